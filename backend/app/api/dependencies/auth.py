@@ -1,35 +1,39 @@
+import hmac
 from typing import Optional
 
 from app.api.dependencies.database import get_repository
-from app.core.config import API_PREFIX, SECRET_KEY
+from app.core.config import API_PREFIX, METRICS_TOKEN, SECRET_KEY
 from app.db.repositories.users import UsersRepository
-from app.models.user import UserInDB
+from app.models.user import UserPrincipal
 from app.services import auth_service
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.security import (
+    HTTPAuthorizationCredentials,
+    HTTPBearer,
+    OAuth2PasswordBearer,
+)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{API_PREFIX}/users/login/token")
+metrics_scheme = HTTPBearer(auto_error=False)
 
 
 async def get_user_from_token(
     *,
     token: str = Depends(oauth2_scheme),
     user_repo: UsersRepository = Depends(get_repository(UsersRepository)),
-) -> Optional[UserInDB]:
-    """ """
-    try:
-        username = auth_service.get_username_from_token(
-            token=token, secret_key=str(SECRET_KEY)
-        )
-        user = await user_repo.get_user_by_username(username=username)
-    except Exception as e:
-        raise e
-    return user
+) -> Optional[UserPrincipal]:
+    """
+    トークンを検証し、持ち主のユーザーを返す (ユーザーはキャッシュから取得する)
+    """
+    payload = auth_service.get_token_payload(token=token, secret_key=str(SECRET_KEY))
+    return await user_repo.get_principal(
+        username=payload.username, token_id=payload.jti
+    )
 
 
 def get_current_active_user(
-    current_user: UserInDB = Depends(get_user_from_token),
-) -> Optional[UserInDB]:
+    current_user: UserPrincipal = Depends(get_user_from_token),
+) -> Optional[UserPrincipal]:
     if not current_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -43,3 +47,24 @@ def get_current_active_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     return current_user
+
+
+def require_metrics_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(metrics_scheme),
+) -> None:
+    """
+    METRICS_TOKEN を持つクライアントだけに運用の情報を返す
+
+    METRICS_TOKEN が設定されていない場合は、エンドポイントがないものとして 404 を返す。
+    """
+    token = str(METRICS_TOKEN)
+    if not token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(
+        credentials.credentials.encode(), token.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -1,3 +1,4 @@
+import time
 from typing import Callable, Type
 
 from app.db.repositories.base import BaseRepository
@@ -5,13 +6,43 @@ from databases import Database
 from fastapi import Depends
 from starlette.requests import Request
 
+# 書き込んだクライアントにプライマリで読ませる期限 (UNIX 時刻) を持つクッキー
+READ_YOUR_WRITES_COOKIE = "read_primary_until"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
 
 def get_database(requet: Request) -> Database:
     return requet.app.state._db
 
 
+def wrote_recently(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def get_read_database(request: Request) -> Database:
+    """
+    読み取りに使う DB を返す
+
+    読み取りのリクエストは遅延の小さいレプリカで読む。
+    書き込みのリクエストと、直前に書き込んだクライアントの読み取りはプライマリで読む。
+    """
+    primary = get_database(request)
+    replicas = getattr(request.app.state, "_replicas", None)
+    if replicas is None or request.method not in SAFE_METHODS:
+        return primary
+    if wrote_recently(request):
+        return primary
+    return replicas.choose() or primary
+
+
 def get_repository(Repo_type: Type[BaseRepository]) -> Callable:
-    def get_repo(db: Database = Depends(get_database)) -> Type[BaseRepository]:
-        return Repo_type(db)
+    def get_repo(
+        db: Database = Depends(get_database),
+        read_db: Database = Depends(get_read_database),
+    ) -> Type[BaseRepository]:
+        return Repo_type(db, read_db=read_db)
 
     return get_repo
@@ -0,0 +1,94 @@
+"""
+ETag と条件付きリクエストのヘッダーを扱う依存関係
+
+ハリネズミの ETag は "<id>-<version>" の形式の強い ETag で、
+version は行が更新されるたびに加算される。
+一覧の ETag はテーブル単位の変更カウンタとクエリ文字列から作る。
+圧縮を受け付けるリクエストや MessagePack で返すレスポンスでは、304 も含めて
+同じ値を弱い ETag (W/"...") にして返す。
+"""
+
+import hashlib
+import re
+from typing import List, Optional
+
+from app.models.hedgehog import HedgehogInDB
+from fastapi import Header, HTTPException, Path
+from starlette.status import HTTP_412_PRECONDITION_FAILED
+
+# RFC 9110 の entity-tag (etagc には , も含まれるので、, で分割せずに先頭から読む)
+_ENTITY_TAG_PATTERN = re.compile(r'[ \t]*(?:W/)?"([\x21\x23-\x7e\x80-\xff]*)"[ \t]*')
+
+
+def hedgehog_etag(hedgehog: HedgehogInDB) -> str:
+    return f'"{hedgehog.id}-{hedgehog.version}"'
+
+
+def hedgehogs_list_etag(table_version: int, query: str) -> str:
+    # ページ指定ごとに表現が異なるので、クエリ文字列も ETag に含める
+    digest = hashlib.sha1(query.encode()).hexdigest()[:16]
+    return f'"list-{table_version}-{digest}"'
+
+
+def parse_entity_tags(header: str) -> Optional[List[str]]:
+    """
+    If-Match / If-None-Match の値を ETag の一覧にする
+
+    W/ は取り除いて引用符付きの値だけを返す。ETag が1つもない場合と形式が不正な場合は None を返す (* は呼び出し側で扱う)。
+    """
+    tags: List[str] = []
+    position = 0
+    while position < len(header):
+        # 空の要素 (", ,") は読み飛ばす
+        if header[position] in " \t,":
+            position += 1
+            continue
+        match = _ENTITY_TAG_PATTERN.match(header, position)
+        if match is None:
+            return None
+        position = match.end()
+        if position < len(header) and header[position] != ",":
+            return None
+        tags.append(f'"{match.group(1)}"')
+    return tags or None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match のいずれかの ETag が一致するかを弱い比較で判定する
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # 形式が不正な場合は、ヘッダーがない場合と同じように扱う
+    return etag in (parse_entity_tags(if_none_match) or [])
+
+
+def get_if_match_versions(
+    id: int = Path(...),
+    if_match: Optional[str] = Header(None),
+) -> Optional[List[int]]:
+    """
+    If-Match ヘッダーの ETag から、更新してよいバージョンの一覧を取り出す
+
+    ヘッダーがない場合と * の場合は None を返し、バージョンを確認しない。
+    別の行の ETag は無視するので、一致する ETag がなければ空のリストになり 412 を返す。
+    If-Match は強い比較だが、W/ の ETag もこのサーバーが強い ETag と同じ値から作ったものなので、
+    同じバージョンとして受け付ける。形式が不正な場合は 412 を返す。
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+
+    tags = parse_entity_tags(if_match)
+    if tags is None:
+        raise HTTPException(
+            status_code=HTTP_412_PRECONDITION_FAILED,
+            detail="Invalid If-Match header.",
+        )
+    versions = []
+    for tag in tags:
+        etag_id, _, version = tag.strip('"').partition("-")
+        if etag_id == str(id) and version.isdigit():
+            versions.append(int(version))
+    return versions
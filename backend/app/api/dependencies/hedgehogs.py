@@ -0,0 +1,30 @@
+from typing import Optional
+
+from app.models.hedgehog import ColorType, HedgehogFilter
+from fastapi import HTTPException, Query, status
+
+
+def get_hedgehog_filter(
+    color_type: Optional[ColorType] = Query(None),
+    min_age: Optional[float] = Query(None, ge=0),
+    max_age: Optional[float] = Query(None, ge=0),
+    name_prefix: Optional[str] = Query(None, min_length=1, max_length=100),
+    name_contains: Optional[str] = Query(
+        None,
+        min_length=3,
+        max_length=100,
+        description="部分一致 (大文字小文字を区別しない)。トライグラム索引を使うため3文字以上",
+    ),
+) -> HedgehogFilter:
+    if min_age is not None and max_age is not None and min_age > max_age:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="min_age must not be greater than max_age.",
+        )
+    return HedgehogFilter(
+        color_type=color_type,
+        min_age=min_age,
+        max_age=max_age,
+        name_prefix=name_prefix,
+        name_contains=name_contains,
+    )
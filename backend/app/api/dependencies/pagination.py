@@ -0,0 +1,73 @@
+"""
+カーソルページネーションの依存関係
+
+カーソルはクライアントにとって不透明な文字列で、
+中身は最後に返した行のキーを JSON にして base64url でエンコードしたもの。
+"""
+
+import base64
+import binascii
+import json
+import math
+from typing import Any, Dict, Optional
+
+from app.core.config import HEDGEHOGS_MAX_PAGE_SIZE, HEDGEHOGS_PAGE_SIZE
+from app.models.pagination import PageParams
+from fastapi import HTTPException, Query, status
+
+# カーソルの id は INTEGER の主キーなので、この範囲の外は受け付けない
+MAX_CURSOR_ID = 2**31 - 1
+
+
+def encode_cursor(key: Dict[str, Any]) -> str:
+    raw = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        key = None
+    if not isinstance(key, dict):
+        raise invalid_cursor()
+    return key
+
+
+def invalid_cursor() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid pagination cursor.",
+    )
+
+
+def get_cursor_id(key: Dict[str, Any]) -> int:
+    """
+    カーソルから id を取り出す (bool や INTEGER の範囲外の値は 400)
+    """
+    value = key.get("id")
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise invalid_cursor()
+    if not 1 <= value <= MAX_CURSOR_ID:
+        raise invalid_cursor()
+    return value
+
+
+def get_cursor_rank(key: Dict[str, Any]) -> float:
+    """
+    カーソルから検索の順位を取り出す (bool や NaN・無限大は 400)
+    """
+    value = key.get("rank")
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise invalid_cursor()
+    if not math.isfinite(value):
+        raise invalid_cursor()
+    return float(value)
+
+
+def get_page_params(
+    limit: int = Query(HEDGEHOGS_PAGE_SIZE, ge=1, le=HEDGEHOGS_MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="前のページで返されたカーソル"),
+) -> PageParams:
+    return PageParams(limit=limit, after=decode_cursor(after) if after else {})
@@ -0,0 +1,82 @@
+import ipaddress
+import math
+
+from app.api.dependencies.database import get_repository
+from app.core.config import (
+    LOGIN_RATE_LIMIT_ACCOUNT_BURST,
+    LOGIN_RATE_LIMIT_ACCOUNT_PER_MINUTE,
+    LOGIN_RATE_LIMIT_IP_BURST,
+    LOGIN_RATE_LIMIT_IP_PER_MINUTE,
+    TRUSTED_PROXIES,
+)
+from app.db.repositories.rate_limits import RateLimitsRepository
+from app.models.rate_limit import RateLimit
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+
+TRUSTED_PROXY_NETWORKS = [
+    ipaddress.ip_network(proxy, strict=False) for proxy in TRUSTED_PROXIES
+]
+
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXY_NETWORKS)
+
+
+def get_client_ip(request: Request) -> str:
+    """
+    レート制限に使うクライアントの IP アドレスを返す
+
+    接続元が信頼するプロキシ (TRUSTED_PROXIES) の場合だけ X-Forwarded-For を右から読み、
+    信頼するプロキシでない最初のアドレスをクライアントとする。
+    それより左はクライアントが自由に書けるので使わない。
+    """
+    client_host = request.client.host if request.client else "unknown"
+    if not is_trusted_proxy(client_host):
+        return client_host
+    forwarded_for = ",".join(request.headers.getlist("x-forwarded-for"))
+    addresses = [address.strip() for address in forwarded_for.split(",")]
+    for address in reversed([address for address in addresses if address]):
+        if not is_trusted_proxy(address):
+            return address
+        client_host = address
+    return client_host
+
+
+async def limit_login_attempts(
+    request: Request,
+    form_data: OAuth2PasswordRequestForm = Depends(OAuth2PasswordRequestForm),
+    rate_limits_repo: RateLimitsRepository = Depends(
+        get_repository(RateLimitsRepository)
+    ),
+) -> None:
+    """
+    ログインの試行を IP ごと・アカウントごとに制限する
+
+    DB の検索やパスワードの検証より前に判定し、超えていれば 429 を返す。
+    """
+    client_host = get_client_ip(request)
+    result = await rate_limits_repo.take_tokens(
+        limits=[
+            RateLimit(
+                key=f"login:ip:{client_host}",
+                capacity=LOGIN_RATE_LIMIT_IP_BURST,
+                refill_per_second=LOGIN_RATE_LIMIT_IP_PER_MINUTE / 60,
+            ),
+            RateLimit(
+                key=f"login:account:{form_data.username.strip().lower()}",
+                capacity=LOGIN_RATE_LIMIT_ACCOUNT_BURST,
+                refill_per_second=LOGIN_RATE_LIMIT_ACCOUNT_PER_MINUTE / 60,
+            ),
+        ]
+    )
+    if not result.allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts. Please try again later.",
+            headers={"Retry-After": str(max(1, math.ceil(result.retry_after)))},
+        )
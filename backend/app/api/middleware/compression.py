@@ -0,0 +1,323 @@
+"""
+Accept-Encoding に応じてレスポンスを圧縮するミドルウェア
+
+gzip は常に使える。brotli と zstd は、それぞれ brotli / zstandard のパッケージが
+インストールされている場合だけ使う。クライアントが同じ q 値で複数受け付ける場合は
+br, zstd, gzip の順に選ぶ。
+minimum_size 未満のレスポンスは圧縮しない (ヘッダーの分だけ大きくなり、CPU も無駄になる)。
+ストリーミングのレスポンスは大きさが分からないので、最初のチャンクから
+チャンクごとに圧縮してすぐに送り出す (溜めると最初のバイトが届くのが遅れる)。
+圧縮にかかった CPU 時間は符号化ごとに集計し、/api/metrics/ で返す。
+"""
+
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 圧縮して効果のあるメディアタイプ (前方一致)。画像や圧縮済みの形式は含めない
+COMPRESSIBLE_MEDIA_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+class GzipCompressor:
+    def __init__(self, level: int) -> None:
+        # wbits に 16 を足すと gzip のヘッダーとトレーラーを付ける
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        # 受け取った分はすぐにクライアントが展開できるようにフラッシュする
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, level: int) -> None:
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self, level: int) -> None:
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+def available_encodings() -> List[str]:
+    """
+    使える符号化を優先順に返す
+    """
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+
+COMPRESSORS: Dict[str, Callable[[int], Any]] = {
+    "br": BrotliCompressor,
+    "zstd": ZstdCompressor,
+    "gzip": GzipCompressor,
+}
+
+
+def choose_encoding(accept_encoding: str, encodings: Sequence[str]) -> Optional[str]:
+    """
+    Accept-Encoding から使う符号化を選ぶ (どれも受け付けなければ None)
+
+    q 値の大きいものを選び、同じ q 値なら encodings の順で選ぶ。q=0 は拒否を表す。
+    """
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if coding == "x-gzip":
+            coding = "gzip"
+        weight = 1.0
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                weight = float(value)
+            except ValueError:
+                continue
+        if coding:
+            weights[coding] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def is_compressible(headers: Headers) -> bool:
+    media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    return (
+        media_type.startswith(COMPRESSIBLE_MEDIA_TYPES) or media_type.endswith("+json")
+    ) and "no-transform" not in headers.get("cache-control", "")
+
+
+class CompressionStats:
+    """
+    符号化ごとの圧縮の件数・バイト数・CPU 時間の集計 (ワーカーごと)
+    """
+
+    def __init__(self) -> None:
+        self.skipped_below_minimum = 0
+        self._totals: Dict[str, Dict[str, float]] = {}
+
+    def record(
+        self, encoding: str, *, bytes_in: int, bytes_out: int, cpu_seconds: float
+    ) -> None:
+        totals = self._totals.setdefault(
+            encoding,
+            {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0},
+        )
+        totals["responses"] += 1
+        totals["bytes_in"] += bytes_in
+        totals["bytes_out"] += bytes_out
+        totals["cpu_seconds"] += cpu_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        encodings = {}
+        for encoding, totals in self._totals.items():
+            bytes_in = totals["bytes_in"]
+            encodings[encoding] = {
+                **totals,
+                "ratio": totals["bytes_out"] / bytes_in if bytes_in else None,
+                "cpu_ns_per_byte": (
+                    totals["cpu_seconds"] * 1e9 / bytes_in if bytes_in else None
+                ),
+            }
+        return {
+            "available_encodings": available_encodings(),
+            "skipped_below_minimum": self.skipped_below_minimum,
+            "encodings": encodings,
+        }
+
+
+compression_stats = CompressionStats()
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        minimum_size: int,
+        levels: Dict[str, int],
+        stats: CompressionStats = compression_stats,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = levels
+        self.stats = stats
+        self.encodings = [
+            encoding for encoding in available_encodings() if encoding in levels
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = None
+        if scope["method"] != "HEAD":
+            accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+            encoding = choose_encoding(accept_encoding, self.encodings)
+        responder = CompressionResponder(self, send, encoding)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    """
+    1つのレスポンスの送信を仲介し、必要であれば圧縮して送る
+    """
+
+    def __init__(
+        self, middleware: CompressionMiddleware, send: Send, encoding: Optional[str]
+    ) -> None:
+        self.middleware = middleware
+        self._send = send
+        self.encoding = encoding
+        # 本文を仲介する (圧縮するか、大きさを確かめる) 場合は True
+        self.pending = False
+        self.start_message: Optional[Message] = None
+        self.compressor: Any = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            await self._start(message)
+        elif message["type"] == "http.response.body" and self.pending:
+            await self._body(message)
+        else:
+            await self._send(message)
+
+    async def _start(self, message: Message) -> None:
+        headers = MutableHeaders(scope=message)
+        status = message["status"]
+        if self.encoding is not None:
+            # 圧縮を受け付けるリクエストには、本文が小さく圧縮しなかった場合や
+            # 304 の場合も弱い ETag を返し、ステータスや大きさによって ETag が変わらないようにする
+            self._weaken_etag(headers)
+            if status == 304:
+                headers.add_vary_header("Accept-Encoding")
+        if (
+            status < 200
+            or status in (204, 304)
+            or "content-encoding" in headers
+            or not is_compressible(headers)
+        ):
+            await self._send(message)
+            return
+        # 圧縮するかどうかは Accept-Encoding で変わるので、キャッシュに知らせる
+        headers.add_vary_header("Accept-Encoding")
+        if self.encoding is None:
+            await self._send(message)
+            return
+        self.pending = True
+        self.start_message = message
+
+    async def _body(self, message: Message) -> None:
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            # 1回で送られる本文だけ大きさで判断する。ストリーミングは溜めずにすぐ圧縮する
+            if not more_body and len(body) < self.middleware.minimum_size:
+                self.middleware.stats.skipped_below_minimum += 1
+                self.pending = False
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+            self._begin_compression()
+
+        compressed = self._compress(body, more_body)
+        if self.start_message is not None:
+            headers = MutableHeaders(scope=self.start_message)
+            if more_body:
+                # 全体の大きさは分からないので chunked で送る
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(compressed))
+            await self._send(self.start_message)
+            self.start_message = None
+        if compressed or not more_body:
+            await self._send(
+                {
+                    "type": "http.response.body",
+                    "body": compressed,
+                    "more_body": more_body,
+                }
+            )
+
+    def _begin_compression(self) -> None:
+        headers = MutableHeaders(scope=self.start_message)
+        headers["Content-Encoding"] = self.encoding
+        self.compressor = COMPRESSORS[self.encoding](
+            self.middleware.levels[self.encoding]
+        )
+
+    @staticmethod
+    def _weaken_etag(headers: MutableHeaders) -> None:
+        etag = headers.get("etag")
+        if etag is not None and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+
+    def _compress(self, body: bytes, more_body: bool) -> bytes:
+        started_at = time.thread_time()
+        if more_body:
+            compressed = self.compressor.compress(body)
+        else:
+            compressed = self.compressor.finish(body)
+        self.cpu_seconds += time.thread_time() - started_at
+        self.bytes_in += len(body)
+        self.bytes_out += len(compressed)
+        if not more_body:
+            self.middleware.stats.record(
+                self.encoding,
+                bytes_in=self.bytes_in,
+                bytes_out=self.bytes_out,
+                cpu_seconds=self.cpu_seconds,
+            )
+        return compressed
@@ -0,0 +1,56 @@
+"""
+書き込んだクライアントが直後の読み取りで自分の書き込みを読めるようにするミドルウェア
+
+書き込みのリクエストが成功したら、しばらくの間プライマリで読むためのクッキーを返す。
+クッキーの期限はクライアントが持つので、複数ワーカーでも同じように振り分けられる。
+"""
+
+import math
+import time
+
+from app.api.dependencies.database import READ_YOUR_WRITES_COOKIE, SAFE_METHODS
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+def read_your_writes_window(
+    window_seconds: float, *, replica_max_lag: float, replica_check_interval: float
+) -> float:
+    """
+    書き込んだクライアントがプライマリで読む秒数を返す
+
+    使われるレプリカの遅延は測った時点で replica_max_lag 以下だが、
+    次に測るまでの replica_check_interval の間にさらに遅れうる。
+    それより短いと、期間が終わった直後にレプリカで自分の書き込み前の行を読みうるので、
+    少なくともその合計の秒数にする。
+    """
+    return max(window_seconds, replica_max_lag + replica_check_interval)
+
+
+class ReadYourWritesMiddleware:
+    def __init__(self, app: ASGIApp, *, window_seconds: float) -> None:
+        self.app = app
+        self.window_seconds = window_seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            if (
+                message["type"] == "http.response.start"
+                and message["status"] < 400
+                and getattr(scope["app"].state, "_replicas", None) is not None
+            ):
+                read_primary_until = time.time() + self.window_seconds
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Set-Cookie",
+                    f"{READ_YOUR_WRITES_COOKIE}={read_primary_until:.3f}; "
+                    f"Max-Age={math.ceil(self.window_seconds)}; Path=/; "
+                    "HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -1,12 +1,99 @@
-from typing import List
+import csv
+import io
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 from app.api.dependencies.database import get_repository
+from app.api.dependencies.etag import (
+    etag_matches,
+    get_if_match_versions,
+    hedgehog_etag,
+    hedgehogs_list_etag,
+)
+from app.api.dependencies.hedgehogs import get_hedgehog_filter
+from app.api.dependencies.pagination import (
+    encode_cursor,
+    get_cursor_id,
+    get_cursor_rank,
+    get_page_params,
+)
+from app.api.routing import MessagePackRoute
+from app.core.config import HEDGEHOGS_BULK_MAX_ROWS, HEDGEHOGS_EXPORT_BATCH_SIZE
 from app.db.repositories.hedgehogs import HedgehogsRepository
-from app.models.hedgehog import HedgehogCreate, HedgehogPublic, HedgehogUpdate
-from fastapi import APIRouter, Body, Depends, HTTPException, Path
-from starlette.status import HTTP_201_CREATED, HTTP_404_NOT_FOUND
+from app.models.hedgehog import (
+    HedgehogBulkCreatedRow,
+    HedgehogBulkCreateResult,
+    HedgehogBulkRowError,
+    HedgehogCreate,
+    HedgehogExportFormat,
+    HedgehogFilter,
+    HedgehogInDB,
+    HedgehogPublic,
+    HedgehogSearchResult,
+    HedgehogStats,
+    HedgehogUpdate,
+)
+from app.models.pagination import PageParams
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    Header,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from starlette.status import (
+    HTTP_201_CREATED,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_400_BAD_REQUEST,
+    HTTP_404_NOT_FOUND,
+    HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+)
+
+router = APIRouter(route_class=MessagePackRoute)
+
+EXPORT_MEDIA_TYPES = {
+    HedgehogExportFormat.ndjson: "application/x-ndjson",
+    HedgehogExportFormat.json: "application/json",
+}
+
 
-router = APIRouter()
+async def encode_hedgehogs_stream(
+    hedgehogs: AsyncIterator[HedgehogInDB],
+    *,
+    export_format: HedgehogExportFormat,
+    batch_size: int,
+) -> AsyncIterator[bytes]:
+    """
+    ハリネズミを NDJSON または JSON 配列として batch_size 行ずつ書き出す
+    """
+    is_ndjson = export_format == HedgehogExportFormat.ndjson
+    if not is_ndjson:
+        # 最初のバイトをすぐに返すため、配列の開き括弧は先に送る
+        yield b"["
+
+    chunk = bytearray()
+    written = 0
+    async for hedgehog in hedgehogs:
+        if not is_ndjson and written:
+            chunk += b","
+        chunk += hedgehog.model_dump_json(exclude={"version"}).encode()
+        if is_ndjson:
+            chunk += b"\n"
+        written += 1
+        if written % batch_size == 0:
+            yield bytes(chunk)
+            chunk.clear()
+
+    if not is_ndjson:
+        chunk += b"]"
+    if chunk:
+        yield bytes(chunk)
 
 
 @router.get(
@@ -15,9 +102,193 @@ router = APIRouter()
     name="hedgehogs:get-all-hedgehogs",
 )
 async def get_all_hedgehogs(
+    request: Request,
+    response: Response,
+    page: PageParams = Depends(get_page_params),
+    filters: HedgehogFilter = Depends(get_hedgehog_filter),
+    include_total: bool = Query(False, description="行数の概算をヘッダーで返す"),
+    if_none_match: Optional[str] = Header(None),
     hedgehogs_repo: HedgehogsRepository = Depends(get_repository(HedgehogsRepository)),
 ) -> List[HedgehogPublic]:
-    return await hedgehogs_repo.get_all_hedgehogs()
+    """
+    ハリネズミを id の昇順でページ単位に返す
+
+    color_type / min_age / max_age / name_prefix / name_contains で絞り込める。
+    次のページがある場合は X-Next-Cursor と Link ヘッダーにカーソルを載せる。
+    テーブルが変更されていなければ、一覧を取得せずに 304 を返す。
+    """
+    after_id = get_cursor_id(page.after) if page.after else None
+
+    # 一覧より先にカウンタを読むので、ETag が本文より新しくなることはない
+    table_version = await hedgehogs_repo.get_hedgehogs_table_version()
+    etag = hedgehogs_list_etag(table_version, request.url.query)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    # 1件多く取得して次のページの有無を判定する
+    hedgehogs = await hedgehogs_repo.get_all_hedgehogs(
+        limit=page.limit + 1, after_id=after_id, filters=filters
+    )
+    if len(hedgehogs) > page.limit:
+        hedgehogs = hedgehogs[: page.limit]
+        next_cursor = encode_cursor({"id": hedgehogs[-1].id})
+        next_url = request.url.include_query_params(limit=page.limit, after=next_cursor)
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+
+    if include_total:
+        total = await hedgehogs_repo.get_approximate_hedgehogs_count()
+        response.headers["X-Total-Count-Estimate"] = str(total)
+    return hedgehogs
+
+
+def parse_csv_rows(content: bytes) -> List[Dict[str, Any]]:
+    """
+    ヘッダー行付きの CSV を辞書のリストにする (空のセルは None として扱う)
+    """
+    try:
+        reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+        return [
+            {key: (value if value != "" else None) for key, value in row.items()}
+            for row in reader
+        ]
+    except (UnicodeDecodeError, csv.Error):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid CSV.")
+
+
+async def read_bulk_rows(request: Request) -> List[Dict[str, Any]]:
+    """
+    JSON・MessagePack の配列、text/csv の本文、または multipart の file フィールドから行を読み出す
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        upload = (await request.form()).get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST, detail="CSV file is required."
+            )
+        return parse_csv_rows(await upload.read())
+    if content_type.startswith("text/csv"):
+        return parse_csv_rows(await request.body())
+
+    try:
+        # MessagePack の本文も MessagePackRequest.json() で同じように読める
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid JSON.")
+    if isinstance(payload, dict):
+        payload = payload.get("new_hedgehogs")
+    if not isinstance(payload, list):
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail="Expected a list of hedgehogs.",
+        )
+    return payload
+
+
+def validate_bulk_rows(
+    rows: List[Any],
+) -> Tuple[List[Tuple[int, HedgehogCreate]], List[HedgehogBulkRowError]]:
+    """
+    全行を1回の走査で検証し、有効な行 (行番号との組) と行ごとのエラーに分ける
+    """
+    valid: List[Tuple[int, HedgehogCreate]] = []
+    errors: List[HedgehogBulkRowError] = []
+    for row_number, row in enumerate(rows, start=1):
+        try:
+            hedgehog = HedgehogCreate.model_validate(row)
+        except ValidationError as e:
+            messages = [
+                f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+                for error in e.errors()
+            ]
+            errors.append(HedgehogBulkRowError(row=row_number, errors=messages))
+            continue
+        # age は DB 上 NOT NULL なので、INSERT 前に行単位で弾く
+        if hedgehog.age is None:
+            errors.append(
+                HedgehogBulkRowError(row=row_number, errors=["age: Field required"])
+            )
+            continue
+        valid.append((row_number, hedgehog))
+    return valid, errors
+
+
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    name="hedgehogs:export-hedgehogs",
+)
+async def export_hedgehogs(
+    export_format: HedgehogExportFormat = Query(
+        HedgehogExportFormat.ndjson, alias="format"
+    ),
+    hedgehogs_repo: HedgehogsRepository = Depends(get_repository(HedgehogsRepository)),
+) -> StreamingResponse:
+    """
+    全件をサーバーサイドカーソルから読み出してストリーミングで返す
+
+    行をまとめてメモリに載せないので、テーブルの大きさに関わらずメモリ使用量は一定。
+    """
+    return StreamingResponse(
+        encode_hedgehogs_stream(
+            hedgehogs_repo.iterate_all_hedgehogs(),
+            export_format=export_format,
+            batch_size=HEDGEHOGS_EXPORT_BATCH_SIZE,
+        ),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+    )
+
+
+@router.get(
+    "/search",
+    response_model=List[HedgehogSearchResult],
+    name="hedgehogs:search-hedgehogs",
+)
+async def search_hedgehogs(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200, description="検索語"),
+    page: PageParams = Depends(get_page_params),
+    hedgehogs_repo: HedgehogsRepository = Depends(get_repository(HedgehogsRepository)),
+) -> List[HedgehogSearchResult]:
+    """
+    名前と説明を全文検索し、関連度の高い順に返す
+
+    q は websearch_to_tsquery の書式 ("..." でフレーズ、-語 で除外、or) で解釈する。
+    次のページがある場合は X-Next-Cursor と Link ヘッダーにカーソルを載せる。
+    """
+    after = None
+    if page.after:
+        after = (get_cursor_rank(page.after), get_cursor_id(page.after))
+
+    results = await hedgehogs_repo.search_hedgehogs(
+        q=q, limit=page.limit + 1, after=after
+    )
+    if len(results) > page.limit:
+        results = results[: page.limit]
+        next_cursor = encode_cursor({"rank": results[-1].rank, "id": results[-1].id})
+        next_url = request.url.include_query_params(limit=page.limit, after=next_cursor)
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return results
+
+
+@router.get(
+    "/stats",
+    response_model=HedgehogStats,
+    name="hedgehogs:get-hedgehog-stats",
+)
+async def get_hedgehog_stats(
+    hedgehogs_repo: HedgehogsRepository = Depends(get_repository(HedgehogsRepository)),
+) -> HedgehogStats:
+    """
+    color_type ごとの件数、1歳刻みの年齢のヒストグラム、合計と平均年齢を返す
+
+    書き込みのたびに更新される集計テーブルから読むので、テーブルの大きさによらず軽い。
+    """
+    return await hedgehogs_repo.get_hedgehog_stats()
 
 
 @router.post(
@@ -34,41 +305,130 @@ async def create_new_hedgehog(
     return created_hedgehog
 
 
+@router.post(
+    "/bulk",
+    response_model=HedgehogBulkCreateResult,
+    name="hedgehogs:bulk-create-hedgehogs",
+    status_code=HTTP_201_CREATED,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/HedgehogCreate"},
+                    }
+                },
+                "application/msgpack": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/HedgehogCreate"},
+                    }
+                },
+                "text/csv": {"schema": {"type": "string"}},
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {"file": {"type": "string", "format": "binary"}},
+                    }
+                },
+            },
+        }
+    },
+)
+async def bulk_create_hedgehogs(
+    request: Request,
+    skip_invalid: bool = Query(False, description="無効な行を飛ばして残りを登録する"),
+    hedgehogs_repo: HedgehogsRepository = Depends(get_repository(HedgehogsRepository)),
+) -> HedgehogBulkCreateResult:
+    """
+    ハリネズミを一括で登録するエンドポイント
+
+    既定では1行でも無効なら何も登録せず、行ごとのエラーを 422 で返す。
+    """
+    rows = await read_bulk_rows(request)
+    if len(rows) > HEDGEHOGS_BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {HEDGEHOGS_BULK_MAX_ROWS} rows can be created at once.",
+        )
+
+    valid_rows, errors = validate_bulk_rows(rows)
+    if errors and not skip_invalid:
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=[error.model_dump() for error in errors],
+        )
+
+    ids = []
+    if valid_rows:
+        ids = await hedgehogs_repo.bulk_create_hedgehogs(
+            new_hedgehogs=[hedgehog for _, hedgehog in valid_rows]
+        )
+    created = [
+        HedgehogBulkCreatedRow(row=row_number, id=hedgehog_id)
+        for (row_number, _), hedgehog_id in zip(valid_rows, ids)
+    ]
+    return HedgehogBulkCreateResult(ids=ids, created=created, errors=errors)
+
+
 @router.get("/{id}", response_model=HedgehogPublic, name="hedgehogs:get-hedgehog-by-id")
 async def get_hedgehog_by_id(
     id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     hedgehogs_repo: HedgehogsRepository = Depends(get_repository(HedgehogsRepository)),
 ) -> HedgehogPublic:
     hedgehog = await hedgehogs_repo.get_hedgehog_by_id(id=id)
     if not hedgehog:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Hedgehog not found")
+    etag = hedgehog_etag(hedgehog)
+    if etag_matches(if_none_match, etag):
+        # 変更がなければシリアライズせずに返す
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return hedgehog
 
 
 @router.put(
     "/{id}/", response_model=HedgehogPublic, name="hedgehogs:update-hedgehog-by-id"
 )
+@router.patch(
+    "/{id}/", response_model=HedgehogPublic, name="hedgehogs:patch-hedgehog-by-id"
+)
 async def update_hedgehog_by_id(
+    response: Response,
     id: int = Path(..., ge=1, title="The ID of the hedgehog to update."),
     hedgehog_update: HedgehogUpdate = Body(..., embed=True),
+    expected_versions: Optional[List[int]] = Depends(get_if_match_versions),
     hedgehogs_repo: HedgehogsRepository = Depends(get_repository(HedgehogsRepository)),
 ) -> HedgehogPublic:
+    """
+    送られてきた項目だけを更新する
+
+    If-Match に ETag を指定すると、他の更新と競合した場合に 412 を返す。
+    """
     updated_hedgehog = await hedgehogs_repo.update_hedgehog(
-        id=id, hedgehog_update=hedgehog_update
+        id=id, hedgehog_update=hedgehog_update, expected_versions=expected_versions
     )
     if not updated_hedgehog:
         raise HTTPException(
             status_code=HTTP_404_NOT_FOUND, detail="Hedgehog not found with that id"
         )
+    response.headers["ETag"] = hedgehog_etag(updated_hedgehog)
     return updated_hedgehog
 
 
 @router.delete("/{id}/", response_model=int, name="hedgehogs:delete-hedgehog-by-id")
 async def delete_hedgehog_by_id(
     id: int = Path(..., ge=1, title="The ID of the hedgehog to delete."),
+    expected_versions: Optional[List[int]] = Depends(get_if_match_versions),
     hedgehogs_repo: HedgehogsRepository = Depends(get_repository(HedgehogsRepository)),
 ) -> int:
-    delete_id = await hedgehogs_repo.delete_hedgehog(id=id)
+    delete_id = await hedgehogs_repo.delete_hedgehog_by_id(
+        id=id, expected_versions=expected_versions
+    )
     if not delete_id:
         raise HTTPException(
             status_code=HTTP_404_NOT_FOUND, detail="Hedgehog not found with that id"
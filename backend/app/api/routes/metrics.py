@@ -0,0 +1,36 @@
+from typing import Any, Dict
+
+from app.api.dependencies.auth import require_metrics_token
+from app.api.dependencies.database import get_database
+from app.api.middleware.compression import compression_stats
+from app.db.cache import repository_cache
+from app.services.password_hashing import password_hashing_pool
+from databases import Database
+from fastapi import APIRouter, Depends, Request
+
+router = APIRouter()
+
+
+@router.get(
+    "/",
+    response_model=Dict[str, Any],
+    name="metrics:get-metrics",
+    dependencies=[Depends(require_metrics_token)],
+)
+async def get_metrics(
+    request: Request, db: Database = Depends(get_database)
+) -> Dict[str, Any]:
+    """
+    このワーカーのコネクションプール・レプリカ・キャッシュ・ハッシュ化のプール・圧縮の状態を返す
+
+    値はワーカーごとに集計されるので、複数ワーカーの場合はワーカーごとに取得する。
+    METRICS_TOKEN を Bearer トークンとして送る必要がある。
+    """
+    replicas = getattr(request.app.state, "_replicas", None)
+    return {
+        "db_pool": db.pool_stats() if hasattr(db, "pool_stats") else {},
+        "db_replicas": replicas.stats() if replicas is not None else {},
+        "repository_cache": repository_cache.stats(),
+        "password_hashing": password_hashing_pool.stats(),
+        "compression": compression_stats.stats(),
+    }
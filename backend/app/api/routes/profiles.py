@@ -1,11 +1,12 @@
 from app.api.dependencies.auth import get_current_active_user
 from app.api.dependencies.database import get_repository
+from app.api.routing import MessagePackRoute
 from app.db.repositories.profiles import ProfilesRepository
-from app.models.profile import ProfileCreate, ProfileInDB, ProfilePublic
-from app.models.user import UserCreate, UserInDB, UserPublic, UserUpdate
+from app.models.profile import ProfileInDB, ProfilePublic, ProfileUpdate
+from app.models.user import UserCreate, UserPrincipal, UserPublic, UserUpdate
 from fastapi import APIRouter, Body, Depends, HTTPException, Path, status
 
-router = APIRouter()
+router = APIRouter(route_class=MessagePackRoute)
 
 
 @router.get(
@@ -15,7 +16,7 @@ router = APIRouter()
 )
 async def get_profile_by_username(
     username: str = Path(..., min_length=3, regex="^[a-zA-Z0-9_-]+$"),
-    current_user: UserInDB = Depends(get_current_active_user),
+    current_user: UserPrincipal = Depends(get_current_active_user),
     profiles_repo: ProfilesRepository = Depends(get_repository(ProfilesRepository)),
 ) -> ProfilePublic:
     profile = await profiles_repo.get_profile_by_username(username=username)
@@ -29,8 +30,8 @@ async def get_profile_by_username(
 
 @router.put("/me/", response_model=ProfilePublic, name="profiles:update-own-profile")
 async def update_own_profile(
-    profile_update: ProfileCreate = Body(..., embed=True),
-    current_user: UserInDB = Depends(get_current_active_user),
+    profile_update: ProfileUpdate = Body(..., embed=True),
+    current_user: UserPrincipal = Depends(get_current_active_user),
     profiles_repo: ProfilesRepository = Depends(get_repository(ProfilesRepository)),
 ) -> ProfilePublic:
     """
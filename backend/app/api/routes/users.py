@@ -1,14 +1,16 @@
 from app.api.dependencies.auth import get_current_active_user
 from app.api.dependencies.database import get_repository
+from app.api.dependencies.rate_limit import limit_login_attempts
+from app.api.routing import TrustedResponseRoute
 from app.db.repositories.users import UsersRepository
 from app.models.token import AccessToken
-from app.models.user import UserCreate, UserInDB, UserPublic, UserUpdate
+from app.models.user import UserCreate, UserPrincipal, UserPublic, UserUpdate
 from app.services import auth_service
 from fastapi import APIRouter, Body, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from starlette.status import HTTP_201_CREATED
 
-router = APIRouter()
+router = APIRouter(route_class=TrustedResponseRoute)
 
 
 @router.post(
@@ -30,7 +32,10 @@ async def register_new_user(
 
 
 @router.post(
-    "/login/token", response_model=AccessToken, name="users:login-email-and-password"
+    "/login/token",
+    response_model=AccessToken,
+    name="users:login-email-and-password",
+    dependencies=[Depends(limit_login_attempts)],
 )
 async def user_login_with_email_and_password(
     user_repo: UsersRepository = Depends(get_repository(UsersRepository)),
@@ -38,13 +43,16 @@ async def user_login_with_email_and_password(
 ) -> AccessToken:
     """
     トークン作成のエンドポイント
+
+    試行回数は limit_login_attempts で制限し、超えた場合は 429 を返す。
+    パスワードの検証が混み合っている場合は 503 を返す。
     """
     user = await user_repo.authenticate_user(
         email=form_data.username, password=form_data.password
     )
     if not user:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
+            status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Authentication was unsuccessful",
             headers={"WWW-Authenticate": "Bearer"},
         )
@@ -57,6 +65,8 @@ async def user_login_with_email_and_password(
 
 @router.get("/me/", response_model=UserPublic, name="users:get-current-user")
 async def get_currenctly_authenticated_user(
-    current_user: UserInDB = Depends(get_current_active_user),
+    current_user: UserPrincipal = Depends(get_current_active_user),
+    user_repo: UsersRepository = Depends(get_repository(UsersRepository)),
 ) -> UserPublic:
-    return current_user
+    # 認証ではプロフィールを取得しないので、ここで必要な分だけ取得する
+    return await user_repo.populate_user(user=current_user)
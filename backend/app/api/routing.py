@@ -0,0 +1,358 @@
+"""
+response_model の検証をやり直さずにレスポンスを返すルート
+
+FastAPI の既定の経路では、エンドポイントが返したモデルを一旦 dict にし、
+response_model で検証し直してから jsonable_encoder と json.dumps で文字列にする。
+リポジトリが返すモデルは DB から組み立てた信頼できる値なので、
+TrustedResponseRoute は response_model の型に詰め替えるだけにして (hydrate)、
+pydantic-core で1回だけ JSON のバイト列にする。
+ルートの response_model はそのまま残すので、OpenAPI のスキーマは変わらない。
+
+MessagePackRoute は、同じモデルを Accept に応じて MessagePack でも返し、
+Content-Type が MessagePack の本文も JSON と同じように受け付ける。
+"""
+
+import asyncio
+from copy import copy
+from enum import Enum
+from functools import lru_cache
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Type,
+    get_args,
+    get_origin,
+)
+
+import msgpack
+from app.db.hydration import hydrate
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.routing import APIRoute, get_request_handler
+from fastapi.utils import is_body_allowed_for_status_code
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import to_jsonable_python
+from starlette.types import Receive, Scope
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# 登録前から使われている名前も受け付ける
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+# エンドポイントが Response や Request を引数に取らない場合に、その代わりに使う引数名
+_SUB_RESPONSE_PARAM = "_trusted_sub_response"
+_REQUEST_PARAM = "_trusted_request"
+
+
+def _model_converter(model: Any) -> Callable[[Any], Any]:
+    """
+    エンドポイントが返した値を response_model の型に揃える関数を返す
+
+    モデルのインスタンスは検証せずに詰め替える (余分なフィールドはここで落ちる)。
+    それ以外の値 (dict など) は信頼できないので検証する。
+    """
+    if isinstance(model, type) and issubclass(model, BaseModel):
+        # 同じ型のインスタンスだけそのまま使う (サブクラスは余分なフィールドを持ちうる)
+        return lambda value: (
+            value
+            if type(value) is model
+            else (
+                hydrate(model, value)
+                if isinstance(value, BaseModel)
+                else model.model_validate(value)
+            )
+        )
+    if get_origin(model) in (list, List, Sequence) and get_args(model):
+        (item,) = get_args(model)
+        if isinstance(item, type) and issubclass(item, BaseModel):
+            convert = _model_converter(item)
+            return lambda value: [convert(element) for element in value]
+    return TypeAdapter(model).validate_python
+
+
+def _nested_models(annotation: Any) -> Iterator[Type[BaseModel]]:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        yield annotation
+    for arg in get_args(annotation):
+        yield from _nested_models(arg)
+
+
+@lru_cache(maxsize=None)
+def _directly_packable_models(
+    model: Type[BaseModel],
+) -> Optional[FrozenSet[Type[BaseModel]]]:
+    """
+    __dict__ をそのまま MessagePack にできるモデルの集合を返す (できなければ None)
+
+    独自のシリアライザ・計算フィールド・別名がなく、入れ子のモデルも同じ条件を満たす場合だけ。
+    """
+    decorators = model.__pydantic_decorators__
+    if (
+        decorators.field_serializers
+        or decorators.model_serializers
+        or model.model_computed_fields
+    ):
+        return None
+    models = {model}
+    for field in model.model_fields.values():
+        if field.alias or field.serialization_alias:
+            return None
+        for nested in _nested_models(field.annotation):
+            nested_models = _directly_packable_models(nested)
+            if nested_models is None:
+                return None
+            models |= nested_models
+    return frozenset(models)
+
+
+def _build_msgpack_serializer(
+    response_model: Any, convert: Callable[[Any], Any], adapter: TypeAdapter
+) -> Callable[[Any], bytes]:
+    def serialize_with_pydantic(value: Any) -> bytes:
+        return msgpack.packb(
+            adapter.dump_python(convert(value), mode="json", by_alias=True)
+        )
+
+    is_list = get_origin(response_model) in (list, List, Sequence)
+    item = get_args(response_model)[0] if is_list else response_model
+    if not (isinstance(item, type) and issubclass(item, BaseModel)):
+        return serialize_with_pydantic
+    models = _directly_packable_models(item)
+    if models is None:
+        return serialize_with_pydantic
+
+    def default(value: Any) -> Any:
+        if type(value) in models:
+            return value.__dict__
+        if isinstance(value, Enum):
+            return value.value
+        if isinstance(value, BaseModel):
+            # 宣言と異なる型の入れ子のモデルは pydantic に任せる
+            raise TypeError(type(value))
+        # 日時や URL などは JSON と同じ形の値にする
+        return to_jsonable_python(value)
+
+    def serialize(value: Any) -> bytes:
+        converted = convert(value)
+        # convert で response_model と同じ型に揃えているので、
+        # __dict__ にはそのモデルのフィールドだけが入っている
+        fields = (
+            [instance.__dict__ for instance in converted]
+            if is_list
+            else converted.__dict__
+        )
+        try:
+            return msgpack.packb(fields, default=default)
+        except TypeError:
+            return serialize_with_pydantic(value)
+
+    return serialize
+
+
+@lru_cache(maxsize=None)
+def build_serializer(
+    response_model: Any, media_type: str = JSON_MEDIA_TYPE
+) -> Callable[[Any], bytes]:
+    """
+    response_model ごとに、値を JSON (または MessagePack) のバイト列にする関数を作る
+
+    MessagePack の値は JSON と同じ形 (日時は ISO 8601 の文字列、列挙型は値) にする。
+    pydantic で dict にしてから詰めると JSON の数倍かかるので、
+    モデルの __dict__ を直接 MessagePack にする。
+    """
+    convert = _model_converter(response_model)
+    adapter = TypeAdapter(response_model)
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return _build_msgpack_serializer(response_model, convert, adapter)
+    return lambda value: adapter.dump_json(convert(value), by_alias=True)
+
+
+def _media_range_weights(accept: str) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for part in accept.split(","):
+        media_range, *params = part.split(";")
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        media_range = media_range.strip().lower()
+        if media_range:
+            weights[media_range] = max(weight, weights.get(media_range, 0.0))
+    return weights
+
+
+def accepts_msgpack(accept: str) -> bool:
+    """
+    Accept で MessagePack が JSON と同じかそれ以上に優先されているかを判定する
+
+    MessagePack は明示された場合だけ返す (*/* では JSON を返す)。
+    """
+    weights = _media_range_weights(accept)
+    msgpack_weight = max(
+        weights.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES
+    )
+    if msgpack_weight <= 0:
+        return False
+    json_weight = weights.get(
+        JSON_MEDIA_TYPE, weights.get("application/*", weights.get("*/*", 0.0))
+    )
+    return msgpack_weight >= json_weight
+
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() in MSGPACK_MEDIA_TYPES
+
+
+class MessagePackRequest(Request):
+    """
+    本文が MessagePack のリクエスト
+
+    FastAPI の本文の検証や各ルートが JSON と同じ経路で読めるよう、
+    Content-Type を application/json に見せ、json() で MessagePack を展開した値を返す。
+    """
+
+    def __init__(self, scope: Scope, receive: Receive) -> None:
+        headers = [
+            (name, b"application/json" if name == b"content-type" else value)
+            for name, value in scope["headers"]
+        ]
+        super().__init__({**scope, "headers": headers}, receive)
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            # 形式が不正な場合は ValueError (FastAPI は 400 を返す)
+            self._json = msgpack.unpackb(await self.body())
+        return self._json
+
+
+class TrustedResponseRoute(APIRoute):
+    """
+    response_model を検証し直さず、pydantic-core で直接 JSON にするルート
+
+    APIRouter(route_class=TrustedResponseRoute) で使う。
+    response_model_include などのオプションや独自の response_class を指定したルート、
+    エンドポイントが Response を返した場合は、これまでどおり FastAPI の経路で処理する。
+    """
+
+    # Accept に応じて MessagePack でも返すか (MessagePackRoute で有効にする)
+    msgpack = False
+
+    def _serializes_directly(self) -> bool:
+        return (
+            self.response_model is not None
+            and isinstance(self.response_class, DefaultPlaceholder)
+            and self.response_model_include is None
+            and self.response_model_exclude is None
+            and self.response_model_by_alias
+            and not self.response_model_exclude_unset
+            and not self.response_model_exclude_defaults
+            and not self.response_model_exclude_none
+        )
+
+    def get_route_handler(self) -> Callable:
+        if not self._serializes_directly():
+            return super().get_route_handler()
+
+        # ステータスコードやヘッダーを設定するための Response を必ず受け取る
+        dependant = copy(self.dependant)
+        endpoint = dependant.call
+        is_coroutine = asyncio.iscoroutinefunction(endpoint)
+        passes_sub_response = dependant.response_param_name is not None
+        sub_response_param = dependant.response_param_name or _SUB_RESPONSE_PARAM
+        dependant.response_param_name = sub_response_param
+        # MessagePack で返す場合は Accept を見るために Request も受け取る
+        passes_request = dependant.request_param_name is not None
+        request_param = dependant.request_param_name or _REQUEST_PARAM
+        if self.msgpack:
+            dependant.request_param_name = request_param
+        negotiates = self.msgpack
+        serializers = {
+            JSON_MEDIA_TYPE: build_serializer(self.response_model),
+            MSGPACK_MEDIA_TYPE: build_serializer(
+                self.response_model, MSGPACK_MEDIA_TYPE
+            ),
+        }
+        route_status_code = self.status_code
+
+        async def call(**values: Any) -> Any:
+            if passes_sub_response:
+                sub_response = values[sub_response_param]
+            else:
+                sub_response = values.pop(sub_response_param)
+            media_type = JSON_MEDIA_TYPE
+            if negotiates:
+                if passes_request:
+                    request = values[request_param]
+                else:
+                    request = values.pop(request_param)
+                if accepts_msgpack(request.headers.get("accept", "")):
+                    media_type = MSGPACK_MEDIA_TYPE
+            if is_coroutine:
+                content = await endpoint(**values)
+            else:
+                content = await run_in_threadpool(endpoint, **values)
+            if isinstance(content, Response):
+                response = content
+            else:
+                # FastAPI と同じく、エンドポイントで設定したステータスコードを優先する
+                status_code = sub_response.status_code or route_status_code or 200
+                body = (
+                    serializers[media_type](content)
+                    if is_body_allowed_for_status_code(status_code)
+                    else b""
+                )
+                response = Response(
+                    content=body, status_code=status_code, media_type=media_type
+                )
+                response.headers.raw.extend(sub_response.headers.raw)
+            if negotiates:
+                response.headers.add_vary_header("Accept")
+                # 同じ内容の別の表現なので、強い ETag は弱い ETag にする
+                # (エンドポイントが返した 304 にも、200 と同じ ETag を付ける)
+                etag = response.headers.get("etag")
+                if media_type != JSON_MEDIA_TYPE and etag and not etag.startswith("W/"):
+                    response.headers["ETag"] = f"W/{etag}"
+            return response
+
+        dependant.call = call
+        return get_request_handler(
+            dependant=dependant,
+            body_field=self.body_field,
+            status_code=self.status_code,
+            response_class=self.response_class,
+            response_field=None,
+            dependency_overrides_provider=self.dependency_overrides_provider,
+        )
+
+
+class MessagePackRoute(TrustedResponseRoute):
+    """
+    JSON に加えて MessagePack でもやり取りするルート
+
+    Accept: application/msgpack のリクエストには、同じモデルを MessagePack で返す。
+    Content-Type: application/msgpack の本文は、JSON と同じように検証してエンドポイントに渡す。
+    エラーのレスポンス (HTTPException など) はこれまでどおり JSON で返す。
+    """
+
+    msgpack = True
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def msgpack_handler(request: Request) -> Response:
+            if is_msgpack(request.headers.get("content-type")):
+                request = MessagePackRequest(request.scope, request.receive)
+            return await handler(request)
+
+        return msgpack_handler
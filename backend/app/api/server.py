@@ -1,7 +1,23 @@
+from app.api.middleware.compression import CompressionMiddleware
+from app.api.middleware.read_your_writes import (
+    ReadYourWritesMiddleware,
+    read_your_writes_window,
+)
 from app.api.routes import router as api_router
 from app.core import config, tasks
-from fastapi import FastAPI
+from app.db.pool import PoolTimeout
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+
+
+async def pool_timeout_handler(request: Request, exc: PoolTimeout) -> JSONResponse:
+    # 接続が空くのを待っている間の過負荷なので、少し待って再試行させる
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Timed out waiting for a database connection."},
+        headers={"Retry-After": "1"},
+    )
 
 
 def get_application() -> FastAPI:
@@ -13,6 +29,27 @@ def get_application() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    # レプリカを使う場合、書き込んだクライアントはしばらくプライマリで読む
+    app.add_middleware(
+        ReadYourWritesMiddleware,
+        window_seconds=read_your_writes_window(
+            config.READ_YOUR_WRITES_SECONDS,
+            replica_max_lag=config.REPLICA_MAX_LAG_SECONDS,
+            replica_check_interval=config.REPLICA_LAG_CHECK_INTERVAL_SECONDS,
+        ),
+    )
+    # Accept-Encoding に応じてレスポンスを圧縮する (最後に追加して一番外側で圧縮する)
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=config.COMPRESSION_MINIMUM_SIZE,
+        levels={
+            "br": config.COMPRESSION_BROTLI_QUALITY,
+            "zstd": config.COMPRESSION_ZSTD_LEVEL,
+            "gzip": config.COMPRESSION_GZIP_LEVEL,
+        },
+    )
+
+    app.add_exception_handler(PoolTimeout, pool_timeout_handler)
 
     # イベントハンドラの追加
     app.add_event_handler("startup", tasks.create_start_app_handler(app))
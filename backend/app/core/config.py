@@ -1,8 +1,11 @@
+import os
+
 from databases import DatabaseURL
 from starlette.config import Config
-from starlette.datastructures import Secret
+from starlette.datastructures import CommaSeparatedStrings, Secret
 
-config = Config(".env")
+# .env がない場合は環境変数だけを使う
+config = Config(".env" if os.path.isfile(".env") else None)
 
 PROJECT_NAME = "FastAPI-Docker"
 VERSION = "1.0.0"
@@ -28,3 +31,110 @@ DATABASE_URL = config(
     cast=DatabaseURL,
     default=f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}",
 )
+
+
+# ページネーションの設定
+HEDGEHOGS_PAGE_SIZE = config("HEDGEHOGS_PAGE_SIZE", cast=int, default=100)
+HEDGEHOGS_MAX_PAGE_SIZE = config("HEDGEHOGS_MAX_PAGE_SIZE", cast=int, default=1000)
+
+# エクスポートで1チャンクにまとめる行数
+HEDGEHOGS_EXPORT_BATCH_SIZE = config("HEDGEHOGS_EXPORT_BATCH_SIZE", cast=int, default=500)
+
+# 一括登録で1リクエストに受け付ける最大行数
+HEDGEHOGS_BULK_MAX_ROWS = config("HEDGEHOGS_BULK_MAX_ROWS", cast=int, default=100_000)
+
+
+# リポジトリのキャッシュの設定 (CACHE_BACKEND は memory / redis / none)
+# memory はプロセスごとなので、複数のワーカーでは redis を使う (runner は none に切り替える)
+CACHE_BACKEND = config("CACHE_BACKEND", cast=str, default="memory")
+CACHE_URL = config("CACHE_URL", cast=str, default="redis://redis:6379/0")
+CACHE_TTL_SECONDS = config("CACHE_TTL_SECONDS", cast=float, default=60)
+CACHE_MAX_ENTRIES = config("CACHE_MAX_ENTRIES", cast=int, default=10_000)
+
+
+# パスワードのハッシュ化を実行するプールの設定 (PASSWORD_HASH_EXECUTOR は thread / process)
+# WORKERS と MAX_QUEUE はワーカープロセスごとの値で、サーバー全体では SERVER_WORKERS 倍になる
+PASSWORD_HASH_EXECUTOR = config("PASSWORD_HASH_EXECUTOR", cast=str, default="thread")
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", cast=int, default=4)
+PASSWORD_HASH_MAX_QUEUE = config("PASSWORD_HASH_MAX_QUEUE", cast=int, default=64)
+
+
+# 認証済みユーザーのキャッシュの有効期限 (無効化されなくてもこの秒数で読み直す)
+AUTH_PRINCIPAL_CACHE_TTL_SECONDS = config("AUTH_PRINCIPAL_CACHE_TTL_SECONDS", cast=float, default=30)
+
+
+# 検証済み JWT のキャッシュの最大件数 (0 で無効)
+JWT_CACHE_MAX_ENTRIES = config("JWT_CACHE_MAX_ENTRIES", cast=int, default=10_000)
+
+
+# ログインのレート制限 (IP ごと・アカウントごとのトークンバケット)
+LOGIN_RATE_LIMIT_IP_BURST = config("LOGIN_RATE_LIMIT_IP_BURST", cast=float, default=20)
+LOGIN_RATE_LIMIT_IP_PER_MINUTE = config("LOGIN_RATE_LIMIT_IP_PER_MINUTE", cast=float, default=10)
+LOGIN_RATE_LIMIT_ACCOUNT_BURST = config("LOGIN_RATE_LIMIT_ACCOUNT_BURST", cast=float, default=5)
+LOGIN_RATE_LIMIT_ACCOUNT_PER_MINUTE = config("LOGIN_RATE_LIMIT_ACCOUNT_PER_MINUTE", cast=float, default=2)
+# 呼び出しのうちこの割合で、満タンに戻ったバケットの行を掃除する
+RATE_LIMIT_PRUNE_PROBABILITY = config("RATE_LIMIT_PRUNE_PROBABILITY", cast=float, default=0.001)
+# X-Forwarded-For を信頼する前段のプロキシの IP アドレスか CIDR (カンマ区切り)。空の場合は接続元のアドレスで制限する
+TRUSTED_PROXIES = config("TRUSTED_PROXIES", cast=CommaSeparatedStrings, default="")
+
+
+# bcrypt のコスト (2^BCRYPT_ROUNDS 回)。異なるコストのハッシュはログイン時に作り直す
+BCRYPT_ROUNDS = config("BCRYPT_ROUNDS", cast=int, default=12)
+
+
+# DB のコネクションプールの設定 (ワーカーごと)
+DB_POOL_MIN_SIZE = config("DB_POOL_MIN_SIZE", cast=int, default=5)
+DB_POOL_MAX_SIZE = config("DB_POOL_MAX_SIZE", cast=int, default=20)
+# 接続を取得できるまで待つ最大の秒数 (超えると 503)
+DB_POOL_ACQUIRE_TIMEOUT_SECONDS = config("DB_POOL_ACQUIRE_TIMEOUT_SECONDS", cast=float, default=5)
+# この秒数使った接続は返却時に閉じて作り直す (0 で無効)
+DB_POOL_MAX_LIFETIME_SECONDS = config("DB_POOL_MAX_LIFETIME_SECONDS", cast=float, default=1800)
+# この秒数使われなかった接続は閉じる (0 で無効)
+DB_POOL_MAX_IDLE_SECONDS = config("DB_POOL_MAX_IDLE_SECONDS", cast=float, default=300)
+
+
+# 読み取り用のレプリカの接続先 (カンマ区切り、空ならすべてプライマリで読む)
+DATABASE_REPLICA_URLS = config("DATABASE_REPLICA_URLS", cast=CommaSeparatedStrings, default="")
+# この秒数より遅れているレプリカは使わない
+REPLICA_MAX_LAG_SECONDS = config("REPLICA_MAX_LAG_SECONDS", cast=float, default=5)
+REPLICA_LAG_CHECK_INTERVAL_SECONDS = config("REPLICA_LAG_CHECK_INTERVAL_SECONDS", cast=float, default=1)
+# 書き込んだクライアントは、この秒数の間プライマリで読む (REPLICA_MAX_LAG_SECONDS + REPLICA_LAG_CHECK_INTERVAL_SECONDS より短い場合はその秒数)
+READ_YOUR_WRITES_SECONDS = config("READ_YOUR_WRITES_SECONDS", cast=float, default=5)
+
+
+# この大きさ (バイト) 未満のレスポンスは圧縮しない
+COMPRESSION_MINIMUM_SIZE = config("COMPRESSION_MINIMUM_SIZE", cast=int, default=1024)
+# 圧縮レベル (gzip は 1-9、brotli は 0-11、zstd は 1-22)。高いほど小さくなるが CPU を使う
+COMPRESSION_GZIP_LEVEL = config("COMPRESSION_GZIP_LEVEL", cast=int, default=6)
+COMPRESSION_BROTLI_QUALITY = config("COMPRESSION_BROTLI_QUALITY", cast=int, default=4)
+COMPRESSION_ZSTD_LEVEL = config("COMPRESSION_ZSTD_LEVEL", cast=int, default=3)
+
+
+# /api/metrics/ を読むのに必要なトークン (Authorization: Bearer <token>)。空の場合は /api/metrics/ を公開しない (404)
+METRICS_TOKEN = config("METRICS_TOKEN", cast=Secret, default="")
+
+
+# 本番用のサーバー (python -m app.core.runner) の設定
+SERVER_HOST = config("SERVER_HOST", cast=str, default="0.0.0.0")
+SERVER_PORT = config("SERVER_PORT", cast=int, default=8000)
+# ワーカープロセスの数 (既定は CPU のコア数)
+SERVER_WORKERS = config("SERVER_WORKERS", cast=int, default=os.cpu_count() or 1)
+# イベントループ (uvloop / asyncio) と HTTP パーサー (httptools / h11)
+SERVER_LOOP = config("SERVER_LOOP", cast=str, default="uvloop")
+SERVER_HTTP = config("SERVER_HTTP", cast=str, default="httptools")
+# listen のバックログ (受け付け待ちの接続数の上限)
+SERVER_BACKLOG = config("SERVER_BACKLOG", cast=int, default=2048)
+# Keep-Alive の接続を閉じるまでの秒数 (前段のロードバランサーのタイムアウトより長くする)
+SERVER_KEEP_ALIVE_SECONDS = config("SERVER_KEEP_ALIVE_SECONDS", cast=int, default=5)
+# ワーカーがこの件数のリクエストを処理したら入れ替える (0 で無効)。一斉に入れ替わらないよう最大 JITTER 件ずらす
+SERVER_MAX_REQUESTS = config("SERVER_MAX_REQUESTS", cast=int, default=10000)
+SERVER_MAX_REQUESTS_JITTER = config("SERVER_MAX_REQUESTS_JITTER", cast=int, default=1000)
+# 停止するときに処理中のリクエストを待つ最大の秒数 (超えると強制終了する)
+SERVER_GRACEFUL_TIMEOUT_SECONDS = config("SERVER_GRACEFUL_TIMEOUT_SECONDS", cast=int, default=30)
+SERVER_ACCESS_LOG = config("SERVER_ACCESS_LOG", cast=bool, default=False)
+# 起動してから MIN_UPTIME 秒以内に異常終了したワーカーは、待ってから起動し直す
+# (続けて落ちるたびに待つ秒数を倍にし、最大 BACKOFF_MAX 秒)。続けて MAX_FAST_FAILURES 回落ちたらサーバーごと止める
+SERVER_WORKER_MIN_UPTIME_SECONDS = config("SERVER_WORKER_MIN_UPTIME_SECONDS", cast=float, default=5)
+SERVER_RESPAWN_BACKOFF_SECONDS = config("SERVER_RESPAWN_BACKOFF_SECONDS", cast=float, default=0.5)
+SERVER_RESPAWN_BACKOFF_MAX_SECONDS = config("SERVER_RESPAWN_BACKOFF_MAX_SECONDS", cast=float, default=30)
+SERVER_MAX_FAST_FAILURES = config("SERVER_MAX_FAST_FAILURES", cast=int, default=5)
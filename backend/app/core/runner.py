@@ -0,0 +1,305 @@
+"""
+本番用のサーバーを起動する
+
+    python -m app.core.runner [app.api.server:app]
+
+親プロセスでアプリを読み込み、ソケットを開いてから SERVER_WORKERS 個のワーカーを fork する。
+ワーカーは uvloop と httptools を使う uvicorn.Server で、同じソケットから接続を受け付ける。
+アプリを読み込んだあとに gc.freeze() してから fork するので、
+読み込んだモジュールのオブジェクトはワーカーの GC に触られず、copy-on-write でワーカー間で共有される。
+(uvicorn の --workers は spawn でワーカーを起動し、それぞれがアプリを読み込み直すので共有されない。
+また、--limit-max-requests で終了したワーカーを起動し直さない)
+
+ワーカーは SERVER_MAX_REQUESTS 件 (ワーカーごとに最大 SERVER_MAX_REQUESTS_JITTER 件ずらす) を処理すると
+処理中のリクエストを終えてから終了し、親が新しいワーカーを起動する。
+起動してすぐに異常終了したワーカーは、待つ秒数を倍にしながら起動し直し、
+続けて SERVER_MAX_FAST_FAILURES 回落ちた場合はサーバーごと終了コード 1 で止める。
+SIGTERM / SIGINT を受け取ると、ワーカーに SIGTERM を送り、
+SERVER_GRACEFUL_TIMEOUT_SECONDS 待っても終わらないワーカーは強制終了する。
+
+開発用の uvicorn app.api.server:app --reload --workers 1 との比較 (benchmarks/server.py、
+1 CPU の環境で /api/metrics/ を 32 接続の Keep-Alive で8秒間叩いた5回の中央値):
+
+    uvicorn --reload --workers 1 (asyncio, h11)          671 req/s
+    uvicorn --reload --workers 1 (uvloop, httptools)   1,446 req/s
+    runner 1 ワーカー (asyncio, h11)                     699 req/s
+    runner 1 ワーカー (uvloop, httptools)              1,861 req/s
+    runner 2 ワーカー (uvloop, httptools)              1,867 req/s
+
+開発用のコマンドは uvloop と httptools がインストールされていれば自動で使うが、
+リロードの監視とアクセスログの分だけ遅い。CPU が1つの環境ではワーカーを増やしても速くならないので、
+SERVER_WORKERS はコアの数にする。
+gc.freeze() しない場合は、ワーカーが親と共有せずに持つメモリ (USS) が約 33 MB、
+する場合は約 16 MB だった。
+"""
+
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+import uvicorn
+from app.core.config import (
+    SERVER_ACCESS_LOG,
+    SERVER_BACKLOG,
+    SERVER_GRACEFUL_TIMEOUT_SECONDS,
+    SERVER_HOST,
+    SERVER_HTTP,
+    SERVER_KEEP_ALIVE_SECONDS,
+    SERVER_LOOP,
+    SERVER_MAX_FAST_FAILURES,
+    SERVER_MAX_REQUESTS,
+    SERVER_MAX_REQUESTS_JITTER,
+    SERVER_PORT,
+    SERVER_RESPAWN_BACKOFF_MAX_SECONDS,
+    SERVER_RESPAWN_BACKOFF_SECONDS,
+    SERVER_WORKER_MIN_UPTIME_SECONDS,
+    SERVER_WORKERS,
+)
+from app.db.cache import repository_cache
+
+logger = logging.getLogger("uvicorn.error")
+
+# ワーカーがアプリを起動できなかった場合の終了コード (uvicorn と同じ)
+WORKER_BOOT_ERROR = 3
+# ワーカーが起動直後に落ち続けたためにサーバーを止めた場合の終了コード
+CRASH_LOOP_EXIT_CODE = 1
+# 子プロセスの終了を確認する間隔 (秒)
+POLL_INTERVAL_SECONDS = 0.2
+
+
+def worker_max_requests(max_requests: int, jitter: int) -> Optional[int]:
+    """
+    ワーカーが入れ替わるまでに処理するリクエストの件数を返す (入れ替えない場合は None)
+
+    同時に起動したワーカーが一斉に再起動しないよう、ワーカーごとに 0 - jitter 件ずらす。
+    """
+    if max_requests <= 0:
+        return None
+    return max_requests + random.randint(0, max(jitter, 0))
+
+
+def respawn_delay(failures: int, backoff: float, backoff_max: float) -> float:
+    """
+    続けて failures 回すぐに落ちたワーカーを起動し直すまでに待つ秒数を返す
+    """
+    if failures <= 0:
+        return 0.0
+    return min(backoff * 2 ** (failures - 1), backoff_max)
+
+
+class Supervisor:
+    """
+    ワーカーを fork し、終了したワーカーを起動し直す親プロセス
+    """
+
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        *,
+        workers: int,
+        max_requests: int,
+        max_requests_jitter: int,
+        graceful_timeout: float,
+        min_uptime: float = 5,
+        respawn_backoff: float = 0.5,
+        respawn_backoff_max: float = 30,
+        max_fast_failures: int = 5,
+    ) -> None:
+        self.config = config
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.min_uptime = min_uptime
+        self.respawn_backoff = respawn_backoff
+        self.respawn_backoff_max = respawn_backoff_max
+        self.max_fast_failures = max_fast_failures
+        # ワーカーのプロセス ID ごとの起動時刻
+        self.children: Dict[int, float] = {}
+        # 続けてすぐに落ちたワーカーの数と、最後に落ちた時刻
+        self.fast_failures = 0
+        self.last_fast_failure_at = 0.0
+        self.next_spawn_at = 0.0
+        self.should_exit = False
+        self.exit_code = 0
+        self.sock: Optional[socket.socket] = None
+
+    def run(self) -> int:
+        # 読み込みの途中で GC が走ると、解放された隙間にあとのオブジェクトが入り、
+        # ワーカーでその隙間が書き換わるたびにページがコピーされる
+        gc.disable()
+        self.config.load()
+        self.sock = self.config.bind_socket()
+        gc.collect()
+        gc.freeze()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.handle_exit)
+        logger.info(
+            "Started supervisor [%d] with %d workers", os.getpid(), self.workers
+        )
+
+        for _ in range(self.workers):
+            self.spawn()
+        while not self.should_exit:
+            self.reap()
+            self.reset_fast_failures()
+            for _ in range(self.workers - len(self.children)):
+                if not self.should_exit and time.monotonic() >= self.next_spawn_at:
+                    self.spawn()
+            time.sleep(POLL_INTERVAL_SECONDS)
+        self.stop()
+        self.sock.close()
+        return self.exit_code
+
+    def handle_exit(self, sig: int, frame: object) -> None:
+        self.should_exit = True
+
+    def spawn(self) -> None:
+        # fork の前に決めないと、すべてのワーカーで乱数が同じになる
+        limit = worker_max_requests(self.max_requests, self.max_requests_jitter)
+        # 前のワーカーを起動したあとに作られたオブジェクトも共有する
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(self.run_worker(limit))
+        self.children[pid] = time.monotonic()
+        logger.info("Booted worker [%d] (max requests: %s)", pid, limit)
+
+    def run_worker(self, limit: Optional[int]) -> int:
+        try:
+            # シグナルは uvicorn.Server が受け取って、処理中のリクエストを終えてから終了する
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, signal.SIG_DFL)
+            gc.enable()
+            self.config.limit_max_requests = limit
+            server = uvicorn.Server(self.config)
+            server.run(sockets=[self.sock])
+            return 0 if server.started else WORKER_BOOT_ERROR
+        except BaseException:
+            logger.exception("Worker [%d] crashed", os.getpid())
+            return 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+    def reap(self) -> None:
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            booted_at = self.children.pop(pid, None)
+            exit_code = os.waitstatus_to_exitcode(status)
+            if exit_code == WORKER_BOOT_ERROR:
+                # 起動し直しても失敗し続けるので、サーバーごと止める
+                logger.error("Worker [%d] failed to boot", pid)
+                self.should_exit = True
+                self.exit_code = WORKER_BOOT_ERROR
+            elif self.should_exit:
+                continue
+            elif (
+                exit_code != 0
+                and booted_at is not None
+                and time.monotonic() - booted_at < self.min_uptime
+            ):
+                self.record_fast_failure(pid, exit_code)
+            else:
+                logger.info("Worker [%d] exited with code %d", pid, exit_code)
+
+    def record_fast_failure(self, pid: int, exit_code: int) -> None:
+        self.fast_failures += 1
+        self.last_fast_failure_at = time.monotonic()
+        if self.fast_failures >= self.max_fast_failures:
+            logger.error(
+                "Worker [%d] exited with code %d; %d workers crashed right after"
+                " starting, stopping",
+                pid,
+                exit_code,
+                self.fast_failures,
+            )
+            self.should_exit = True
+            self.exit_code = CRASH_LOOP_EXIT_CODE
+            return
+        delay = respawn_delay(
+            self.fast_failures, self.respawn_backoff, self.respawn_backoff_max
+        )
+        self.next_spawn_at = self.last_fast_failure_at + delay
+        logger.warning(
+            "Worker [%d] exited with code %d right after starting;"
+            " respawning in %.1f seconds",
+            pid,
+            exit_code,
+            delay,
+        )
+
+    def reset_fast_failures(self) -> None:
+        # 最後に落ちたあとに起動したワーカーが動き続けていれば、落ち続けてはいない
+        now = time.monotonic()
+        if self.fast_failures and any(
+            booted_at > self.last_fast_failure_at and now - booted_at >= self.min_uptime
+            for booted_at in self.children.values()
+        ):
+            self.fast_failures = 0
+
+    def stop(self) -> None:
+        self.signal_children(signal.SIGTERM)
+        # ワーカーの uvicorn も同じ秒数で打ち切るので、アプリの終了処理の分だけ長く待つ
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(POLL_INTERVAL_SECONDS)
+        if self.children:
+            logger.warning(
+                "Killing %d workers after graceful timeout", len(self.children)
+            )
+            self.signal_children(signal.SIGKILL)
+            for pid in list(self.children):
+                os.waitpid(pid, 0)
+                self.children.pop(pid)
+        logger.info("Stopped supervisor [%d]", os.getpid())
+
+    def signal_children(self, sig: int) -> None:
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                self.children.pop(pid)
+
+
+def main() -> None:
+    app = sys.argv[1] if len(sys.argv) > 1 else "app.api.server:app"
+    config = uvicorn.Config(
+        app,
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        loop=SERVER_LOOP,
+        http=SERVER_HTTP,
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=SERVER_KEEP_ALIVE_SECONDS,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT_SECONDS,
+        access_log=SERVER_ACCESS_LOG,
+    )
+    # プロセス内のキャッシュは、他のワーカーの書き込みで無効化されない
+    repository_cache.configure_for_workers(SERVER_WORKERS)
+    supervisor = Supervisor(
+        config,
+        workers=SERVER_WORKERS,
+        max_requests=SERVER_MAX_REQUESTS,
+        max_requests_jitter=SERVER_MAX_REQUESTS_JITTER,
+        graceful_timeout=SERVER_GRACEFUL_TIMEOUT_SECONDS,
+        min_uptime=SERVER_WORKER_MIN_UPTIME_SECONDS,
+        respawn_backoff=SERVER_RESPAWN_BACKOFF_SECONDS,
+        respawn_backoff_max=SERVER_RESPAWN_BACKOFF_MAX_SECONDS,
+        max_fast_failures=SERVER_MAX_FAST_FAILURES,
+    )
+    sys.exit(supervisor.run())
+
+
+if __name__ == "__main__":
+    main()
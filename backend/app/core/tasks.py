@@ -1,6 +1,8 @@
 from typing import Callable
 
+from app.db.cache import repository_cache
 from app.db.tasks import close_db_connection, connect_to_db
+from app.services.password_hashing import password_hashing_pool
 from fastapi import FastAPI
 
 
@@ -14,5 +16,7 @@ def create_start_app_handler(app: FastAPI) -> Callable:
 def create_stop_app_handler(app: FastAPI) -> Callable:
     async def stop_app() -> None:
         await close_db_connection(app)
+        await repository_cache.close()
+        password_hashing_pool.shutdown()
 
     return stop_app
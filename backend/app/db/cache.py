@@ -0,0 +1,386 @@
+"""
+リポジトリのリードスルーキャッシュ
+
+リポジトリのメソッドは @cached でキャッシュを利用し、
+書き込みを行うメソッドは @invalidates で関連するタグを無効化する。
+バックエンドはプロセス内 (memory) とワーカー間で共有する (redis) を切り替えられる。
+"""
+
+import inspect
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import wraps
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    get_type_hints,
+)
+
+from app.core.config import (
+    CACHE_BACKEND,
+    CACHE_MAX_ENTRIES,
+    CACHE_TTL_SECONDS,
+    CACHE_URL,
+)
+from pydantic import TypeAdapter
+
+logger = logging.getLogger(__name__)
+
+# キャッシュに値がなかったことを表す (None もキャッシュされうる値と区別する)
+MISSING = object()
+
+
+class CacheBackend(ABC):
+    """
+    キャッシュの保存先のインターフェース
+    """
+
+    evictions: int = 0
+    # 無効化がすべてのワーカーに届くか
+    shared: bool = True
+    # 値を JSON の bytes で保存するか (プロセスの外に保存するバックエンド)
+    serialized: bool = False
+
+    @abstractmethod
+    async def get(self, key: str) -> Any:
+        """
+        キーの値を返す (ない場合や期限切れの場合は MISSING)
+        """
+
+    @abstractmethod
+    async def set(
+        self, key: str, value: Any, *, ttl: float, tags: Iterable[str]
+    ) -> None:
+        """
+        ttl 秒の間、値をタグと一緒に保存する
+        """
+
+    @abstractmethod
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        """
+        いずれかのタグの付いたキーをすべて削除する
+        """
+
+    @abstractmethod
+    async def clear(self) -> None:
+        """
+        すべてのキーを削除する
+        """
+
+    async def close(self) -> None:
+        pass
+
+
+class NullCacheBackend(CacheBackend):
+    """
+    何もキャッシュしないバックエンド (CACHE_BACKEND=none)
+    """
+
+    async def get(self, key: str) -> Any:
+        return MISSING
+
+    async def set(
+        self, key: str, value: Any, *, ttl: float, tags: Iterable[str]
+    ) -> None:
+        pass
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        pass
+
+    async def clear(self) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    プロセス内の LRU キャッシュ
+
+    max_entries を超えたら最も古く使われたエントリから追い出す。
+    無効化は書き込んだプロセスにしか届かないので、ワーカーが1つの場合だけ使う。
+    """
+
+    shared = False
+
+    def __init__(self, *, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any, Tuple[str, ...]]]" = (
+            OrderedDict()
+        )
+        self._tags: Dict[str, Set[str]] = {}
+
+    async def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(
+        self, key: str, value: Any, *, ttl: float, tags: Iterable[str]
+    ) -> None:
+        if key in self._entries:
+            self._remove(key)
+        tags = tuple(tags)
+        self._entries[key] = (time.monotonic() + ttl, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            for key in self._tags.pop(tag, set()):
+                self._remove(key)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self._tags.clear()
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Redis を使ってワーカー間でキャッシュを共有するバックエンド
+
+    タグごとにキーの集合を持ち、無効化の際はその集合に含まれるキーを削除する。
+    容量を超えた場合の追い出しは Redis の maxmemory-policy に任せる。
+    値は @cached が JSON にした bytes をそのまま保存する (pickle は使わない)。
+    """
+
+    serialized = True
+
+    def __init__(self, *, url: str, namespace: str = "repo-cache") -> None:
+        try:
+            from redis import asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package") from e
+        self._redis = aioredis.from_url(url)
+        self._namespace = namespace
+
+    def _key(self, key: str) -> str:
+        return f"{self._namespace}:key:{key}"
+
+    def _tag(self, tag: str) -> str:
+        return f"{self._namespace}:tag:{tag}"
+
+    async def get(self, key: str) -> Any:
+        value = await self._redis.get(self._key(key))
+        return MISSING if value is None else value
+
+    async def set(
+        self, key: str, value: Any, *, ttl: float, tags: Iterable[str]
+    ) -> None:
+        ttl_ms = max(1, int(ttl * 1000))
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.set(self._key(key), value, px=ttl_ms)
+            for tag in tags:
+                pipe.sadd(self._tag(tag), self._key(key))
+                pipe.pexpire(self._tag(tag), ttl_ms)
+            await pipe.execute()
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        tag_keys = [self._tag(tag) for tag in tags]
+        if not tag_keys:
+            return
+        keys = await self._redis.sunion(tag_keys)
+        await self._redis.delete(*keys, *tag_keys)
+
+    async def clear(self) -> None:
+        async for key in self._redis.scan_iter(match=f"{self._namespace}:*"):
+            await self._redis.delete(key)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+class RepositoryCache:
+    """
+    バックエンドをラップし、ヒット・ミス・無効化の回数を記録する
+    """
+
+    def __init__(self, backend: CacheBackend, *, ttl: float) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get(self, key: str) -> Any:
+        value = await self.backend.get(key)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(
+        self, key: str, value: Any, *, tags: Iterable[str], ttl: Optional[float] = None
+    ) -> None:
+        await self.backend.set(key, value, ttl=ttl or self.ttl, tags=tags)
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        tags = list(tags)
+        self.invalidations += len(tags)
+        await self.backend.invalidate_tags(tags)
+
+    async def clear(self) -> None:
+        await self.backend.clear()
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    def configure_for_workers(self, workers: int) -> None:
+        """
+        複数のワーカーで動かす場合は、ワーカー間で共有されないバックエンドを使わない
+
+        他のワーカーは書き込みで無効化されず、TTL の間古い値を返し続けるので、
+        キャッシュしない (none) ようにする。共有するには CACHE_BACKEND=redis にする。
+        """
+        if workers > 1 and not self.backend.shared:
+            logger.warning(
+                "%s is not shared between %d workers; caching is disabled "
+                "(set CACHE_BACKEND=redis to share the cache)",
+                type(self.backend).__name__,
+                workers,
+            )
+            self.backend = NullCacheBackend()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def build_cache_backend(name: str) -> CacheBackend:
+    if name == "memory":
+        return MemoryCacheBackend(max_entries=CACHE_MAX_ENTRIES)
+    if name == "redis":
+        return RedisCacheBackend(url=CACHE_URL)
+    if name == "none":
+        return NullCacheBackend()
+    raise ValueError(f"Unknown CACHE_BACKEND: {name}")
+
+
+def _bind_arguments(
+    signature: inspect.Signature, self: Any, kwargs: Dict[str, Any]
+) -> Dict[str, Any]:
+    bound = signature.bind(self, **kwargs)
+    bound.apply_defaults()
+    return bound.arguments
+
+
+def cached(
+    key: str,
+    *,
+    tags: Sequence[str] = (),
+    ttl: Optional[float] = None,
+    shared_only: bool = False,
+    local_only: bool = False,
+) -> Callable:
+    """
+    リポジトリのメソッドの結果をキャッシュするデコレータ
+
+    key と tags はメソッドのキーワード引数で format される。
+    tags では結果を {result} として参照できる (例: "user:{result.id}")。
+    結果が None の場合はキャッシュしない。
+    レプリカで読んだ結果もキャッシュしない (プライマリへの書き込みで無効化したあとに、
+    遅れているレプリカの古い行で埋め直され、TTL の間残り続けてしまうため)。
+    shared_only の場合は、無効化がすべてのワーカーに届くバックエンドでだけキャッシュする。
+    local_only の場合は、プロセスの外に保存するバックエンドではキャッシュしない
+    (パスワードやソルトを含む結果を Redis などに書き込まないため)。
+    プロセスの外に保存するバックエンドには、戻り値の型の JSON にして保存し、
+    読むときに同じ型で検証する。
+    """
+
+    def decorator(method: Callable) -> Callable:
+        signature = inspect.signature(method)
+        adapters: list = []
+
+        def get_adapter() -> TypeAdapter:
+            # 型ヒントは初めて JSON にするときに解決する
+            if not adapters:
+                adapters.append(TypeAdapter(get_type_hints(method).get("return", Any)))
+            return adapters[0]
+
+        @wraps(method)
+        async def wrapper(self: Any, **kwargs: Any) -> Any:
+            backend = self.cache.backend
+            if (shared_only and not backend.shared) or (
+                local_only and backend.serialized
+            ):
+                return await method(self, **kwargs)
+            arguments = _bind_arguments(signature, self, kwargs)
+            cache_key = key.format(**arguments)
+            value = await self.cache.get(cache_key)
+            if value is not MISSING:
+                if backend.serialized:
+                    return get_adapter().validate_json(value)
+                return value
+
+            result = await method(self, **kwargs)
+            if result is not None and not getattr(self, "reads_from_replica", False):
+                await self.cache.set(
+                    cache_key,
+                    get_adapter().dump_json(result) if backend.serialized else result,
+                    tags=[tag.format(result=result, **arguments) for tag in tags],
+                    ttl=ttl,
+                )
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def invalidates(*tags: str) -> Callable:
+    """
+    書き込みが成功した後に、引数と結果から組み立てたタグを無効化するデコレータ
+    """
+
+    def decorator(method: Callable) -> Callable:
+        signature = inspect.signature(method)
+
+        @wraps(method)
+        async def wrapper(self: Any, **kwargs: Any) -> Any:
+            arguments = _bind_arguments(signature, self, kwargs)
+            result = await method(self, **kwargs)
+            await self.cache.invalidate_tags(
+                [tag.format(result=result, **arguments) for tag in tags]
+            )
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+repository_cache = RepositoryCache(
+    build_cache_backend(CACHE_BACKEND), ttl=CACHE_TTL_SECONDS
+)
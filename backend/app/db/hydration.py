@@ -0,0 +1,167 @@
+"""
+DB の行からモデルを組み立てる (検証を省略する)
+
+自分たちのスキーマから読んだ行は型も制約も DB で保証されているので、
+Model(**record) のように pydantic の検証をやり直さず、model_construct と同じ方法で組み立てる。
+ただし DB の型とモデルの型が異なる列 (NUMERIC → float、TEXT → Enum / HttpUrl) と
+DateTimeModelMixin の既定値だけは変換する。
+フィールドごとの変換はモデルごとに1回だけ決めておく (compile_hydrator)。
+クライアントから受け取った値には使わないこと。
+"""
+
+from datetime import datetime
+from enum import Enum
+from functools import lru_cache
+from typing import (
+    Annotated,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Type,
+    TypeVar,
+    Union,
+    get_args,
+    get_origin,
+)
+
+from app.models.core import JST, DateTimeModelMixin
+from pydantic import BaseModel, EmailStr, TypeAdapter
+from pydantic.fields import FieldInfo
+
+Model = TypeVar("Model", bound=BaseModel)
+Converter = Optional[Callable[[Any], Any]]
+
+_MISSING = object()
+_SKIP = object()
+_object_setattr = object.__setattr__
+# DB から返る値をそのまま使える型 (constr や EmailStr も実体は str)
+_TRUSTED_TYPES = (int, str, bool, datetime, EmailStr)
+
+
+def _unwrap_optional(annotation: Any) -> Any:
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _default_datetime(value: Optional[datetime]) -> datetime:
+    # DateTimeModelMixin.default_datetime と同じ
+    return value or datetime.now(JST)
+
+
+def _to_float(value: Any) -> Optional[float]:
+    return None if value is None else float(value)
+
+
+def _field_converter(model: Type[BaseModel], name: str, field: FieldInfo) -> Converter:
+    if issubclass(model, DateTimeModelMixin) and name in ("created_at", "updated_at"):
+        return _default_datetime
+
+    annotation = _unwrap_optional(field.annotation)
+    if annotation in _TRUSTED_TYPES:
+        return None
+    if get_origin(annotation) is Annotated and get_args(annotation)[0] is str:
+        return None
+    if annotation is float:
+        return _to_float
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        members = annotation._value2member_map_
+        return lambda value: (
+            None if value is None else members.get(value) or annotation(value)
+        )
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        nested = annotation
+        return lambda value: (
+            value
+            if value is None or isinstance(value, nested)
+            else hydrate(nested, value)
+        )
+
+    # それ以外の型 (HttpUrl など) は、その列だけ検証して変換する
+    adapter = TypeAdapter(field.annotation)
+    return adapter.validate_python
+
+
+def _missing_value(converter: Converter, field: FieldInfo) -> Callable[[], Any]:
+    """
+    行に列がない場合の値を返す関数 (既定値がなければ _SKIP を返してフィールドを省く)
+    """
+    if converter is _default_datetime:
+        return lambda: _default_datetime(None)
+    if field.is_required():
+        return lambda: _SKIP
+    return lambda: field.get_default(call_default_factory=True)
+
+
+@lru_cache(maxsize=None)
+def compile_hydrator(model: Type[Model]) -> Callable[[Any], Model]:
+    """
+    モデル専用の組み立て関数を作る (モデルごとに1回)
+
+    フィールドごとの変換と、列がない場合の値はここで1回だけ決めておく。
+    """
+    plan = tuple(
+        (name, converter, _missing_value(converter, field))
+        for name, field in model.model_fields.items()
+        for converter in (_field_converter(model, name, field),)
+    )
+    all_fields = frozenset(model.model_fields)
+    has_private_attributes = bool(model.__private_attributes__)
+
+    def hydrate_row(row: Any) -> Model:
+        get = row.get
+        values = {}
+        missing = None
+        for name, convert, missing_value in plan:
+            value = get(name, _MISSING)
+            if value is _MISSING:
+                missing = (missing or set()) | {name}
+                value = missing_value()
+                if value is not _SKIP:
+                    values[name] = value
+            elif convert is None:
+                values[name] = value
+            else:
+                values[name] = convert(value)
+        fields_set = set(all_fields - missing if missing else all_fields)
+        if has_private_attributes:
+            return model.model_construct(fields_set, **values)
+        # model_construct と同じ属性を直接設定する
+        instance = model.__new__(model)
+        _object_setattr(instance, "__dict__", values)
+        _object_setattr(instance, "__pydantic_fields_set__", fields_set)
+        _object_setattr(instance, "__pydantic_extra__", None)
+        _object_setattr(instance, "__pydantic_private__", None)
+        return instance
+
+    return hydrate_row
+
+
+def _as_mapping(row: Any) -> Any:
+    # モデルに hasattr を使うと AttributeError の組み立てで遅くなるので先に判定する
+    if isinstance(row, BaseModel):
+        # 組み立て済みのモデルから別のモデルを作る場合 (UserInDB → UserPublic など)
+        return row.__dict__
+    if hasattr(row, "get"):
+        return row
+    # databases の Record (iterate など) はマッピングとして読む
+    return row._mapping
+
+
+def hydrate(model: Type[Model], row: Any) -> Model:
+    """
+    DB の行 (または信頼できる dict・組み立て済みのモデル) から検証せずにモデルを作る
+
+    行にない列はフィールドの既定値を使う。モデルにない列は無視する。
+    """
+    return compile_hydrator(model)(_as_mapping(row))
+
+
+def hydrate_all(model: Type[Model], rows: Iterable[Any]) -> List[Model]:
+    hydrate_row = compile_hydrator(model)
+    return [hydrate_row(_as_mapping(row)) for row in rows]
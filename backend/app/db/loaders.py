@@ -0,0 +1,87 @@
+"""
+リクエスト内の1件ずつの取得をまとめるバッチローダー (DataLoader)
+
+同じイベントループの周回で load されたキーを集め、
+batch_load で1回だけ問い合わせて (例: WHERE id = ANY(:ids))、結果をそれぞれの呼び出し元に返す。
+リポジトリはリクエストごとに作られるので、ローダーもリクエストの間だけ使われる。
+"""
+
+import asyncio
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    TypeVar,
+)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class BatchLoader(Generic[K, V]):
+    """
+    キーごとの取得を1回の問い合わせにまとめる
+
+    batch_load は重複のないキーのリストを受け取り、キーから結果への対応を返す。
+    対応にないキーの結果は None になる。
+    同じ周回で同じキーが複数回 load された場合は、1つのキーとして問い合わせる。
+    """
+
+    def __init__(
+        self,
+        batch_load: Callable[[List[K]], Awaitable[Mapping[K, V]]],
+        *,
+        max_batch_size: int = 1000,
+    ) -> None:
+        self.batch_load = batch_load
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self._pending: Dict[K, "asyncio.Future[Optional[V]]"] = {}
+        # 実行中のバッチが GC されないように参照を持っておく
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+    async def load(self, key: K) -> Optional[V]:
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._pending:
+                # 同じ周回で load される他のキーを待ってから問い合わせる
+                loop.call_soon(self._dispatch)
+            future = loop.create_future()
+            self._pending[key] = future
+        # 待っている呼び出し元の1つがキャンセルされても、他の呼び出し元には結果を返す
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[K]) -> List[Optional[V]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def _dispatch(self) -> None:
+        pending, self._pending = self._pending, {}
+        keys = list(pending)
+        for start in range(0, len(keys), self.max_batch_size):
+            batch = {
+                key: pending[key] for key in keys[start : start + self.max_batch_size]
+            }
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: Dict[K, "asyncio.Future[Optional[V]]"]) -> None:
+        self.batches += 1
+        try:
+            results = await self.batch_load(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
@@ -0,0 +1,67 @@
+"""add table versions
+
+Revision ID: 393a61739ede
+Revises: b0298e568470
+Create Date: 2026-10-17 11:24:40.518302
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "393a61739ede"
+down_revision = "b0298e568470"
+branch_labels = None
+depends_on = None
+
+
+def create_table_versions_table() -> None:
+    """
+    テーブル単位の変更カウンタ。一覧の ETag に使う。
+    """
+    op.create_table(
+        "table_versions",
+        sa.Column("table_name", sa.Text, primary_key=True),
+        sa.Column("version", sa.BigInteger, nullable=False, server_default="1"),
+    )
+    op.execute("INSERT INTO table_versions (table_name) VALUES ('hedgehogs')")
+
+
+def create_bump_table_version_trigger() -> None:
+    # 行ごとではなく文ごとに1回だけ加算するので、一括登録でも更新は1回で済む
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION bump_table_version()
+            RETURNS TRIGGER AS
+        $$
+        BEGIN
+            INSERT INTO table_versions (table_name, version)
+            VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (table_name)
+            DO UPDATE SET version = table_versions.version + 1;
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER bump_hedgehogs_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+            ON hedgehogs
+            FOR EACH STATEMENT
+        EXECUTE FUNCTION bump_table_version();
+        """
+    )
+
+
+def upgrade() -> None:
+    create_table_versions_table()
+    create_bump_table_version_trigger()
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER bump_hedgehogs_version ON hedgehogs")
+    op.execute("DROP FUNCTION bump_table_version")
+    op.drop_table("table_versions")
@@ -0,0 +1,43 @@
+"""add rate limit buckets
+
+Revision ID: 4b7e1d9c2a53
+Revises: 8f3d6a2c1e90
+Create Date: 2026-10-17 16:40:12.305611
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4b7e1d9c2a53"
+down_revision = "8f3d6a2c1e90"
+branch_labels = None
+depends_on = None
+
+
+def create_rate_limit_buckets_table() -> None:
+    # 全ワーカーで共有するトークンバケット。
+    # 失われても満タンの状態に戻るだけなので WAL を書かない UNLOGGED にする
+    op.execute(
+        """
+        CREATE UNLOGGED TABLE rate_limit_buckets (
+            key TEXT PRIMARY KEY,
+            capacity DOUBLE PRECISION NOT NULL,
+            refill_per_second DOUBLE PRECISION NOT NULL,
+            tokens DOUBLE PRECISION NOT NULL,
+            allowed BOOLEAN NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+        );
+        """
+    )
+    op.create_index(
+        "ix_rate_limit_buckets_updated_at", "rate_limit_buckets", ["updated_at"]
+    )
+
+
+def upgrade() -> None:
+    create_rate_limit_buckets_table()
+
+
+def downgrade() -> None:
+    op.drop_table("rate_limit_buckets")
@@ -0,0 +1,41 @@
+"""add hedgehog search vector
+
+Revision ID: 5e0c2f9a7b41
+Revises: ca1496be7cd7
+Create Date: 2026-10-17 14:21:07.512934
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5e0c2f9a7b41"
+down_revision = "ca1496be7cd7"
+branch_labels = None
+depends_on = None
+
+
+def add_search_vector_column() -> None:
+    # 名前を重み A、説明を重み B として、書き込み時に tsvector を生成しておく
+    op.execute(
+        """
+        ALTER TABLE hedgehogs
+        ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'B')
+        ) STORED;
+        """
+    )
+    op.execute(
+        "CREATE INDEX ix_hedgehogs_search_vector ON hedgehogs USING gin (search_vector)"
+    )
+
+
+def upgrade() -> None:
+    add_search_vector_column()
+
+
+def downgrade() -> None:
+    op.drop_index("ix_hedgehogs_search_vector", table_name="hedgehogs")
+    op.drop_column("hedgehogs", "search_vector")
@@ -0,0 +1,124 @@
+"""add hedgehog stats
+
+Revision ID: 8f3d6a2c1e90
+Revises: 5e0c2f9a7b41
+Create Date: 2026-10-17 15:02:44.190257
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8f3d6a2c1e90"
+down_revision = "5e0c2f9a7b41"
+branch_labels = None
+depends_on = None
+
+
+def create_hedgehog_stats_table() -> None:
+    """
+    color_type と1歳刻みの年齢ごとの件数と年齢の合計を持つ集計テーブル
+    """
+    op.create_table(
+        "hedgehog_stats",
+        sa.Column("color_type", sa.Text, primary_key=True),
+        sa.Column("age_bucket", sa.Integer, primary_key=True),
+        sa.Column("count", sa.BigInteger, nullable=False, server_default="0"),
+        sa.Column("age_sum", sa.Numeric, nullable=False, server_default="0"),
+    )
+    op.execute(
+        """
+        INSERT INTO hedgehog_stats (color_type, age_bucket, count, age_sum)
+        SELECT color_type, floor(age)::int, count(*), sum(age)
+        FROM hedgehogs
+        GROUP BY 1, 2;
+        """
+    )
+
+
+# 集計テーブルへ差分を加算する文。{source} は (color_type, age, sign) を返す
+APPLY_HEDGEHOG_STATS_DELTA = """
+            INSERT INTO hedgehog_stats AS s (color_type, age_bucket, count, age_sum)
+            SELECT color_type, floor(age)::int, sum(sign), sum(sign * age)
+            FROM ({source}) delta
+            GROUP BY 1, 2
+            HAVING sum(sign) <> 0 OR sum(sign * age) <> 0
+            ORDER BY 1, 2
+            ON CONFLICT (color_type, age_bucket)
+            DO UPDATE SET count = s.count + EXCLUDED.count,
+                          age_sum = s.age_sum + EXCLUDED.age_sum;
+"""
+
+NEW_ROWS = "SELECT color_type, age, 1 AS sign FROM new_rows"
+OLD_ROWS = "SELECT color_type, age, -1 AS sign FROM old_rows"
+
+
+def create_update_hedgehog_stats_trigger() -> None:
+    # 遷移テーブルを使い、文ごとに差分をまとめて1回だけ集計テーブルに反映する
+    # キーの順に更新するので、同時に書き込んでも行ロックの順序が揃う
+    # 存在しない遷移テーブルは参照できないので、操作ごとに文を分けている
+    on_insert = APPLY_HEDGEHOG_STATS_DELTA.format(source=NEW_ROWS)
+    on_delete = APPLY_HEDGEHOG_STATS_DELTA.format(source=OLD_ROWS)
+    on_update = APPLY_HEDGEHOG_STATS_DELTA.format(
+        source=f"{NEW_ROWS} UNION ALL {OLD_ROWS}"
+    )
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION update_hedgehog_stats()
+            RETURNS TRIGGER AS
+        $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                DELETE FROM hedgehog_stats;
+            ELSIF TG_OP = 'INSERT' THEN
+                {on_insert}
+            ELSIF TG_OP = 'DELETE' THEN
+                {on_delete}
+            ELSE
+                {on_update}
+            END IF;
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        """
+    )
+    # 遷移テーブルを参照するトリガーはイベントごとに分けて作る必要がある
+    op.execute(
+        """
+        CREATE TRIGGER update_hedgehog_stats_on_insert
+            AFTER INSERT ON hedgehogs
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT
+        EXECUTE FUNCTION update_hedgehog_stats();
+
+        CREATE TRIGGER update_hedgehog_stats_on_update
+            AFTER UPDATE ON hedgehogs
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT
+        EXECUTE FUNCTION update_hedgehog_stats();
+
+        CREATE TRIGGER update_hedgehog_stats_on_delete
+            AFTER DELETE ON hedgehogs
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT
+        EXECUTE FUNCTION update_hedgehog_stats();
+
+        CREATE TRIGGER update_hedgehog_stats_on_truncate
+            AFTER TRUNCATE ON hedgehogs
+            FOR EACH STATEMENT
+        EXECUTE FUNCTION update_hedgehog_stats();
+        """
+    )
+
+
+def upgrade() -> None:
+    create_hedgehog_stats_table()
+    create_update_hedgehog_stats_trigger()
+
+
+def downgrade() -> None:
+    for event in ("insert", "update", "delete", "truncate"):
+        op.execute(f"DROP TRIGGER update_hedgehog_stats_on_{event} ON hedgehogs")
+    op.execute("DROP FUNCTION update_hedgehog_stats")
+    op.drop_table("hedgehog_stats")
@@ -0,0 +1,28 @@
+"""add hedgehog version
+
+Revision ID: b0298e568470
+Revises: f07c5d85d588
+Create Date: 2026-10-17 10:02:11.204519
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b0298e568470"
+down_revision = "f07c5d85d588"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # 更新のたびに加算し、If-Match による楽観的ロックと ETag に使う
+    op.add_column(
+        "hedgehogs",
+        sa.Column("version", sa.Integer, nullable=False, server_default="1"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("hedgehogs", "version")
@@ -0,0 +1,97 @@
+"""shard table versions
+
+Revision ID: c7e4a1f95b28
+Revises: e2a9c4f81b36
+Create Date: 2026-10-17 21:40:12.583019
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c7e4a1f95b28"
+down_revision = "e2a9c4f81b36"
+branch_labels = None
+depends_on = None
+
+# 変更カウンタを分ける行の数
+TABLE_VERSION_SHARDS = 16
+
+
+def shard_table_versions_table() -> None:
+    """
+    テーブルごとの変更カウンタを複数の行に分ける
+
+    1行のカウンタでは、書き込むトランザクションがコミットするまで行ロックを持つので、
+    hedgehogs に書き込むトランザクションがすべて1つずつしか進まない。
+    行はセッション (pg_backend_pid) ごとに選ぶので、1つのトランザクションが複数の行を
+    ロックすることはなく、カウンタ同士でデッドロックしない。
+    テーブルの変更カウンタは全行の合計で、文ごとにどれか1行が加算されるので単調に増える。
+    既存の値は shard 0 に残るので、合計は移行の前から続く。
+
+    benchmarks/table_versions.py (1 CPU、16 接続、加算してから 5 ms 後にコミット) では
+    1行の場合 133 件/秒、16 行の場合 1,263 件/秒だった (待たずにコミットすると 1,207 件/秒と 2,433 件/秒)。
+    """
+    op.add_column(
+        "table_versions",
+        sa.Column("shard", sa.SmallInteger, nullable=False, server_default="0"),
+    )
+    op.drop_constraint("table_versions_pkey", "table_versions", type_="primary")
+    op.create_primary_key(
+        "table_versions_pkey", "table_versions", ["table_name", "shard"]
+    )
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION bump_table_version()
+            RETURNS TRIGGER AS
+        $$
+        BEGIN
+            INSERT INTO table_versions (table_name, shard, version)
+            VALUES (TG_TABLE_NAME, pg_backend_pid() % {TABLE_VERSION_SHARDS}, 1)
+            ON CONFLICT (table_name, shard)
+            DO UPDATE SET version = table_versions.version + 1;
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        """
+    )
+
+
+def upgrade() -> None:
+    shard_table_versions_table()
+
+
+def downgrade() -> None:
+    # 合計を shard 0 にまとめてから1行に戻す (ETag は変わらない)
+    op.execute(
+        """
+        UPDATE table_versions AS t
+        SET version = s.total
+        FROM (
+            SELECT table_name, sum(version) AS total
+            FROM table_versions
+            GROUP BY table_name
+        ) AS s
+        WHERE t.table_name = s.table_name AND t.shard = 0;
+        """
+    )
+    op.execute("DELETE FROM table_versions WHERE shard <> 0")
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION bump_table_version()
+            RETURNS TRIGGER AS
+        $$
+        BEGIN
+            INSERT INTO table_versions (table_name, version)
+            VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (table_name)
+            DO UPDATE SET version = table_versions.version + 1;
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        """
+    )
+    op.drop_constraint("table_versions_pkey", "table_versions", type_="primary")
+    op.create_primary_key("table_versions_pkey", "table_versions", ["table_name"])
+    op.drop_column("table_versions", "shard")
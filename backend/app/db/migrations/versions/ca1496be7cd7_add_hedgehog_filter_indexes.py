@@ -0,0 +1,55 @@
+"""add hedgehog filter indexes
+
+Revision ID: ca1496be7cd7
+Revises: 393a61739ede
+Create Date: 2026-10-17 13:05:52.881406
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "ca1496be7cd7"
+down_revision = "393a61739ede"
+branch_labels = None
+depends_on = None
+
+
+def create_filter_indexes() -> None:
+    # 絞り込み + id 順のキーセットページネーション用
+    op.create_index("ix_hedgehogs_color_type_id", "hedgehogs", ["color_type", "id"])
+    op.create_index("ix_hedgehogs_age_id", "hedgehogs", ["age", "id"])
+    # 前方一致は C 照合順序の範囲検索にすると、パラメータ化しても索引が使える
+    op.execute('CREATE INDEX ix_hedgehogs_name_c ON hedgehogs (name COLLATE "C")')
+
+
+def create_trigram_index() -> None:
+    # 部分一致用。pg_trgm が入っていない環境では索引を作らずに進める
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')
+            THEN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                CREATE INDEX ix_hedgehogs_name_trgm
+                    ON hedgehogs USING gin (name gin_trgm_ops);
+            ELSE
+                RAISE NOTICE 'pg_trgm is not available, skipping ix_hedgehogs_name_trgm';
+            END IF;
+        END
+        $$;
+        """
+    )
+
+
+def upgrade() -> None:
+    create_filter_indexes()
+    create_trigram_index()
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_hedgehogs_name_trgm")
+    op.drop_index("ix_hedgehogs_name_c", table_name="hedgehogs")
+    op.drop_index("ix_hedgehogs_age_id", table_name="hedgehogs")
+    op.drop_index("ix_hedgehogs_color_type_id", table_name="hedgehogs")
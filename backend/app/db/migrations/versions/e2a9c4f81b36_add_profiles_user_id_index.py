@@ -0,0 +1,25 @@
+"""add profiles user_id index
+
+Revision ID: e2a9c4f81b36
+Revises: 4b7e1d9c2a53
+Create Date: 2026-10-17 18:03:29.774150
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e2a9c4f81b36"
+down_revision = "4b7e1d9c2a53"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # ユーザーとプロフィールの結合と user_id での検索を索引で行う
+    # プロフィールはユーザーごとに1件なので一意にする
+    op.create_index("ix_profiles_user_id", "profiles", ["user_id"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_profiles_user_id", table_name="profiles")
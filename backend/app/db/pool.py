@@ -0,0 +1,191 @@
+"""
+計測付きのコネクションプール
+
+databases の Postgres バックエンドが作る asyncpg のプールをラップし、
+接続の取得に上限時間を設け、取得の待ち時間・タイムアウト・使用中の接続数を記録する。
+上限時間を超えた場合は PoolTimeout を送出する (API では 503 に変換する)。
+一定時間使った接続は返却時に閉じ、次の取得で新しい接続に置き換える。
+"""
+
+import asyncio
+import bisect
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.db.statements import StatementDatabase
+from databases.backends.postgres import PostgresBackend
+
+# 取得の待ち時間のヒストグラムの境界 (秒)
+ACQUIRE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class PoolTimeout(Exception):
+    """
+    acquire_timeout の間に接続を取得できなかった
+    """
+
+
+class Histogram:
+    """
+    累積のバケットを持つヒストグラム (Prometheus の histogram と同じ形)
+    """
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip((*self.buckets, float("inf")), self._counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {"buckets": buckets, "count": self.count, "sum": self.sum}
+
+
+class InstrumentedPool:
+    """
+    asyncpg のプールのラッパー
+
+    databases からは acquire / release / close だけが呼ばれる。
+    それ以外の属性は元のプールに委譲する。
+    """
+
+    def __init__(
+        self,
+        pool: Any,
+        *,
+        acquire_timeout: Optional[float],
+        max_lifetime: Optional[float],
+    ) -> None:
+        self._pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.acquire_wait = Histogram(ACQUIRE_WAIT_BUCKETS)
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.recycled = 0
+        # サーバーのプロセス ID ごとの接続の作成時刻 (init で記録する)
+        self._created_at: Dict[int, float] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._pool, name)
+
+    def record_connection(self, pid: int) -> None:
+        now = time.monotonic()
+        if self.max_lifetime:
+            # 閉じられた接続の記録が溜まらないように、寿命を大きく過ぎたものを捨てる
+            self._created_at = {
+                key: created_at
+                for key, created_at in self._created_at.items()
+                if now - created_at < 2 * self.max_lifetime
+            }
+        self._created_at[pid] = now
+
+    async def acquire(self) -> Any:
+        started_at = time.monotonic()
+        try:
+            connection = await self._pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.acquire_wait.observe(time.monotonic() - started_at)
+            raise PoolTimeout(
+                f"Timed out after {self.acquire_timeout}s waiting for a connection"
+            ) from None
+        self.acquisitions += 1
+        self.acquire_wait.observe(time.monotonic() - started_at)
+        return connection
+
+    async def release(self, connection: Any) -> None:
+        if self.max_lifetime and not connection.is_closed():
+            pid = connection.get_server_pid()
+            created_at = self._created_at.get(pid)
+            if created_at is None or time.monotonic() - created_at >= self.max_lifetime:
+                # 閉じた接続はプールから外れ、次の取得で新しい接続が作られる
+                self._created_at.pop(pid, None)
+                self.recycled += 1
+                await connection.close()
+        await self._pool.release(connection)
+
+    async def close(self) -> None:
+        await self._pool.close()
+
+    def stats(self) -> Dict[str, Any]:
+        size = self._pool.get_size()
+        idle = self._pool.get_idle_size()
+        return {
+            "min_size": self._pool.get_min_size(),
+            "max_size": self._pool.get_max_size(),
+            "size": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "acquisitions": self.acquisitions,
+            "timeouts": self.timeouts,
+            "recycled": self.recycled,
+            "acquire_wait_seconds": self.acquire_wait.snapshot(),
+        }
+
+
+class InstrumentedPostgresBackend(PostgresBackend):
+    """
+    InstrumentedPool を使う Postgres バックエンド
+
+    acquire_timeout と max_lifetime 以外のオプションは asyncpg.create_pool に渡される。
+    """
+
+    def __init__(
+        self,
+        database_url: Any,
+        *,
+        acquire_timeout: Optional[float] = None,
+        max_lifetime: Optional[float] = None,
+        **options: Any,
+    ) -> None:
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self._instrumented: Optional[InstrumentedPool] = None
+        super().__init__(database_url, init=self._init_connection, **options)
+
+    async def _init_connection(self, connection: Any) -> None:
+        if self._instrumented is not None:
+            self._instrumented.record_connection(connection.get_server_pid())
+
+    async def connect(self) -> None:
+        self._instrumented = InstrumentedPool(
+            None, acquire_timeout=self.acquire_timeout, max_lifetime=self.max_lifetime
+        )
+        await super().connect()
+        # create_pool の中で作られた最初の接続も init で記録されている
+        self._instrumented._pool = self._pool
+        self._pool = self._instrumented
+
+    async def disconnect(self) -> None:
+        await super().disconnect()
+        self._instrumented = None
+
+
+class InstrumentedDatabase(StatementDatabase):
+    """
+    Postgres の接続に InstrumentedPostgresBackend を使う Database
+
+    コンパイル済みの Statement は StatementDatabase の経路で asyncpg で直接実行する。
+    """
+
+    SUPPORTED_BACKENDS = {
+        **StatementDatabase.SUPPORTED_BACKENDS,
+        "postgresql": "app.db.pool:InstrumentedPostgresBackend",
+        "postgres": "app.db.pool:InstrumentedPostgresBackend",
+    }
+
+    def pool_stats(self) -> Dict[str, Any]:
+        pool = getattr(self._backend, "_pool", None)
+        if not isinstance(pool, InstrumentedPool):
+            return {}
+        return pool.stats()
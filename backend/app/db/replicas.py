@@ -0,0 +1,126 @@
+"""
+読み取り用のレプリカ
+
+読み取りのリクエストを遅延の小さいレプリカに振り分ける。
+遅延は一定間隔で測り、max_lag を超えたレプリカや接続できないレプリカ、
+プライマリから WAL を受信していないレプリカは使わない。
+使えるレプリカがなければ呼び出し元はプライマリで読む。
+"""
+
+import asyncio
+import itertools
+import logging
+from typing import Any, Dict, List, Optional
+
+from databases import Database
+
+logger = logging.getLogger(__name__)
+
+# レプリカが最後に適用したトランザクションからの経過秒数
+# WAL レシーバーがプライマリからストリーミングしていなければ NULL (使えない) を返す
+# (切断されていると、受信済みの WAL を適用し終えた時点で遅延がないように見えるため)。
+# status を読むには接続するロールに pg_read_all_stats が必要で、ない場合も NULL になる。
+# ストリーミング中で受信した WAL をすべて適用済みなら、プライマリに書き込みがないだけなので 0
+GET_REPLICA_LAG_QUERY = """
+    SELECT
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN NOT EXISTS (
+                SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming'
+            ) THEN NULL
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(
+                EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+            )
+        END;
+"""
+
+
+class ReplicaSet:
+    """
+    レプリカの接続と遅延を管理し、読み取りに使うレプリカを選ぶ
+    """
+
+    def __init__(
+        self, replicas: List[Database], *, max_lag: float, check_interval: float
+    ) -> None:
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # None は未計測か接続できないことを表す
+        self.lags: List[Optional[float]] = [None] * len(replicas)
+        self.reads = [0] * len(replicas)
+        self.fallbacks = 0
+        self._next = itertools.count()
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def connect(self) -> None:
+        for replica in self.replicas:
+            try:
+                await replica.connect()
+            except Exception as e:
+                logger.warning("--- REPLICA CONNECTION ERROR ---")
+                logger.warning(e)
+        await self.check_lag()
+        self._task = asyncio.create_task(self._check_lag_periodically())
+
+    async def disconnect(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for replica in self.replicas:
+            if replica.is_connected:
+                await replica.disconnect()
+
+    async def check_lag(self) -> None:
+        for index, replica in enumerate(self.replicas):
+            try:
+                if not replica.is_connected:
+                    await replica.connect()
+                lag = await replica.fetch_val(query=GET_REPLICA_LAG_QUERY)
+                if lag is None:
+                    logger.warning(
+                        "replica %d is not streaming from the primary", index
+                    )
+                    self.lags[index] = None
+                else:
+                    self.lags[index] = float(lag)
+            except Exception as e:
+                logger.warning("replica %d is unavailable: %s", index, e)
+                self.lags[index] = None
+
+    async def _check_lag_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_lag()
+
+    def choose(self) -> Optional[Database]:
+        """
+        遅延が max_lag 以下のレプリカを順番に返す (なければ None)
+        """
+        healthy = [
+            index
+            for index, lag in enumerate(self.lags)
+            if lag is not None and lag <= self.max_lag
+        ]
+        if not healthy:
+            self.fallbacks += 1
+            return None
+        index = healthy[next(self._next) % len(healthy)]
+        self.reads[index] += 1
+        return self.replicas[index]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "replicas": [
+                {
+                    "lag_seconds": lag,
+                    "reads": reads,
+                    "pool": (
+                        replica.pool_stats() if hasattr(replica, "pool_stats") else {}
+                    ),
+                }
+                for replica, lag, reads in zip(self.replicas, self.lags, self.reads)
+            ],
+            "fallbacks": self.fallbacks,
+        }
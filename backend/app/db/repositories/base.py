@@ -4,13 +4,32 @@
 リポジトリ パターンは、アプリケーションとデータストア（例えば、データベース）との間の抽象層を提供するデザインパターンのこと。
 """
 
+from typing import Optional
+
+from app.db.cache import RepositoryCache, repository_cache
 from databases import Database
 
 
 class BaseRepository:
     """
-    データベースコネクションへの参照を保持する
+    データベースコネクションとキャッシュへの参照を保持する
+
+    キャッシュは app.db.cache の @cached / @invalidates でメソッドごとに利用する。
+    読み取りのメソッド (get_*) は read_db を使い、書き込みは db (プライマリ) を使う。
+    read_db はリクエストに応じてレプリカかプライマリが渡される (省略時は db)。
+    レプリカで読んだ結果はキャッシュに入れない (@cached を参照)。
     """
 
-    def __init__(self, db: Database) -> None:
+    def __init__(
+        self,
+        db: Database,
+        cache: Optional[RepositoryCache] = None,
+        read_db: Optional[Database] = None,
+    ) -> None:
         self.db = db
+        self.read_db = read_db if read_db is not None else db
+        self.cache = cache if cache is not None else repository_cache
+
+    @property
+    def reads_from_replica(self) -> bool:
+        return self.read_db is not self.db
@@ -1,42 +1,312 @@
-from typing import List
+import html
+import logging
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
+from app.db.cache import cached, invalidates
+from app.db.hydration import hydrate, hydrate_all
 from app.db.repositories.base import BaseRepository
-from app.models.hedgehog import HedgehogCreate, HedgehogInDB, HedgehogUpdate
+from app.db.statements import Statement, statement
+from app.models.hedgehog import (
+    HedgehogAgeBucket,
+    HedgehogColorTypeCount,
+    HedgehogCreate,
+    HedgehogFilter,
+    HedgehogInDB,
+    HedgehogSearchResult,
+    HedgehogStats,
+    HedgehogUpdate,
+)
+from asyncpg.exceptions import DataError, IntegrityConstraintViolationError
 from fastapi import HTTPException
-from starlette.status import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
+from starlette.status import HTTP_400_BAD_REQUEST, HTTP_412_PRECONDITION_FAILED
 
-CREATE_HEDGEHOG_QUERY = """
+logger = logging.getLogger(__name__)
+
+CREATE_HEDGEHOG_QUERY = Statement(
+    """
     INSERT INTO hedgehogs (name, description, age, color_type)
     VALUES (:name, :description, :age, :color_type)
-    RETURNING id, name, description, age, color_type;
+    RETURNING id, name, description, age, color_type, version;
+"""
+)
+
+# 配列パラメータを unnest して1文で複数行を登録する
+# RETURNING の順序は保証されないので、配列の位置 (ordinality) ごとに先に id を採番し、
+# 位置と id の組を位置の順に返す
+BULK_CREATE_HEDGEHOGS_QUERY = Statement(
+    """
+    WITH new_rows AS (
+        SELECT
+            t.*,
+            nextval(pg_get_serial_sequence('hedgehogs', 'id')) AS id
+        FROM unnest(
+            CAST(:names AS TEXT[]),
+            CAST(:descriptions AS TEXT[]),
+            CAST(:ages AS NUMERIC[]),
+            CAST(:color_types AS TEXT[])
+        ) WITH ORDINALITY AS t(name, description, age, color_type, ordinality)
+    ), inserted AS (
+        INSERT INTO hedgehogs (id, name, description, age, color_type)
+        SELECT id, name, description, age, color_type
+        FROM new_rows
+        RETURNING id
+    )
+    SELECT new_rows.ordinality, inserted.id
+    FROM new_rows
+        JOIN inserted ON inserted.id = new_rows.id
+    ORDER BY new_rows.ordinality;
 """
+)
 
-GET_HEDGEHOG_BY_ID_QUERY = """
-    SELECT id, name, description, age, color_type
+GET_HEDGEHOG_BY_ID_QUERY = Statement(
+    """
+    SELECT id, name, description, age, color_type, version
     FROM hedgehogs
     WHERE id = :id;
 """
+)
+
+GET_ALL_HEDGEHOGS_QUERY = Statement(
+    """
+    SELECT id, name, description, age, color_type, version
+    FROM hedgehogs
+    ORDER BY id;
+"""
+)
+
+# 主キーでシークするキーセットページネーション
+# WHERE 句は build_hedgehogs_where_clause で固定の条件だけから組み立てる
+GET_HEDGEHOGS_PAGE_QUERY = """
+    SELECT id, name, description, age, color_type, version
+    FROM hedgehogs
+    {where_clause}
+    ORDER BY id
+    LIMIT :limit;
+"""
+
+# 一致した行を順位の降順 (同順位は id の昇順) で並べ、ページ内の行だけ見出しを作る
+# ts_headline は重いので、LIMIT で絞り込んだ後に計算する
+SEARCH_HEDGEHOGS_QUERY = """
+    WITH search AS (
+        SELECT websearch_to_tsquery('english', :q) AS query
+    ), matches AS (
+        SELECT h.id, h.name, h.description, h.age, h.color_type,
+               ts_rank_cd(h.search_vector, search.query) AS rank
+        FROM hedgehogs h, search
+        WHERE h.search_vector @@ search.query
+    ), page AS (
+        SELECT *
+        FROM matches
+        {after_clause}
+        ORDER BY rank DESC, id
+        LIMIT :limit
+    )
+    SELECT page.*,
+           ts_headline(
+               'english', translate(page.name, :markers, ''),
+               search.query, :name_options
+           ) AS name_highlight,
+           CASE WHEN page.description IS NOT NULL
+               THEN ts_headline(
+                   'english', translate(page.description, :markers, ''),
+                   search.query, :snippet_options
+               )
+           END AS snippet
+    FROM page, search
+    ORDER BY page.rank DESC, page.id;
+"""
+
+SEARCH_HEDGEHOGS_AFTER_CLAUSE = """
+        WHERE rank < :after_rank OR (rank = :after_rank AND id > :after_id)
+"""
+
+# 一致した語は制御文字で囲んで返し、HTML エスケープしてから <mark> に置き換える
+# (元の文字列に含まれる制御文字は、見出しを作る前に translate で取り除く)
+HEADLINE_START = "\x01"
+HEADLINE_STOP = "\x02"
+HEADLINE_NAME_OPTIONS = (
+    f"StartSel={HEADLINE_START}, StopSel={HEADLINE_STOP}, HighlightAll=true"
+)
+HEADLINE_SNIPPET_OPTIONS = (
+    f"StartSel={HEADLINE_START}, StopSel={HEADLINE_STOP}, MaxWords=35, MinWords=15, "
+    'MaxFragments=2, FragmentDelimiter=" ... "'
+)
+
+
+def render_headline(headline: Optional[str]) -> Optional[str]:
+    """
+    ts_headline の結果を HTML エスケープし、一致した語を <mark> で囲む
+    """
+    if headline is None:
+        return None
+    return (
+        html.escape(headline)
+        .replace(HEADLINE_START, "<mark>")
+        .replace(HEADLINE_STOP, "</mark>")
+    )
+
+
+# COUNT(*) の代わりにプランナの統計情報から行数の概算を取得する
+GET_APPROXIMATE_HEDGEHOGS_COUNT_QUERY = Statement(
+    """
+    SELECT GREATEST(reltuples, 0)::bigint AS estimate
+    FROM pg_class
+    WHERE oid = 'hedgehogs'::regclass;
+"""
+)
 
-GET_ALL_HEDGEHOGS_QUERY = """
-    SELECT id, name, description, age, color_type
-    FROM hedgehogs;
+# 集計テーブルはトリガーで書き込みのたびに更新されるので、件数は区間の数だけで済む
+GET_HEDGEHOG_STATS_QUERY = Statement(
+    """
+    SELECT color_type, age_bucket, count, age_sum
+    FROM hedgehog_stats
+    WHERE count > 0
+    ORDER BY color_type, age_bucket;
 """
+)
+
+# 変更カウンタは書き込みが1行に集中しないよう複数の行に分けてあるので、合計を読む
+GET_HEDGEHOGS_TABLE_VERSION_QUERY = Statement(
+    """
+    SELECT CAST(sum(version) AS BIGINT)
+    FROM table_versions
+    WHERE table_name = 'hedgehogs';
+"""
+)
+
+# 更新できるカラム。SET 句はここに含まれるカラムからのみ組み立てる
+HEDGEHOG_UPDATABLE_COLUMNS = ("name", "description", "age", "color_type")
 
 UPDATE_HEDGEHOG_BY_ID_QUERY = """
     UPDATE hedgehogs
-    SET name          = :name,
-        description   = :description,
-        age           = :age,
-        color_type = :color_type
+    SET {set_clause}
     WHERE id = :id
-    RETURNING id, name, description, age, color_type;
+    RETURNING id, name, description, age, color_type, version;
+"""
+
+# バージョンが一致しない場合でも、対象の有無 (404 と 412 の区別) を同じ文で返す
+UPDATE_HEDGEHOG_BY_ID_AND_VERSION_QUERY = """
+    WITH target AS (
+        SELECT id FROM hedgehogs WHERE id = :id
+    ), updated AS (
+        UPDATE hedgehogs
+        SET {set_clause}
+        WHERE id = :id AND version = ANY(CAST(:versions AS INTEGER[]))
+        RETURNING id, name, description, age, color_type, version
+    )
+    SELECT updated.*
+    FROM target
+        LEFT JOIN updated
+        ON updated.id = target.id;
 """
 
-DELETE_HEDGEHOG_BY_ID_QUERY = """
+# 更新する項目がない場合に、更新と同じ条件で現在の行を返す
+GET_HEDGEHOG_BY_ID_AND_VERSION_QUERY = Statement(
+    """
+    WITH target AS (
+        SELECT id FROM hedgehogs WHERE id = :id
+    ), current AS (
+        SELECT id, name, description, age, color_type, version
+        FROM hedgehogs
+        WHERE id = :id AND version = ANY(CAST(:versions AS INTEGER[]))
+    )
+    SELECT current.*
+    FROM target
+        LEFT JOIN current
+        ON current.id = target.id;
+"""
+)
+
+DELETE_HEDGEHOG_BY_ID_QUERY = Statement(
+    """
     DELETE FROM hedgehogs
     WHERE id = :id
     RETURNING id;
 """
+)
+
+DELETE_HEDGEHOG_BY_ID_AND_VERSION_QUERY = Statement(
+    """
+    WITH target AS (
+        SELECT id FROM hedgehogs WHERE id = :id
+    ), deleted AS (
+        DELETE FROM hedgehogs
+        WHERE id = :id AND version = ANY(CAST(:versions AS INTEGER[]))
+        RETURNING id
+    )
+    SELECT deleted.id
+    FROM target
+        LEFT JOIN deleted
+        ON deleted.id = target.id;
+"""
+)
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def build_hedgehogs_where_clause(
+    filters: HedgehogFilter, *, after_id: Optional[int]
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    絞り込み条件からパラメータ化された WHERE 句と値を作る
+
+    それぞれの条件は ca1496be7cd7 で作成した索引で処理できる形にしている。
+    """
+    conditions: List[str] = []
+    values: Dict[str, Any] = {}
+    if after_id is not None:
+        conditions.append("id > :after_id")
+        values["after_id"] = after_id
+    if filters.color_type is not None:
+        conditions.append("color_type = :color_type")
+        values["color_type"] = filters.color_type.value
+    if filters.min_age is not None:
+        conditions.append("age >= :min_age")
+        values["min_age"] = filters.min_age
+    if filters.max_age is not None:
+        conditions.append("age <= :max_age")
+        values["max_age"] = filters.max_age
+    if filters.name_prefix:
+        # 前方一致は C 照合順序での範囲検索にする ('abc' <= name < 'abd')
+        prefix = filters.name_prefix
+        conditions.append('name COLLATE "C" >= :name_prefix_lower')
+        values["name_prefix_lower"] = prefix
+        if ord(prefix[-1]) < 0x10FFFF:
+            conditions.append('name COLLATE "C" < :name_prefix_upper')
+            values["name_prefix_upper"] = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    if filters.name_contains:
+        conditions.append("name ILIKE :name_contains")
+        values["name_contains"] = f"%{escape_like(filters.name_contains)}%"
+
+    if not conditions:
+        return "", values
+    return "WHERE " + " AND ".join(conditions), values
+
+
+@lru_cache(maxsize=None)
+def build_update_hedgehog_query(
+    columns: Tuple[str, ...], *, check_version: bool
+) -> Statement:
+    """
+    更新するカラムから SET 句を生成する (カラムの組み合わせごとにキャッシュする)
+
+    更新するカラムがなければ、バージョンを上げずに現在の行を読む文を返す。
+    """
+    if not columns:
+        if check_version:
+            return GET_HEDGEHOG_BY_ID_AND_VERSION_QUERY
+        return GET_HEDGEHOG_BY_ID_QUERY
+    set_clause = ", ".join(
+        [f"{column} = :{column}" for column in columns] + ["version = version + 1"]
+    )
+    if check_version:
+        return Statement(
+            UPDATE_HEDGEHOG_BY_ID_AND_VERSION_QUERY.format(set_clause=set_clause)
+        )
+    return Statement(UPDATE_HEDGEHOG_BY_ID_QUERY.format(set_clause=set_clause))
 
 
 class HedgehogsRepository(BaseRepository):
@@ -46,58 +316,205 @@ class HedgehogsRepository(BaseRepository):
             query=CREATE_HEDGEHOG_QUERY, values=query_values
         )
 
-        return HedgehogInDB(**hedgehog)
+        return hydrate(HedgehogInDB, hedgehog)
+
+    async def bulk_create_hedgehogs(
+        self, *, new_hedgehogs: List[HedgehogCreate]
+    ) -> List[int]:
+        """
+        複数のハリネズミを1回のラウンドトリップで登録し、作成された id を
+        new_hedgehogs と同じ順に返す
+        """
+        values = {
+            "names": [hedgehog.name for hedgehog in new_hedgehogs],
+            "descriptions": [hedgehog.description for hedgehog in new_hedgehogs],
+            "ages": [hedgehog.age for hedgehog in new_hedgehogs],
+            "color_types": [hedgehog.color_type.value for hedgehog in new_hedgehogs],
+        }
+        records = await self.db.fetch_all(
+            query=BULK_CREATE_HEDGEHOGS_QUERY, values=values
+        )
+        return [record["id"] for record in records]
 
+    @cached("hedgehog:{id}", tags=("hedgehog:{id}",))
     async def get_hedgehog_by_id(self, *, id: int) -> HedgehogInDB:
-        hedgehog = await self.db.fetch_one(
+        hedgehog = await self.read_db.fetch_one(
             query=GET_HEDGEHOG_BY_ID_QUERY, values={"id": id}
         )
         if not hedgehog:
             return None
-        return HedgehogInDB(**hedgehog)
+        return hydrate(HedgehogInDB, hedgehog)
 
-    async def get_all_hedgehogs(self) -> List[HedgehogInDB]:
-        hedgehog_records = await self.db.fetch_all(query=GET_ALL_HEDGEHOGS_QUERY)
-        return [HedgehogInDB(**item) for item in hedgehog_records]
+    async def get_all_hedgehogs(
+        self,
+        *,
+        limit: int,
+        after_id: Optional[int] = None,
+        filters: Optional[HedgehogFilter] = None,
+    ) -> List[HedgehogInDB]:
+        """
+        条件に合うハリネズミを id の昇順で after_id より後ろから最大 limit 件取得する
+        """
+        where_clause, values = build_hedgehogs_where_clause(
+            filters or HedgehogFilter(), after_id=after_id
+        )
+        hedgehog_records = await self.read_db.fetch_all(
+            query=statement(GET_HEDGEHOGS_PAGE_QUERY.format(where_clause=where_clause)),
+            values={**values, "limit": limit},
+        )
+        return hydrate_all(HedgehogInDB, hedgehog_records)
 
-    async def update_hedgehog(
-        self, *, id: int, hedgehog_update: HedgehogUpdate
-    ) -> HedgehogInDB:
-        # 1. ハリネズミが存在するか確認
-        hedgehog = await self.get_hedgehog_by_id(id=id)
-        if not hedgehog:
-            return None
+    async def search_hedgehogs(
+        self,
+        *,
+        q: str,
+        limit: int,
+        after: Optional[Tuple[float, int]] = None,
+    ) -> List[HedgehogSearchResult]:
+        """
+        名前と説明を全文検索し、順位の高い順に最大 limit 件返す
 
-        # 2. ハリネズミの更新情報を取得して、色のタイプがNoneでないことを確認
-        hedgehog_update_params = hedgehog.model_copy(
-            update=hedgehog_update.model_dump(exclude_unset=True)
+        after には前のページの最後の行の (rank, id) を渡す。
+        """
+        values: Dict[str, Any] = {
+            "q": q,
+            "limit": limit,
+            "name_options": HEADLINE_NAME_OPTIONS,
+            "snippet_options": HEADLINE_SNIPPET_OPTIONS,
+            "markers": HEADLINE_START + HEADLINE_STOP,
+        }
+        after_clause = ""
+        if after is not None:
+            after_clause = SEARCH_HEDGEHOGS_AFTER_CLAUSE
+            values["after_rank"], values["after_id"] = after
+        records = await self.read_db.fetch_all(
+            query=statement(SEARCH_HEDGEHOGS_QUERY.format(after_clause=after_clause)),
+            values=values,
         )
-        if hedgehog_update_params.color_type is None:
+        results = hydrate_all(HedgehogSearchResult, records)
+        for result in results:
+            result.name_highlight = render_headline(result.name_highlight)
+            result.snippet = render_headline(result.snippet)
+        return results
+
+    async def get_hedgehogs_table_version(self) -> int:
+        """
+        hedgehogs テーブルへの書き込みのたびに加算される変更カウンタを取得する
+        """
+        return await self.read_db.fetch_val(query=GET_HEDGEHOGS_TABLE_VERSION_QUERY)
+
+    async def iterate_all_hedgehogs(self) -> AsyncIterator[HedgehogInDB]:
+        """
+        サーバーサイドカーソルで全件を1行ずつ取得する
+
+        全件をメモリに載せないため、大量のエクスポートに使う。
+        """
+        async for record in self.read_db.iterate(query=GET_ALL_HEDGEHOGS_QUERY):
+            yield hydrate(HedgehogInDB, record)
+
+    async def get_hedgehog_stats(self) -> HedgehogStats:
+        """
+        集計テーブルから color_type ごとの件数と年齢のヒストグラムを組み立てる
+        """
+        records = await self.read_db.fetch_all(query=GET_HEDGEHOG_STATS_QUERY)
+        total = 0
+        age_sum = 0
+        by_color_type: Dict[str, int] = {}
+        by_age_bucket: Dict[int, int] = {}
+        for record in records:
+            total += record["count"]
+            age_sum += record["age_sum"]
+            color_type, age_bucket = record["color_type"], record["age_bucket"]
+            by_color_type[color_type] = (
+                by_color_type.get(color_type, 0) + record["count"]
+            )
+            by_age_bucket[age_bucket] = (
+                by_age_bucket.get(age_bucket, 0) + record["count"]
+            )
+
+        return HedgehogStats(
+            total=total,
+            average_age=float(age_sum / total) if total else None,
+            by_color_type=[
+                HedgehogColorTypeCount(color_type=color_type, count=count)
+                for color_type, count in sorted(by_color_type.items())
+            ],
+            age_histogram=[
+                HedgehogAgeBucket(age_from=bucket, age_to=bucket + 1, count=count)
+                for bucket, count in sorted(by_age_bucket.items())
+            ],
+        )
+
+    async def get_approximate_hedgehogs_count(self) -> int:
+        return await self.read_db.fetch_val(query=GET_APPROXIMATE_HEDGEHOGS_COUNT_QUERY)
+
+    @invalidates("hedgehog:{id}")
+    async def update_hedgehog(
+        self,
+        *,
+        id: int,
+        hedgehog_update: HedgehogUpdate,
+        expected_versions: Optional[List[int]] = None,
+    ) -> Optional[HedgehogInDB]:
+        """
+        送られてきた項目だけを1文で更新する
+
+        expected_versions を指定した場合、どのバージョンとも一致しなければ 412 を返す。
+        """
+        update_params = hedgehog_update.model_dump(exclude_unset=True)
+        if "color_type" in update_params and update_params["color_type"] is None:
             raise HTTPException(
                 status_code=HTTP_400_BAD_REQUEST,
                 detail="Invalid color type. Cannot be None.",
             )
 
-        # 3. ハリネズミを更新
-        try:
-            update_hedgehog = await self.db.fetch_one(  # 一つだけレコードを取得
-                query=UPDATE_HEDGEHOG_BY_ID_QUERY,
-                values=hedgehog_update_params.model_dump(),
-            )
-            return HedgehogInDB(**update_hedgehog)
+        columns = tuple(
+            column for column in HEDGEHOG_UPDATABLE_COLUMNS if column in update_params
+        )
+        query = build_update_hedgehog_query(
+            columns, check_version=expected_versions is not None
+        )
+        values = {column: update_params[column] for column in columns}
+        values["id"] = id
+        if expected_versions is not None:
+            values["versions"] = expected_versions
 
-        except Exception as e:
-            print(e)
+        try:
+            updated_hedgehog = await self.db.fetch_one(query=query, values=values)
+        except (DataError, IntegrityConstraintViolationError) as e:
+            # 値の範囲や制約の違反だけを 400 にする (接続の障害などはそのまま送出する)
+            logger.info("Rejected update of hedgehog %d: %s", id, e)
             raise HTTPException(
                 status_code=HTTP_400_BAD_REQUEST, detail="Invalid update params."
-            )
+            ) from e
 
-    async def delete_hedgehog_by_id(self, *, id: int) -> int:
-        # 1. ハリネズミを取得
-        hedgehog = await self.get_hedgehog_by_id(id=id)
-        if not hedgehog:
+        if not updated_hedgehog:
             return None
-        delete_id = await self.db.execute(
-            query=DELETE_HEDGEHOG_BY_ID_QUERY, values={"id": id}
+        if updated_hedgehog["id"] is None:
+            raise HTTPException(
+                status_code=HTTP_412_PRECONDITION_FAILED,
+                detail="Hedgehog has been modified.",
+            )
+        return hydrate(HedgehogInDB, updated_hedgehog)
+
+    @invalidates("hedgehog:{id}")
+    async def delete_hedgehog_by_id(
+        self, *, id: int, expected_versions: Optional[List[int]] = None
+    ) -> Optional[int]:
+        if expected_versions is None:
+            return await self.db.execute(
+                query=DELETE_HEDGEHOG_BY_ID_QUERY, values={"id": id}
+            )
+
+        deleted = await self.db.fetch_one(
+            query=DELETE_HEDGEHOG_BY_ID_AND_VERSION_QUERY,
+            values={"id": id, "versions": expected_versions},
         )
-        return delete_id
+        if not deleted:
+            return None
+        if deleted["id"] is None:
+            raise HTTPException(
+                status_code=HTTP_412_PRECONDITION_FAILED,
+                detail="Hedgehog has been modified.",
+            )
+        return deleted["id"]
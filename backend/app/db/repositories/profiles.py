@@ -1,18 +1,41 @@
+from typing import Dict, List, Optional, Tuple
+
+from app.db.cache import RepositoryCache, cached, invalidates
+from app.db.hydration import hydrate
+from app.db.loaders import BatchLoader
 from app.db.repositories.base import BaseRepository
+from app.db.statements import Statement, statement
 from app.models.profile import ProfileCreate, ProfileInDB, ProfileUpdate
-from app.models.user import UserInDB
+from app.models.user import UserPrincipal
+from databases import Database
 
-CREATE_PROFILE_FOR_USER_QUERY = """
+CREATE_PROFILE_FOR_USER_QUERY = Statement(
+    """
     INSERT INTO profiles (full_name, phone_number, bio, image, user_id)
     VALUES (:full_name, :phone_number, :bio, :image, :user_id)
     RETURNING id, full_name, phone_number, bio, image, user_id, created_at, updated_at;
 """
-GET_PROFILE_BY_USER_ID_QUERY = """
-    SELECT id, full_name, phone_number, bio, image, user_id, created_at, updated_at
-    FROM profiles
-    WHERE user_id = :user_id;
+)
+GET_PROFILES_BY_USER_IDS_QUERY = Statement(
+    """
+    SELECT p.id,
+           u.email AS email,
+           u.username AS username,
+           full_name,
+           phone_number,
+           bio,
+           image,
+           user_id,
+           p.created_at,
+           p.updated_at
+    FROM profiles p
+        INNER JOIN users u
+        ON p.user_id = u.id
+    WHERE user_id = ANY(:user_ids);
 """
-GET_PROFILE_BY_USERNAME_QUERY = """
+)
+GET_PROFILE_BY_USERNAME_QUERY = Statement(
+    """
     SELECT p.id,
            u.email AS email,
            u.username AS username,
@@ -28,18 +51,48 @@ GET_PROFILE_BY_USERNAME_QUERY = """
         ON p.user_id = u.id
     WHERE user_id = (SELECT id FROM users WHERE username = :username);
 """
+)
+PROFILE_UPDATABLE_COLUMNS = ("full_name", "phone_number", "bio", "image")
+
 UPDATE_PROFILE_QUERY = """
-    UPDATE profiles
-    SET full_name    = :full_name,
-        phone_number = :phone_number,
-        bio          = :bio,
-        image        = :image
-    WHERE user_id = :user_id
-    RETURNING id, full_name, phone_number, bio, image, user_id, created_at, updated_at;
+    WITH updated AS (
+        UPDATE profiles
+        SET {set_clause}
+        WHERE user_id = :user_id
+        RETURNING id, full_name, phone_number, bio, image, user_id, created_at, updated_at
+    )
+    SELECT updated.*, u.email AS email, u.username AS username
+    FROM updated
+        INNER JOIN users u
+        ON updated.user_id = u.id;
 """
 
 
+def build_update_profile_query(columns: Tuple[str, ...]) -> Statement:
+    """
+    更新するカラムから SET 句を生成する
+
+    送られてきた項目だけを書き換えるので、事前に行を読む必要がない
+    (読んだ値を書き戻すと、その間の他の更新を上書きしてしまう)。
+    項目がない場合も、現在の行を返すために同じ値で更新する。
+    """
+    set_clause = ", ".join(f"{column} = :{column}" for column in columns)
+    return statement(
+        UPDATE_PROFILE_QUERY.format(set_clause=set_clause or "user_id = user_id")
+    )
+
+
 class ProfilesRepository(BaseRepository):
+    def __init__(
+        self,
+        db: Database,
+        cache: Optional[RepositoryCache] = None,
+        read_db: Optional[Database] = None,
+    ) -> None:
+        super().__init__(db, cache, read_db)
+        # 同じリクエスト内で並行して取得されるプロフィールを1回の問い合わせにまとめる
+        self.profile_loader = BatchLoader(self.get_profiles_by_user_ids)
+
     async def create_profile_for_user(
         self, *, profile_create: ProfileCreate
     ) -> ProfileInDB:
@@ -48,36 +101,47 @@ class ProfilesRepository(BaseRepository):
         )
         return created_profile
 
+    @cached("profile:user_id:{user_id}", tags=("user:{user_id}",))
     async def get_profile_by_user_id(self, *, user_id: int) -> ProfileInDB:
-        profile_record = await self.db.fetch_one(
-            query=GET_PROFILE_BY_USER_ID_QUERY, values={"user_id": user_id}
+        return await self.profile_loader.load(user_id)
+
+    async def get_profiles_by_user_ids(
+        self, user_ids: List[int]
+    ) -> Dict[int, ProfileInDB]:
+        """
+        複数のユーザーのプロフィールを1回で取得し、ユーザーの ID ごとに返す
+        """
+        profile_records = await self.read_db.fetch_all(
+            query=GET_PROFILES_BY_USER_IDS_QUERY, values={"user_ids": user_ids}
         )
-        if not profile_record:
-            return None
-        return ProfileInDB(**profile_record)
+        return {
+            record["user_id"]: hydrate(ProfileInDB, record)
+            for record in profile_records
+        }
 
+    @cached("profile:username:{username}", tags=("user:{result.user_id}",))
     async def get_profile_by_username(self, *, username: str) -> ProfileInDB:
-        profile_record = await self.db.fetch_one(
+        profile_record = await self.read_db.fetch_one(
             query=GET_PROFILE_BY_USERNAME_QUERY, values={"username": username}
         )
         if not profile_record:
             return None
-        return ProfileInDB(**profile_record)
+        return hydrate(ProfileInDB, profile_record)
 
+    @invalidates("user:{requesting_user.id}")
     async def update_profile(
-        self, *, profile_update: ProfileUpdate, requeazing_user: UserInDB
+        self, *, profile_update: ProfileUpdate, requesting_user: UserPrincipal
     ) -> ProfileInDB:
         """
         ユーザーのプロフィールを更新するデータベース操作に関する関数
         """
-        profile = await self.get_profile_by_user_id(user_id=requeazing_user.id)
-        update_params = profile.model_copy(
-            update=profile_update.model_dump(exclude_unset=True)
+        update_params = profile_update.model_dump(mode="json", exclude_unset=True)
+        columns = tuple(
+            column for column in PROFILE_UPDATABLE_COLUMNS if column in update_params
         )
+        values = {column: update_params[column] for column in columns}
+        values["user_id"] = requesting_user.id
         update_profile = await self.db.fetch_one(
-            query=UPDATE_PROFILE_QUERY,
-            values=update_params.model_dump(
-                exclude={"id", "user_id", "created_at", "updated_at"}
-            ),
+            query=build_update_profile_query(columns), values=values
         )
-        return ProfileInDB(**update_profile)
+        return hydrate(ProfileInDB, update_profile)
@@ -0,0 +1,115 @@
+import random
+from typing import List
+
+from app.core.config import RATE_LIMIT_PRUNE_PROBABILITY
+from app.db.repositories.base import BaseRepository
+from app.db.statements import Statement
+from app.models.rate_limit import RateLimit, RateLimitResult
+
+# バケットがなければ満タンの状態で作る
+# (キーの順に作るので、同時に呼ばれてもデッドロックしない)
+CREATE_RATE_LIMIT_BUCKETS_QUERY = Statement(
+    """
+    INSERT INTO rate_limit_buckets AS b
+        (key, capacity, refill_per_second, tokens, allowed, updated_at)
+    SELECT key, capacity, refill_per_second, capacity, TRUE, statement_timestamp()
+    FROM unnest(
+        CAST(:keys AS TEXT[]),
+        CAST(:capacities AS DOUBLE PRECISION[]),
+        CAST(:refill_rates AS DOUBLE PRECISION[])
+    ) AS l(key, capacity, refill_per_second)
+    ORDER BY key
+    ON CONFLICT (key) DO NOTHING;
+"""
+)
+
+# バケットをキーの順にロックして前回からの経過時間の分だけ回復させ (capacity が上限)、
+# すべてのバケットに1回分あるときだけ、すべてから1回分ずつ取り出す。
+# 1つでも足りなければどのバケットも書き換えない
+TAKE_RATE_LIMIT_TOKENS_QUERY = Statement(
+    """
+    WITH l AS (
+        SELECT *
+        FROM unnest(
+            CAST(:keys AS TEXT[]),
+            CAST(:capacities AS DOUBLE PRECISION[]),
+            CAST(:refill_rates AS DOUBLE PRECISION[])
+        ) AS l(key, capacity, refill_per_second)
+    ), locked AS (
+        SELECT b.key, l.capacity, l.refill_per_second,
+               LEAST(
+                   l.capacity,
+                   b.tokens + EXTRACT(EPOCH FROM statement_timestamp() - b.updated_at)
+                       * l.refill_per_second
+               ) AS tokens
+        FROM rate_limit_buckets AS b
+        JOIN l ON l.key = b.key
+        ORDER BY b.key
+        FOR UPDATE OF b
+    ), decision AS (
+        SELECT bool_and(tokens >= 1) AS allowed FROM locked
+    ), taken AS (
+        UPDATE rate_limit_buckets AS b SET
+            capacity = locked.capacity,
+            refill_per_second = locked.refill_per_second,
+            tokens = locked.tokens - 1,
+            allowed = TRUE,
+            updated_at = statement_timestamp()
+        FROM locked, decision
+        WHERE b.key = locked.key AND decision.allowed
+    )
+    SELECT locked.key, locked.tokens, locked.tokens >= 1 AS allowed,
+           locked.refill_per_second, decision.allowed AS all_allowed
+    FROM locked, decision;
+"""
+)
+
+# 満タンまで回復しているバケットは、行がない状態と同じなので消してよい
+PRUNE_RATE_LIMIT_BUCKETS_QUERY = Statement(
+    """
+    DELETE FROM rate_limit_buckets
+    WHERE updated_at
+        + make_interval(secs => capacity / refill_per_second) < statement_timestamp();
+"""
+)
+
+
+class RateLimitsRepository(BaseRepository):
+    """
+    Postgres に置いたトークンバケットで、全ワーカー共通のレート制限を行う
+    """
+
+    async def take_tokens(self, *, limits: List[RateLimit]) -> RateLimitResult:
+        """
+        すべてのバケットから1回分ずつ取り出す
+
+        1つでも足りなければ拒否し、どのバケットからも取り出さない。
+        """
+        values = {
+            "keys": [limit.key for limit in limits],
+            "capacities": [limit.capacity for limit in limits],
+            "refill_rates": [limit.refill_per_second for limit in limits],
+        }
+        # 作ったバケットは同じ文からは見えないので、作る文とロックする文を分ける
+        async with self.db.transaction():
+            await self.db.execute(query=CREATE_RATE_LIMIT_BUCKETS_QUERY, values=values)
+            records = await self.db.fetch_all(
+                query=TAKE_RATE_LIMIT_TOKENS_QUERY, values=values
+            )
+        if random.random() < RATE_LIMIT_PRUNE_PROBABILITY:
+            await self.prune_buckets()
+
+        if all(record["all_allowed"] for record in records):
+            return RateLimitResult(allowed=True)
+        denied = [record for record in records if not record["allowed"]]
+        return RateLimitResult(
+            allowed=False,
+            retry_after=max(
+                (1 - record["tokens"]) / record["refill_per_second"]
+                for record in denied
+            ),
+            denied_keys=sorted(record["key"] for record in denied),
+        )
+
+    async def prune_buckets(self) -> None:
+        await self.db.execute(query=PRUNE_RATE_LIMIT_BUCKETS_QUERY)
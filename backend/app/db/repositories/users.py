@@ -1,15 +1,27 @@
-from typing import Optional
+from typing import Any, Dict, List, Mapping, Optional
 
+from app.core.config import AUTH_PRINCIPAL_CACHE_TTL_SECONDS
+from app.db.cache import RepositoryCache, cached, invalidates
+from app.db.hydration import hydrate
+from app.db.loaders import BatchLoader
 from app.db.repositories.base import BaseRepository
 from app.db.repositories.profiles import ProfilesRepository
-from app.models.profile import ProfileCreate, ProfilePublic
-from app.models.user import UserCreate, UserInDB, UserPublic
+from app.db.statements import Statement
+from app.models.profile import ProfilePublic
+from app.models.user import (
+    UserCreate,
+    UserInDB,
+    UserPasswordUpdate,
+    UserPrincipal,
+    UserPublic,
+)
 from app.services import auth_service
 from databases import Database
 from fastapi import HTTPException, status
 from pydantic import EmailStr
 
-GET_USER_BY_EMAIL_QUERY = """
+GET_USER_BY_EMAIL_QUERY = Statement(
+    """
     SELECT
         id, username, email, email_verified, password,
         salt, is_active, is_superuser, created_at, updated_at
@@ -18,80 +30,262 @@ GET_USER_BY_EMAIL_QUERY = """
     WHERE
         email = :email;
 """
-GET_USER_BY_USERNAME_QUERY = """
+)
+GET_USERS_BY_USERNAMES_QUERY = Statement(
+    """
     SELECT
         id, username, email, email_verified, password,
         salt, is_active, is_superuser, created_at, updated_at
     FROM
         users
     WHERE
-        username = :username;
+        username = ANY(:usernames);
 """
-REGISTER_NEW_USER_QUERY = """
-    INSERT INTO users
-        (username, email, password, salt)
-    VALUES
-        (:username, :email, :password, :salt)
+)
+# プロフィールも必要な場合は、ユーザーと結合して1回で取得する
+# (プロフィールの列は profile_ を付けて返し、build_user_public で組み立てる)
+GET_USER_WITH_PROFILE_QUERY = """
+    SELECT
+        u.id, u.username, u.email, u.email_verified, u.password,
+        u.salt, u.is_active, u.is_superuser, u.created_at, u.updated_at,
+        p.id AS profile_id,
+        p.full_name AS profile_full_name,
+        p.phone_number AS profile_phone_number,
+        p.bio AS profile_bio,
+        p.image AS profile_image,
+        p.created_at AS profile_created_at,
+        p.updated_at AS profile_updated_at
+    FROM
+        users u
+        LEFT JOIN profiles p
+        ON p.user_id = u.id
+    WHERE
+        {condition};
+"""
+GET_USER_WITH_PROFILE_BY_EMAIL_QUERY = Statement(
+    GET_USER_WITH_PROFILE_QUERY.format(condition="u.email = :email")
+)
+GET_USERS_WITH_PROFILE_BY_USERNAMES_QUERY = Statement(
+    GET_USER_WITH_PROFILE_QUERY.format(condition="u.username = ANY(:usernames)")
+)
+# ユーザーとプロフィールの作成、重複の判定を1文で行う
+# 重複していれば new_user は空になり、どちらの一意制約に当たったかを *_taken で返す
+# (EXISTS は文の開始時点のスナップショットを見るので、作成した行自体は数えない)
+REGISTER_NEW_USER_QUERY = Statement(
+    """
+    WITH new_user AS (
+        INSERT INTO users (username, email, password, salt)
+        VALUES (:username, :email, :password, :salt)
+        ON CONFLICT DO NOTHING
+        RETURNING
+            id, username, email, email_verified, password,
+            salt, is_active, is_superuser, created_at, updated_at
+    ), new_profile AS (
+        INSERT INTO profiles (full_name, user_id)
+        SELECT '', id FROM new_user
+        RETURNING
+            id, full_name, phone_number, bio, image, user_id, created_at, updated_at
+    )
+    SELECT
+        u.*,
+        p.id AS profile_id,
+        p.full_name AS profile_full_name,
+        p.phone_number AS profile_phone_number,
+        p.bio AS profile_bio,
+        p.image AS profile_image,
+        p.created_at AS profile_created_at,
+        p.updated_at AS profile_updated_at,
+        EXISTS (SELECT 1 FROM users WHERE email = :email) AS email_taken,
+        EXISTS (SELECT 1 FROM users WHERE username = :username) AS username_taken
+    FROM (SELECT 1) AS one
+        LEFT JOIN new_user u ON TRUE
+        LEFT JOIN new_profile p ON p.user_id = u.id;
+"""
+)
+
+SET_USER_ACTIVE_QUERY = Statement(
+    """
+    UPDATE users
+    SET is_active = :is_active
+    WHERE id = :id
     RETURNING
         id, username, email, email_verified, password,
         salt, is_active, is_superuser, created_at, updated_at;
 """
+)
+
+UPDATE_USER_PASSWORD_QUERY = Statement(
+    """
+    UPDATE users
+    SET password = :password,
+        salt = :salt
+    WHERE id = :id;
+"""
+)
+
+
+def build_user_public(record: Mapping[str, Any]) -> UserPublic:
+    """
+    profile_ の付いた列を含む行から、プロフィール付きのユーザーを組み立てる
+    """
+    user = hydrate(UserInDB, record)
+    profile = None
+    if record["profile_id"] is not None:
+        profile = hydrate(
+            ProfilePublic,
+            {
+                "id": record["profile_id"],
+                "full_name": record["profile_full_name"],
+                "phone_number": record["profile_phone_number"],
+                "bio": record["profile_bio"],
+                "image": record["profile_image"],
+                "user_id": user.id,
+                "username": user.username,
+                "email": user.email,
+                "created_at": record["profile_created_at"],
+                "updated_at": record["profile_updated_at"],
+            },
+        )
+    return hydrate(UserPublic, {**user.__dict__, "profile": profile})
 
 
 class UsersRepository(BaseRepository):
-    def __init__(self, db: Database) -> None:
-        super().__init__(db)
+    def __init__(
+        self,
+        db: Database,
+        cache: Optional[RepositoryCache] = None,
+        read_db: Optional[Database] = None,
+    ) -> None:
+        super().__init__(db, cache, read_db)
         self.auth_service = auth_service
-        self.profile_repo = ProfilesRepository(db)
+        self.profile_repo = ProfilesRepository(db, cache, read_db)
+        # 同じリクエスト内で並行して取得されるユーザーを1回の問い合わせにまとめる
+        self.user_loader = BatchLoader(self.get_users_by_usernames)
+        self.populated_user_loader = BatchLoader(self.get_populated_users_by_usernames)
 
-    async def get_user_by_email(self, *, email: EmailStr, populate: bool) -> UserInDB:
-        user_record = await self.db.fetch_one(
+    # パスワードとソルトを含むので、プロセスの外のキャッシュには書き込まない
+    @cached(
+        "user:email:{email}:{populate}", tags=("user:{result.id}",), local_only=True
+    )
+    async def get_user_by_email(
+        self, *, email: EmailStr, populate: bool = False
+    ) -> UserInDB:
+        if populate:
+            user_record = await self.read_db.fetch_one(
+                query=GET_USER_WITH_PROFILE_BY_EMAIL_QUERY, values={"email": email}
+            )
+            return build_user_public(user_record) if user_record else None
+
+        user_record = await self.read_db.fetch_one(
             query=GET_USER_BY_EMAIL_QUERY, values={"email": email}
         )
         if user_record:
-            user = UserInDB(**user_record)
-            if populate:
-                return await self.populate_user(user=user)
-            return user
+            return hydrate(UserInDB, user_record)
+
+    @cached(
+        "user:username:{username}:{populate}",
+        tags=("user:{result.id}",),
+        local_only=True,
+    )
+    async def get_user_by_username(
+        self, *, username: str, populate: bool = False
+    ) -> UserInDB:
+        if populate:
+            return await self.populated_user_loader.load(username)
+        return await self.user_loader.load(username)
 
-    async def get_user_by_username(self, *, username: str, populate: bool) -> UserInDB:
+    async def get_users_by_usernames(self, usernames: List[str]) -> Dict[str, UserInDB]:
+        """
+        複数のユーザーを1回で取得し、ユーザー名ごとに返す
+        """
+        user_records = await self.read_db.fetch_all(
+            query=GET_USERS_BY_USERNAMES_QUERY, values={"usernames": usernames}
+        )
+        return {
+            record["username"]: hydrate(UserInDB, record) for record in user_records
+        }
+
+    async def get_populated_users_by_usernames(
+        self, usernames: List[str]
+    ) -> Dict[str, UserPublic]:
+        """
+        複数のユーザーをプロフィール付きで1回で取得し、ユーザー名ごとに返す
+        """
+        user_records = await self.read_db.fetch_all(
+            query=GET_USERS_WITH_PROFILE_BY_USERNAMES_QUERY,
+            values={"usernames": usernames},
+        )
+        return {
+            record["username"]: build_user_public(record) for record in user_records
+        }
+
+    @cached(
+        "principal:{username}:{token_id}",
+        tags=("user:{result.id}",),
+        ttl=AUTH_PRINCIPAL_CACHE_TTL_SECONDS,
+        shared_only=True,
+    )
+    async def get_principal(
+        self, *, username: str, token_id: Optional[str]
+    ) -> Optional[UserPrincipal]:
+        """
+        トークンの持ち主を取得する
+
+        キャッシュがワーカー間で共有される場合 (CACHE_BACKEND=redis) だけ、
+        ユーザー名とトークンの ID ごとに短い期間キャッシュし、その間は DB へ問い合わせない。
+        ユーザーが更新されると user:{id} のタグですべてのワーカーから無効化される。
+        プロセスごとのキャッシュでは、他のワーカーでの無効化 (ユーザーの無効化など) が
+        届かないので、キャッシュを通さずに毎回 DB で確認する。
+        プロフィールは必要なエンドポイントだけが populate_user で取得する。
+        パスワードとソルトは認証済みのユーザーには不要なので、キャッシュに含めない。
+        """
+        # get_user_by_username もキャッシュするので、ローダーで直接読む
+        user = await self.user_loader.load(username)
+        return hydrate(UserPrincipal, user) if user else None
+
+    @invalidates("user:{user_id}")
+    async def set_user_active(
+        self, *, user_id: int, is_active: bool
+    ) -> Optional[UserInDB]:
+        """
+        ユーザーを有効化・無効化する (キャッシュ済みの認証情報も無効化する)
+        """
         user_record = await self.db.fetch_one(
-            query=GET_USER_BY_USERNAME_QUERY, values={"username": username}
+            query=SET_USER_ACTIVE_QUERY, values={"id": user_id, "is_active": is_active}
         )
-        if user_record:
-            user = UserInDB(**user_record)
-            if populate:
-                return await self.populate_user(user=user)
-            return user
-
-    async def register_new_user(self, *, new_user: UserCreate) -> UserInDB:
-        if await self.get_user_by_email(email=new_user.email):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="このメールアドレスはすでに登録されています。",
-            )
-        if await self.get_user_by_username(username=new_user.username):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="このユーザー名はすでに登録されています。",
-            )
+        if not user_record:
+            return None
+        return hydrate(UserInDB, user_record)
 
+    @invalidates("user:{result.id}")
+    async def register_new_user(self, *, new_user: UserCreate) -> UserPublic:
+        """
+        ユーザーとプロフィールを1回のラウンドトリップで作成し、プロフィール付きで返す
+        """
         # パスワードのハッシュ化とソルトの生成
-        user_password_update = self.auth_service.create_salt_and_hashed_password(
+        user_password_update = await self.auth_service.create_salt_and_hashed_password(
             plaintext_password=new_user.password
         )
-        new_user_params = new_user.model_copy(update=user_password_update.model_dump())
-        created_user = await self.db.fetch_one(
+        record = await self.db.fetch_one(
             query=REGISTER_NEW_USER_QUERY,
-            values={new_user_params.model_dump()},
+            values={
+                "username": new_user.username,
+                "email": new_user.email,
+                **user_password_update.model_dump(),
+            },
         )
 
-        # ユーザーが作成されたら、プロフィールも作成する
-        await self.profile_repo.create_profile_for_user(
-            profile_create=ProfileCreate(user_id=created_user["id"])
-        )
+        if record["id"] is None:
+            if record["email_taken"]:
+                detail = "このメールアドレスはすでに登録されています。"
+            elif record["username_taken"]:
+                detail = "このユーザー名はすでに登録されています。"
+            else:
+                # 同時に登録された行は文のスナップショットからは見えない
+                detail = "このメールアドレスまたはユーザー名はすでに登録されています。"
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
 
-        return await self.populate_user(user=UserInDB(**created_user))
+        return build_user_public(record)
 
     async def authenticate_user(
         self, *, email: EmailStr, password: str
@@ -101,20 +295,37 @@ class UsersRepository(BaseRepository):
         if not user:
             return None
 
-        if not self.auth_service.verify_password(
+        verified, new_hash = await self.auth_service.verify_and_update_password_async(
             password=password, salt=user.salt, hashed_pw=user.password
-        ):
+        )
+        if not verified:
             return None
+        if new_hash is not None:
+            # コストの設定が変わっていれば、平文が手元にあるうちに作り直して保存する
+            password_update = UserPasswordUpdate(password=new_hash, salt=user.salt)
+            await self.update_user_password(
+                user_id=user.id, password_update=password_update
+            )
+            user = user.model_copy(update=password_update.model_dump())
         return user
 
-    async def populate_user(self, *, user: UserInDB) -> UserPublic:
+    @invalidates("user:{user_id}")
+    async def update_user_password(
+        self, *, user_id: int, password_update: UserPasswordUpdate
+    ) -> None:
+        await self.db.execute(
+            query=UPDATE_USER_PASSWORD_QUERY,
+            values={"id": user_id, **password_update.model_dump()},
+        )
+
+    async def populate_user(self, *, user: UserPrincipal) -> UserPublic:
         """
         ユーザーのプロフィール情報を取得し、
         UserPublicモデルに追加して返す。
 
         内部的に使用されるUserInDBモデルをクライアント用のUserPublicモデルに変換する。
+        すでにユーザーを取得済みで、後からプロフィールが必要になった場合に使う。
         """
-        return UserPublic(
-            **user.model_dump(),
-            profile=await self.profile_repo.get_profile_by_user_id(user_id=user.id)
-        )
+        profile = await self.profile_repo.get_profile_by_user_id(user_id=user.id)
+        # どちらも DB から読んだモデルなので、検証せずに組み立て直す
+        return hydrate(UserPublic, {**user.__dict__, "profile": profile})
@@ -0,0 +1,125 @@
+"""
+事前にコンパイルした SQL 文と asyncpg を直接使う実行経路
+
+databases に文字列の SQL を渡すと、呼び出しのたびに SQLAlchemy の text() で
+名前付きパラメータを解析し、結果の行を Record でラップする。
+Statement はモジュールの読み込み時に1回だけ :name を $n に変換しておき、
+StatementDatabase はそれを asyncpg の接続で直接実行して asyncpg の行をそのまま返す。
+asyncpg は SQL の文字列ごとにプリペアドステートメントを接続ごとにキャッシュするので、
+2回目以降は解析も計画もやり直さない。
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, List, Mapping, Optional, Tuple
+
+from databases import Database
+
+# 文字列リテラル・引用符付きの識別子・コメントは読み飛ばし、それ以外の :name だけを置き換える
+# (::regclass のような型キャストは置き換えない)
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<skip>'(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|::)
+    | :(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    """,
+    re.VERBOSE,
+)
+
+
+def compile_named_parameters(sql: str) -> Tuple[str, Tuple[str, ...]]:
+    """
+    :name の形のパラメータを $1, $2, ... に置き換え、パラメータ名の順番と一緒に返す
+
+    同じ名前が複数回出てくる場合は同じ番号を使う。
+    """
+    names: List[str] = []
+
+    def replace(match: "re.Match[str]") -> str:
+        name = match.group("name")
+        if name is None:
+            return match.group("skip")
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _TOKEN_PATTERN.sub(replace, sql), tuple(names)
+
+
+class Statement(str):
+    """
+    コンパイル済みの SQL 文
+
+    str のサブクラスなので、そのまま databases に渡しても (これまでどおり) 実行できる。
+    StatementDatabase に渡した場合は、コンパイル済みの文を asyncpg で直接実行する。
+    """
+
+    positional_sql: str
+    parameter_names: Tuple[str, ...]
+
+    def __new__(cls, sql: str) -> "Statement":
+        statement = super().__new__(cls, sql)
+        statement.positional_sql, statement.parameter_names = compile_named_parameters(
+            sql
+        )
+        return statement
+
+    def arguments(self, values: Optional[Mapping[str, Any]]) -> List[Any]:
+        if not self.parameter_names:
+            return []
+        if values is None:
+            raise KeyError(self.parameter_names[0])
+        return [values[name] for name in self.parameter_names]
+
+
+@lru_cache(maxsize=1024)
+def statement(sql: str) -> Statement:
+    """
+    実行時に組み立てる SQL (WHERE 句などを format したもの) をコンパイルする
+
+    組み立てた結果の文字列ごとにキャッシュするので、同じ形の文は1回しかコンパイルしない。
+    """
+    return Statement(sql)
+
+
+class StatementDatabase(Database):
+    """
+    Statement を asyncpg で直接実行する Database
+
+    文字列の SQL や SQLAlchemy の式は、これまでどおり databases で実行する。
+    トランザクションの中では databases と同じ接続を使う。
+    databases の Connection の非公開の属性 (_query_lock) を使うので、
+    requirements.txt で databases のバージョンを固定し、tests/test_statements.py で確認する。
+    """
+
+    async def _fetch(self, method: str, query: Statement, values: Any) -> Any:
+        arguments = query.arguments(values)
+        async with self.connection() as connection:
+            # databases と同じく、1つの接続で同時に問い合わせないようにする
+            async with connection._query_lock:
+                raw_connection = connection.raw_connection
+                return await getattr(raw_connection, method)(
+                    query.positional_sql, *arguments
+                )
+
+    async def fetch_all(self, query: Any, values: Optional[dict] = None) -> List[Any]:
+        if isinstance(query, Statement):
+            return await self._fetch("fetch", query, values)
+        return await super().fetch_all(query, values)
+
+    async def fetch_one(self, query: Any, values: Optional[dict] = None) -> Any:
+        if isinstance(query, Statement):
+            return await self._fetch("fetchrow", query, values)
+        return await super().fetch_one(query, values)
+
+    async def fetch_val(
+        self, query: Any, values: Optional[dict] = None, column: Any = 0
+    ) -> Any:
+        if isinstance(query, Statement):
+            row = await self._fetch("fetchrow", query, values)
+            return None if row is None else row[column]
+        return await super().fetch_val(query, values, column=column)
+
+    async def execute(self, query: Any, values: Optional[dict] = None) -> Any:
+        if isinstance(query, Statement):
+            return await self._fetch("fetchval", query, values)
+        return await super().execute(query, values)
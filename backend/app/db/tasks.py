@@ -1,13 +1,35 @@
 import logging
 import os
 
-from app.core.config import DATABASE_URL
-from databases import Database
+from app.core.config import (
+    DATABASE_REPLICA_URLS,
+    DATABASE_URL,
+    DB_POOL_ACQUIRE_TIMEOUT_SECONDS,
+    DB_POOL_MAX_IDLE_SECONDS,
+    DB_POOL_MAX_LIFETIME_SECONDS,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    REPLICA_LAG_CHECK_INTERVAL_SECONDS,
+    REPLICA_MAX_LAG_SECONDS,
+)
+from app.db.pool import InstrumentedDatabase
+from app.db.replicas import ReplicaSet
 from fastapi import FastAPI
 
 logger = logging.getLogger(__name__)
 
 
+def build_database(url: str) -> InstrumentedDatabase:
+    return InstrumentedDatabase(
+        url,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT_SECONDS or None,
+        max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS or None,
+        max_inactive_connection_lifetime=DB_POOL_MAX_IDLE_SECONDS,
+    )
+
+
 async def connect_to_db(app: FastAPI) -> None:
     """
     DBに接続する関数。
@@ -16,7 +38,7 @@ async def connect_to_db(app: FastAPI) -> None:
     DB_URL = (
         CONTAINER_DSN if CONTAINER_DSN else DATABASE_URL
     )  # テスト環境とで接続先を変える
-    database = Database(DATABASE_URL, min_size=2, max_size=5)
+    database = build_database(DB_URL)
 
     try:
         await database.connect()
@@ -26,9 +48,22 @@ async def connect_to_db(app: FastAPI) -> None:
         logger.warn(e)
         logger.warn("--- DATABASE CONNECTION ERROR ---")
 
+    # 読み取り用のレプリカ (接続できないレプリカは使わず、プライマリで読む)
+    app.state._replicas = None
+    if DATABASE_REPLICA_URLS:
+        replicas = ReplicaSet(
+            [build_database(url) for url in DATABASE_REPLICA_URLS],
+            max_lag=REPLICA_MAX_LAG_SECONDS,
+            check_interval=REPLICA_LAG_CHECK_INTERVAL_SECONDS,
+        )
+        await replicas.connect()
+        app.state._replicas = replicas
+
 
 async def close_db_connection(app: FastAPI) -> None:
     try:
+        if getattr(app.state, "_replicas", None) is not None:
+            await app.state._replicas.disconnect()
         await app.state._db.disconnect()
     except Exception as e:
         logger.warn("--- DATABASE DISCONNECTION ERROR ---")
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 
 from app.models.core import CoreModel, IDModelMixin
 
@@ -10,6 +10,11 @@ class ColorType(str, Enum):
     chocolate = "CHOCOLATE"
 
 
+class HedgehogExportFormat(str, Enum):
+    ndjson = "ndjson"
+    json = "json"
+
+
 class HedgehogBase(CoreModel):
     name: Optional[str]
     description: Optional[str]
@@ -23,14 +28,33 @@ class HedgehogCreate(HedgehogBase):
 
 
 class HedgehogUpdate(HedgehogBase):
-    description: str
-    age: float
+    """
+    部分更新のためのモデル (送られてきた項目だけを更新する)
+    """
+
+    name: Optional[str] = None
+    description: Optional[str] = None
+    age: Optional[float] = None
+    color_type: Optional[ColorType] = None
+
+
+class HedgehogFilter(CoreModel):
+    """
+    一覧の絞り込み条件 (指定されたものだけを AND で組み合わせる)
+    """
+
+    color_type: Optional[ColorType] = None
+    min_age: Optional[float] = None
+    max_age: Optional[float] = None
+    name_prefix: Optional[str] = None
+    name_contains: Optional[str] = None
 
 
 class HedgehogInDB(IDModelMixin, HedgehogBase):
     name: str
     age: float
     color_type: ColorType
+    version: int = 1
 
 
 class HedgehogPublic(IDModelMixin, HedgehogBase):
@@ -39,3 +63,61 @@ class HedgehogPublic(IDModelMixin, HedgehogBase):
     """
 
     pass
+
+
+class HedgehogSearchResult(HedgehogPublic):
+    """
+    全文検索の結果
+
+    name_highlight と snippet は HTML エスケープした文字列で、一致した語を <mark> で囲む。
+    """
+
+    rank: float
+    name_highlight: str
+    snippet: Optional[str] = None
+
+
+class HedgehogColorTypeCount(CoreModel):
+    color_type: ColorType
+    count: int
+
+
+class HedgehogAgeBucket(CoreModel):
+    """
+    年齢のヒストグラムの1区間 (age_from 以上 age_to 未満)
+    """
+
+    age_from: int
+    age_to: int
+    count: int
+
+
+class HedgehogStats(CoreModel):
+    total: int
+    average_age: Optional[float] = None
+    by_color_type: List[HedgehogColorTypeCount]
+    age_histogram: List[HedgehogAgeBucket]
+
+
+class HedgehogBulkRowError(CoreModel):
+    """
+    一括登録で検証に失敗した行 (row は1始まりのデータ行番号)
+    """
+
+    row: int
+    errors: List[str]
+
+
+class HedgehogBulkCreatedRow(CoreModel):
+    """
+    一括登録で作成された行 (row は1始まりのデータ行番号)
+    """
+
+    row: int
+    id: int
+
+
+class HedgehogBulkCreateResult(CoreModel):
+    ids: List[int]
+    created: List[HedgehogBulkCreatedRow] = []
+    errors: List[HedgehogBulkRowError] = []
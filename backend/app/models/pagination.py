@@ -0,0 +1,18 @@
+"""
+カーソル(キーセット)ページネーションのためのモデル
+"""
+
+from typing import Any, Dict
+
+from app.models.core import CoreModel
+
+
+class PageParams(CoreModel):
+    """
+    クエリパラメータから取り出したページ指定
+
+    after はデコード済みのカーソルで、最初のページでは空の辞書になる。
+    """
+
+    limit: int
+    after: Dict[str, Any] = {}
@@ -20,7 +20,11 @@ class ProfileCreate(ProfileBase):
 
 
 class ProfileUpdate(ProfileBase):
-    pass
+    # 送られてきた項目だけを更新する
+    full_name: Optional[str] = None
+    phone_number: Optional[str] = None
+    bio: Optional[str] = None
+    image: Optional[HttpUrl] = None
 
 
 class ProfileInDB(IDModelMixin, DateTimeModelMixin, ProfileBase):
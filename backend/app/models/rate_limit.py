@@ -0,0 +1,26 @@
+"""
+レート制限のためのモデル
+"""
+
+from typing import List
+
+from app.models.core import CoreModel
+
+
+class RateLimit(CoreModel):
+    """
+    トークンバケットの設定
+
+    最大 capacity 回まで連続で許可し、1秒あたり refill_per_second 回分ずつ回復する。
+    """
+
+    key: str
+    capacity: float
+    refill_per_second: float
+
+
+class RateLimitResult(CoreModel):
+    allowed: bool
+    # 拒否された場合、次に1回分が回復するまでの秒数
+    retry_after: float = 0
+    denied_keys: List[str] = []
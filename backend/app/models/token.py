@@ -3,10 +3,12 @@
 """
 
 from datetime import datetime, timedelta, timezone
+from typing import Optional
+from uuid import uuid4
 
 from app.core.config import ACCESS_TOKEN_EXPIRE_MINUTES, JWT_AUDIENCE
 from app.models.core import CoreModel
-from pydantic import EmailStr
+from pydantic import EmailStr, Field
 
 
 class JWTMeta(CoreModel):
@@ -20,6 +22,7 @@ class JWTMeta(CoreModel):
     exp: float = datetime.timestamp(
         datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )  # JWTの有効期限
+    jti: str = Field(default_factory=lambda: uuid4().hex)  # JWTのID
 
 
 class JWTCreds(CoreModel):
@@ -32,7 +35,7 @@ class JWTPayload(JWTMeta, JWTCreds):
     JWTのペイロード(本文)を表すモデル
     """
 
-    pass
+    jti: Optional[str] = None  # jti を持たない以前のトークンも受け付ける
 
 
 class AccessToken(CoreModel):
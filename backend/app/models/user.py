@@ -55,10 +55,16 @@ class UserInDB(IDModelMixin, DateTimeModelMixin, UserBase):
     salt: str
 
 
+class UserPrincipal(IDModelMixin, DateTimeModelMixin, UserBase):
+    """
+    認証済みのユーザーを表すモデル (パスワードとソルトを含まない)
+    """
+
+
 class UserPublic(IDModelMixin, DateTimeModelMixin, UserBase):
     """
     他のユーザーに公開されるユーザー情報を表すモデル
     """
 
-    access_token: Optional[AccessToken]
-    profile: Optional[ProfilePublic]
+    access_token: Optional[AccessToken] = None
+    profile: Optional[ProfilePublic] = None
@@ -3,12 +3,13 @@
 """
 
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Type
+from typing import Callable, Optional, Tuple, Type
 
 import bcrypt
 import jwt
 from app.core.config import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
+    BCRYPT_ROUNDS,
     JWT_ALGORITHM,
     JWT_AUDIENCE,
     JWT_TOKEN_PREFIX,
@@ -16,11 +17,44 @@ from app.core.config import (
 )
 from app.models.token import JWTCreds, JWTMeta, JWTPayload
 from app.models.user import UserBase, UserInDB, UserPasswordUpdate
+from app.services.password_hashing import PasswordHashingPool, password_hashing_pool
+from app.services.token_cache import VerifiedTokenCache, verified_token_cache
 from fastapi import HTTPException, status
 from passlib.context import CryptContext
 from pydantic import ValidationError
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def build_pwd_context(rounds: int) -> CryptContext:
+    """
+    bcrypt のコストを rounds に固定したコンテキストを作る
+
+    min と max も同じ値にするので、コストの異なる既存のハッシュは needs_update になる。
+    """
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+pwd_context = build_pwd_context(BCRYPT_ROUNDS)
+
+
+# プロセスプールにも渡せるよう、ワーカーで実行する処理はモジュールの関数にしておく
+def _hash_secret(*, secret: str) -> str:
+    return pwd_context.hash(secret)
+
+
+def _verify_secret(*, secret: str, hashed: str) -> bool:
+    return pwd_context.verify(secret, hashed)
+
+
+def _verify_and_update_secret(
+    *, secret: str, hashed: str
+) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(secret, hashed)
 
 
 class AuthException(Exception):
@@ -28,24 +62,67 @@ class AuthException(Exception):
 
 
 class AuthService:
-    def create_salt_and_hashed_password(
+    def __init__(
+        self,
+        hashing_pool: Optional[PasswordHashingPool] = None,
+        token_cache: Optional[VerifiedTokenCache] = None,
+        is_token_revoked: Optional[Callable[[JWTPayload], bool]] = None,
+    ) -> None:
+        self.hashing_pool = hashing_pool or password_hashing_pool
+        self.token_cache = (
+            token_cache if token_cache is not None else verified_token_cache
+        )
+        # 失効したトークンを判定するフック。キャッシュから返す場合も毎回確認する
+        self.is_token_revoked = is_token_revoked
+
+    async def create_salt_and_hashed_password(
         self, *, plaintext_password: str
     ) -> UserPasswordUpdate:
         """
         saltとハッシュ化されたパスワードを生成する
         """
         salt = self.generate_salt()
-        hashed_password = self.hash_password(password=plaintext_password, salt=salt)
+        hashed_password = await self.hash_password_async(
+            password=plaintext_password, salt=salt
+        )
         return UserPasswordUpdate(password=hashed_password, salt=salt)
 
     def generate_salt(self) -> str:
         return bcrypt.gensalt().decode()
 
     def hash_password(self, *, password: str, salt: str) -> str:
-        return pwd_context.hash(password + salt)
+        return _hash_secret(secret=password + salt)
 
     def verify_password(self, *, password: str, salt: str, hashed_pw: str) -> bool:
-        return pwd_context.verify(password + salt, hashed_pw)
+        return _verify_secret(secret=password + salt, hashed=hashed_pw)
+
+    async def hash_password_async(self, *, password: str, salt: str) -> str:
+        """
+        hash_password をイベントループを止めずにワーカープールで実行する
+        """
+        return await self.hashing_pool.run(_hash_secret, secret=password + salt)
+
+    async def verify_password_async(
+        self, *, password: str, salt: str, hashed_pw: str
+    ) -> bool:
+        """
+        verify_password をイベントループを止めずにワーカープールで実行する
+        """
+        return await self.hashing_pool.run(
+            _verify_secret, secret=password + salt, hashed=hashed_pw
+        )
+
+    async def verify_and_update_password_async(
+        self, *, password: str, salt: str, hashed_pw: str
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        パスワードを検証し、ハッシュが現在のコストと異なる場合は作り直したハッシュも返す
+
+        検証に成功し作り直す必要がない場合、2つ目の値は None になる。
+        """
+        return await self.hashing_pool.run(
+            _verify_and_update_secret, secret=password + salt, hashed=hashed_pw
+        )
 
     def create_access_token_for_user(
         self,
@@ -75,19 +152,45 @@ class AuthService:
         )
         return access_token
 
-    def get_username_from_token(self, *, token: str, secret_key: str) -> Optional[str]:
+    def get_token_payload(self, *, token: str, secret_key: str) -> JWTPayload:
         """
-        トークンからユーザー名を取得する
+        トークンを検証してペイロードを取得する
+
+        検証済みのトークンは exp までキャッシュし、署名の検証とモデル化を省略する。
         """
-        try:
-            decoded_token = jwt.decode(
-                token, secret_key, audience=JWT_AUDIENCE, algorithms=[JWT_ALGORITHM]
-            )
-            payload = JWTPayload(**decoded_token)
-        except (jwt.PyJWTError, ValidationError):
+        credentials_exception = HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+        if not isinstance(token, str):
+            raise credentials_exception
+
+        digest = self.token_cache.digest(token=token, secret_key=secret_key)
+        payload = self.token_cache.get(digest)
+        if payload is None:
+            try:
+                decoded_token = jwt.decode(
+                    token, secret_key, audience=JWT_AUDIENCE, algorithms=[JWT_ALGORITHM]
+                )
+                payload = JWTPayload(**decoded_token)
+            except (jwt.PyJWTError, ValidationError):
+                raise credentials_exception
+            # exp を持たないトークンは期限が分からないのでキャッシュしない
+            if "exp" in decoded_token:
+                self.token_cache.set(digest, payload)
+
+        if self.is_token_revoked is not None and self.is_token_revoked(payload):
+            self.token_cache.discard(digest)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
+                detail="Token has been revoked",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        return payload.username
+        return payload
+
+    def get_username_from_token(self, *, token: str, secret_key: str) -> Optional[str]:
+        """
+        トークンからユーザー名を取得する
+        """
+        return self.get_token_payload(token=token, secret_key=secret_key).username
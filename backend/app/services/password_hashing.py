@@ -0,0 +1,120 @@
+"""
+パスワードのハッシュ化をイベントループの外で実行するワーカープール
+
+bcrypt は1回に数百ミリ秒かかるので、ルートの中で直接呼ぶと
+その間ワーカーの他のリクエストがすべて止まる。
+"""
+
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.core.config import (
+    PASSWORD_HASH_EXECUTOR,
+    PASSWORD_HASH_MAX_QUEUE,
+    PASSWORD_HASH_WORKERS,
+)
+from fastapi import HTTPException, status
+
+
+def _timed_call(function: Callable[[], Any]) -> Tuple[Any, float, float]:
+    """
+    ワーカー内で関数を実行し、結果と開始・終了時刻を返す
+    (time.monotonic はプロセス間でも同じ時計を使う)
+    """
+    started_at = time.monotonic()
+    result = function()
+    return result, started_at, time.monotonic()
+
+
+class PasswordHashingPool:
+    """
+    ハッシュ化を実行する上限付きのプール
+
+    実行中と待機中の合計が workers + max_queue を超えた場合は、
+    待たせ続けるのではなく 503 を返して呼び出し元に再試行させる。
+    上限はワーカープロセスごとに数えるので、サーバー全体では SERVER_WORKERS 倍になる。
+    bcrypt は計算中に GIL を解放するので、既定ではスレッドで実行する。
+    """
+
+    def __init__(self, *, workers: int, max_queue: int, kind: str = "thread") -> None:
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown PASSWORD_HASH_EXECUTOR: {kind}")
+        self.workers = workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._executor: Optional[Executor] = None
+        self.in_flight = 0
+        self.calls = 0
+        self.rejected = 0
+        self.queue_wait_seconds_total = 0.0
+        self.queue_wait_seconds_max = 0.0
+        self.hash_seconds_total = 0.0
+        self.hash_seconds_max = 0.0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hash"
+                )
+        return self._executor
+
+    async def run(self, function: Callable[..., Any], /, **kwargs: Any) -> Any:
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password operations in progress.",
+                headers={"Retry-After": "1"},
+            )
+
+        self.in_flight += 1
+        submitted_at = time.monotonic()
+        try:
+            (
+                result,
+                started_at,
+                finished_at,
+            ) = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _timed_call, partial(function, **kwargs)
+            )
+        finally:
+            self.in_flight -= 1
+
+        queue_wait = max(0.0, started_at - submitted_at)
+        hash_time = finished_at - started_at
+        self.calls += 1
+        self.queue_wait_seconds_total += queue_wait
+        self.queue_wait_seconds_max = max(self.queue_wait_seconds_max, queue_wait)
+        self.hash_seconds_total += hash_time
+        self.hash_seconds_max = max(self.hash_seconds_max, hash_time)
+        return result
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight,
+            "queue_wait_seconds_total": self.queue_wait_seconds_total,
+            "queue_wait_seconds_max": self.queue_wait_seconds_max,
+            "hash_seconds_total": self.hash_seconds_total,
+            "hash_seconds_max": self.hash_seconds_max,
+        }
+
+
+password_hashing_pool = PasswordHashingPool(
+    workers=PASSWORD_HASH_WORKERS,
+    max_queue=PASSWORD_HASH_MAX_QUEUE,
+    kind=PASSWORD_HASH_EXECUTOR,
+)
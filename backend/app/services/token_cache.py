@@ -0,0 +1,68 @@
+"""
+検証済みの JWT のキャッシュ
+
+クライアントは同じトークンを何度も送ってくるので、署名の検証と
+ペイロードのモデル化の結果をトークンのダイジェストごとに保持する。
+"""
+
+import hashlib
+import hmac
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.core.config import JWT_CACHE_MAX_ENTRIES
+from app.models.token import JWTPayload
+
+
+class VerifiedTokenCache:
+    """
+    トークンのダイジェストから検証済みのペイロードを引く LRU キャッシュ
+
+    エントリは exp を過ぎたら返さずに捨てる。max_entries が 0 なら何も保持しない。
+    """
+
+    def __init__(self, *, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Tuple[float, JWTPayload]]" = OrderedDict()
+
+    @staticmethod
+    def digest(*, token: str, secret_key: str) -> bytes:
+        # 別の鍵で検証した結果を使い回さないよう、鍵もダイジェストに含める
+        return hmac.new(secret_key.encode(), token.encode(), hashlib.sha256).digest()
+
+    def get(self, digest: bytes) -> Optional[JWTPayload]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            del self._entries[digest]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return payload
+
+    def set(self, digest: bytes, payload: JWTPayload) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[digest] = (payload.exp, payload)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, digest: bytes) -> None:
+        self._entries.pop(digest, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+verified_token_cache = VerifiedTokenCache(max_entries=JWT_CACHE_MAX_ENTRIES)
@@ -0,0 +1,5 @@
+"""
+マイクロベンチマーク
+
+backend ディレクトリで python -m benchmarks.<名前> として実行する。
+"""
@@ -0,0 +1,40 @@
+"""
+bcrypt のコストごとに、このマシンでのハッシュ化1回の時間を測る
+
+    python -m benchmarks.bcrypt_cost [--min-rounds 10] [--max-rounds 14] [--repeat 5]
+
+BCRYPT_ROUNDS を決める際に、ログイン1回あたりの CPU 時間の目安にする。
+"""
+
+import argparse
+import statistics
+import time
+
+from app.core.config import BCRYPT_ROUNDS
+from app.services.authentication import build_pwd_context
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=14)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rounds':>6} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for rounds in range(args.min_rounds, args.max_rounds + 1):
+        context = build_pwd_context(rounds)
+        timings = []
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            context.hash("correct horse battery staple" + "salt")
+            timings.append((time.perf_counter() - started_at) * 1000)
+        current = "  <- BCRYPT_ROUNDS" if rounds == BCRYPT_ROUNDS else ""
+        print(
+            f"{rounds:>6} {statistics.median(timings):>10.1f}"
+            f" {min(timings):>8.1f} {max(timings):>8.1f}{current}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+一覧のレスポンスを符号化・レベルごとに圧縮し、圧縮率と 1 バイトあたりの CPU 時間を比べる
+
+    python -m benchmarks.compression [--rows 1000]
+
+本文は /api/hedgehogs/ と同じ形の JSON を TrustedResponseRoute と同じ方法で作る。
+brotli と zstd は、パッケージがインストールされている場合だけ計測する。
+帯域と CPU のどちらを優先するかに応じて COMPRESSION_*_LEVEL を選ぶ目安にする。
+"""
+
+import argparse
+import time
+from typing import List
+
+from app.api.middleware.compression import COMPRESSORS, available_encodings
+from app.api.routing import build_serializer
+from app.models.hedgehog import HedgehogPublic
+
+LEVELS = {
+    "gzip": (1, 4, 6, 9),
+    "br": (1, 4, 6, 11),
+    "zstd": (1, 3, 9, 19),
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    hedgehogs = [
+        HedgehogPublic(
+            id=i,
+            name=f"hedgehog {i}",
+            description="a hedgehog that likes mealworms",
+            age=1.5 + i % 7,
+            color_type=("DARK GREY", "CHOCOLATE", "SOLT & PEPPER")[i % 3],
+        )
+        for i in range(args.rows)
+    ]
+    body = build_serializer(List[HedgehogPublic])(hedgehogs)
+    print(f"body: {len(body)} bytes ({args.rows} rows)")
+
+    for encoding in available_encodings():
+        for level in LEVELS[encoding]:
+            best = float("inf")
+            for _ in range(args.repeat):
+                started_at = time.thread_time()
+                compressed = COMPRESSORS[encoding](level).finish(body)
+                best = min(best, time.thread_time() - started_at)
+            print(
+                f"{encoding:>5} level {level:>2}: "
+                f"{len(compressed):>7} bytes (ratio {len(compressed) / len(body):.3f}), "
+                f"{best * 1e9 / len(body):6.2f} ns/byte, {best * 1e3:6.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+DB の行からモデルを組み立てる時間を、検証する場合 (Model(**record)) と
+hydrate で検証を省略する場合で比べる
+
+    python -m benchmarks.hydration [--rows 10000]
+
+行は asyncpg が返すのと同じ型 (NUMERIC は Decimal、列挙型は文字列) の dict で作る。
+"""
+
+import argparse
+import timeit
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from app.db.hydration import hydrate, hydrate_all
+from app.models.hedgehog import HedgehogInDB
+from app.models.profile import ProfilePublic
+from app.models.user import UserInDB, UserPublic
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000)
+    args = parser.parse_args()
+
+    now = datetime.now(timezone.utc)
+    hedgehog_rows = [
+        {
+            "id": i,
+            "name": f"hedgehog {i}",
+            "description": "bench",
+            "age": Decimal("1.5"),
+            "color_type": "DARK GREY",
+            "version": 1,
+        }
+        for i in range(args.rows)
+    ]
+    user_rows = [
+        {
+            "id": i,
+            "username": f"user{i}",
+            "email": f"user{i}@mail.com",
+            "email_verified": False,
+            "password": "$2b$12$" + "x" * 53,
+            "salt": "$2b$12$" + "y" * 22,
+            "is_active": True,
+            "is_superuser": False,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(args.rows)
+    ]
+    profile = ProfilePublic(
+        id=1,
+        full_name="bench",
+        phone_number=None,
+        bio=None,
+        image=None,
+        user_id=1,
+        username="user1",
+        email="user1@mail.com",
+        created_at=now,
+        updated_at=now,
+    )
+
+    cases = (
+        (
+            "HedgehogInDB",
+            lambda: [HedgehogInDB(**row) for row in hedgehog_rows],
+            lambda: hydrate_all(HedgehogInDB, hedgehog_rows),
+        ),
+        (
+            "UserInDB",
+            lambda: [UserInDB(**row) for row in user_rows],
+            lambda: hydrate_all(UserInDB, user_rows),
+        ),
+        (
+            "UserPublic",
+            # populate_user でこれまで行っていた組み立て直し
+            lambda: [
+                UserPublic(**UserInDB(**row).model_dump(), profile=profile)
+                for row in user_rows
+            ],
+            lambda: [
+                hydrate(
+                    UserPublic, {**hydrate(UserInDB, row).__dict__, "profile": profile}
+                )
+                for row in user_rows
+            ],
+        ),
+    )
+    for name, validated, hydrated in cases:
+        assert [m.model_dump() for m in validated()] == [
+            m.model_dump() for m in hydrated()
+        ]
+        for label, function in (("validated", validated), ("hydrated", hydrated)):
+            seconds = min(timeit.repeat(function, number=1, repeat=5))
+            print(f"{name:>12} {label:>9}: {seconds * 1e3:8.2f} ms/{args.rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+検証済み JWT のキャッシュの有無で、トークン1件の検証にかかる時間を比べる
+
+    python -m benchmarks.jwt_cache [--number 20000]
+"""
+
+import argparse
+import timeit
+
+from app.core.config import SECRET_KEY
+from app.models.user import UserBase
+from app.services.authentication import AuthService
+from app.services.token_cache import VerifiedTokenCache
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20_000)
+    args = parser.parse_args()
+
+    user = UserBase(email="bench@mail.com", username="bench")
+    secret_key = str(SECRET_KEY)
+    uncached = AuthService(token_cache=VerifiedTokenCache(max_entries=0))
+    cached = AuthService(token_cache=VerifiedTokenCache(max_entries=1_000))
+    token = cached.create_access_token_for_user(user=user, secret_key=secret_key)
+
+    for name, service in (("uncached", uncached), ("cached", cached)):
+        seconds = min(
+            timeit.repeat(
+                lambda: service.get_token_payload(token=token, secret_key=secret_key),
+                number=args.number,
+                repeat=5,
+            )
+        )
+        print(f"{name:>8}: {seconds / args.number * 1e6:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+JSON と MessagePack のスループットを比べる
+
+    python -m benchmarks.msgpack [--rows 1000] [--requests 200]
+
+一覧 (List[HedgehogPublic]) とプロフィール (ProfilePublic) について、
+サーバーでの符号化・クライアントでの復号・リクエストの本文の検証の時間と大きさを測り、
+MessagePackRoute を使った一覧のリクエスト (DB なし) の1秒あたりの件数を比べる。
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import timeit
+from datetime import datetime, timezone
+from typing import Any, Callable, List
+
+import msgpack
+from app.api.routing import MSGPACK_MEDIA_TYPE, MessagePackRoute, build_serializer
+from app.models.hedgehog import HedgehogCreate, HedgehogPublic
+from app.models.profile import ProfilePublic
+from fastapi import APIRouter, FastAPI
+from httpx import AsyncClient
+from pydantic import TypeAdapter
+
+
+def per_call(function: Callable[[], Any]) -> float:
+    return min(timeit.repeat(function, number=20, repeat=5)) / 20
+
+
+def compare_formats(name: str, model: Any, value: Any) -> None:
+    encoders = {
+        "json": build_serializer(model),
+        "msgpack": build_serializer(model, MSGPACK_MEDIA_TYPE),
+    }
+    decoders = {"json": json.loads, "msgpack": msgpack.unpackb}
+    for label, encode in encoders.items():
+        body = encode(value)
+        encode_seconds = per_call(lambda: encode(value))
+        decode_seconds = per_call(lambda: decoders[label](body))
+        print(
+            f"{name:>9} {label:>8}: {len(body):>7} bytes, "
+            f"encode {encode_seconds * 1e6:8.1f} µs, "
+            f"decode {decode_seconds * 1e6:8.1f} µs"
+        )
+
+
+def compare_request_bodies(rows: int) -> None:
+    # クライアントから受け取る本文は検証するので、復号と検証をまとめて測る
+    adapter = TypeAdapter(List[HedgehogCreate])
+    new_hedgehogs = [
+        {
+            "name": f"hedgehog {i}",
+            "description": None,
+            "age": i % 7,
+            "color_type": "CHOCOLATE",
+        }
+        for i in range(rows)
+    ]
+    bodies = {
+        "json": (json.dumps(new_hedgehogs).encode(), json.loads),
+        "msgpack": (msgpack.packb(new_hedgehogs), msgpack.unpackb),
+    }
+    for label, (body, decode) in bodies.items():
+        seconds = per_call(lambda: adapter.validate_python(decode(body)))
+        print(
+            f"{'body':>9} {label:>8}: {len(body):>7} bytes, decode+validate {seconds * 1e6:8.1f} µs"
+        )
+
+
+async def compare_requests(hedgehogs: List[HedgehogPublic], requests: int) -> None:
+    router = APIRouter(route_class=MessagePackRoute)
+
+    @router.get("/hedgehogs/", response_model=List[HedgehogPublic])
+    async def list_hedgehogs() -> List[HedgehogPublic]:
+        return hedgehogs
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    async with AsyncClient(app=app, base_url="http://bench") as client:
+        for label, accept, decode in (
+            ("json", "application/json", json.loads),
+            ("msgpack", MSGPACK_MEDIA_TYPE, msgpack.unpackb),
+        ):
+            headers = {"Accept": accept}
+            await client.get("/api/hedgehogs/", headers=headers)
+            started_at = time.perf_counter()
+            for _ in range(requests):
+                # クライアント側の復号も含める
+                decode((await client.get("/api/hedgehogs/", headers=headers)).content)
+            seconds = time.perf_counter() - started_at
+            print(f"{'requests':>9} {label:>8}: {requests / seconds:8.1f} requests/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    now = datetime.now(timezone.utc)
+    hedgehogs = [
+        HedgehogPublic(
+            id=i,
+            name=f"hedgehog {i}",
+            description="a hedgehog that likes mealworms",
+            age=1.5 + i % 7,
+            color_type=("DARK GREY", "CHOCOLATE", "SOLT & PEPPER")[i % 3],
+        )
+        for i in range(args.rows)
+    ]
+    profile = ProfilePublic(
+        id=1,
+        full_name="bench",
+        phone_number="111-222-3333",
+        bio="likes hedgehogs",
+        image="https://example.com/bench.png",
+        user_id=1,
+        username="user1",
+        email="user1@mail.com",
+        created_at=now,
+        updated_at=now,
+    )
+
+    compare_formats("list", List[HedgehogPublic], hedgehogs)
+    compare_formats("profile", ProfilePublic, profile)
+    compare_request_bodies(args.rows)
+    asyncio.run(compare_requests(hedgehogs, args.requests))
+
+
+if __name__ == "__main__":
+    main()
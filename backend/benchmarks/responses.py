@@ -0,0 +1,130 @@
+"""
+レスポンスを返す時間を、FastAPI の既定のルート (response_model で検証し直す) と
+TrustedResponseRoute (検証せずに pydantic-core で1回だけ JSON にする) で比べる
+
+    python -m benchmarks.responses [--rows 1000] [--requests 200]
+
+DB には接続せず、リポジトリが返すのと同じモデル (hydrate で組み立てたもの) を返す
+エンドポイントを、一覧 (List[HedgehogPublic]) と /users/me/ (UserPublic) の形で用意する。
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import List, Type
+
+from app.api.routing import TrustedResponseRoute
+from app.db.hydration import hydrate, hydrate_all
+from app.models.hedgehog import HedgehogInDB, HedgehogPublic
+from app.models.profile import ProfilePublic
+from app.models.user import UserInDB, UserPublic
+from fastapi import APIRouter, FastAPI, Response
+from fastapi.routing import APIRoute
+from httpx import AsyncClient
+
+
+NOW = datetime.now(timezone.utc)
+
+
+def create_app(route_class: Type[APIRoute], rows: int) -> FastAPI:
+    hedgehogs = hydrate_all(
+        HedgehogInDB,
+        [
+            {
+                "id": i,
+                "name": f"hedgehog {i}",
+                "description": "bench",
+                "age": Decimal("1.5"),
+                "color_type": "DARK GREY",
+                "version": 1,
+            }
+            for i in range(rows)
+        ],
+    )
+    user = hydrate(
+        UserInDB,
+        {
+            "id": 1,
+            "username": "user1",
+            "email": "user1@mail.com",
+            "email_verified": False,
+            "password": "$2b$12$" + "x" * 53,
+            "salt": "$2b$12$" + "y" * 22,
+            "is_active": True,
+            "is_superuser": False,
+            "created_at": NOW,
+            "updated_at": NOW,
+        },
+    )
+    profile = hydrate(
+        ProfilePublic,
+        {
+            "id": 1,
+            "full_name": "bench",
+            "phone_number": None,
+            "bio": None,
+            "image": None,
+            "user_id": 1,
+            "username": "user1",
+            "email": "user1@mail.com",
+            "created_at": NOW,
+            "updated_at": NOW,
+        },
+    )
+
+    router = APIRouter(route_class=route_class)
+
+    @router.get("/hedgehogs/", response_model=List[HedgehogPublic])
+    async def list_hedgehogs(response: Response) -> List[HedgehogPublic]:
+        response.headers["X-Next-Cursor"] = "next"
+        return hedgehogs
+
+    @router.get("/users/me/", response_model=UserPublic)
+    async def get_current_user() -> UserPublic:
+        # populate_user と同じ組み立て方
+        return hydrate(UserPublic, {**user.__dict__, "profile": profile})
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    return app
+
+
+async def measure(client: AsyncClient, path: str, requests: int) -> float:
+    # 1回目はスキーマの生成などを含むので計測しない
+    await client.get(path)
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        await client.get(path)
+    return (time.perf_counter() - started_at) / requests
+
+
+async def run(rows: int, requests: int) -> None:
+    clients = {
+        label: AsyncClient(app=create_app(route_class, rows), base_url="http://bench")
+        for label, route_class in (
+            ("default", APIRoute),
+            ("trusted", TrustedResponseRoute),
+        )
+    }
+    for path in ("/api/hedgehogs/", "/api/users/me/"):
+        responses = [await client.get(path) for client in clients.values()]
+        assert responses[0].content == responses[1].content
+        for label, client in clients.items():
+            seconds = min([await measure(client, path, requests) for _ in range(3)])
+            print(f"{path:>16} {label:>8}: {seconds * 1e6:10.1f} µs/request")
+    for client in clients.values():
+        await client.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+開発用の起動コマンドと app.core.runner のスループットを比べる
+
+    python -m benchmarks.server [--path /api/metrics/] [--connections 32] [--seconds 10] [--repeat 3]
+
+それぞれのサーバーを別のプロセスで起動し、Keep-Alive の接続を張ったまま
+GET を送り続けて1秒あたりの件数を数える。
+runner の場合は、ワーカーが親と共有せずに持つメモリ (USS) も表示する。
+DB に接続できる .env が必要。/api/metrics/ を読めるように METRICS_TOKEN はここで決めて渡す。
+"""
+
+import argparse
+import asyncio
+import os
+import secrets
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+SERVERS = {
+    # uvloop と httptools がインストールされていない場合の開発用のコマンド
+    "uvicorn --reload (asyncio, h11)": (
+        ["uvicorn", "app.api.server:app", "--reload", "--workers", "1"]
+        + ["--loop", "asyncio", "--http", "h11"],
+        {},
+    ),
+    "uvicorn --reload --workers 1": (
+        ["uvicorn", "app.api.server:app", "--reload", "--workers", "1"],
+        {},
+    ),
+    "runner 1 worker (asyncio, h11)": (
+        [sys.executable, "-m", "app.core.runner"],
+        {"SERVER_WORKERS": "1", "SERVER_LOOP": "asyncio", "SERVER_HTTP": "h11"},
+    ),
+    "runner 1 worker (uvloop, httptools)": (
+        [sys.executable, "-m", "app.core.runner"],
+        {"SERVER_WORKERS": "1"},
+    ),
+    "runner 2 workers (uvloop, httptools)": (
+        [sys.executable, "-m", "app.core.runner"],
+        {"SERVER_WORKERS": "2"},
+    ),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_request(path: str, token: str) -> bytes:
+    return (
+        f"GET {path} HTTP/1.1\r\nHost: bench\r\n"
+        f"Authorization: Bearer {token}\r\n\r\n"
+    ).encode()
+
+
+def wait_for_server(port: int, request: bytes, timeout: float = 30) -> None:
+    # ソケットは先に開かれるので、アプリが起動してレスポンスを返すまで待つ
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1) as sock:
+                sock.sendall(request)
+                if sock.recv(16).startswith(b"HTTP/1.1 200"):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"server did not start on port {port}")
+
+
+def unique_set_size(pid: int) -> int:
+    with open(f"/proc/{pid}/smaps_rollup") as rollup:
+        fields = dict(line.split(":", 1) for line in rollup if ":" in line)
+    return sum(
+        int(fields[name].split()[0]) * 1024
+        for name in ("Private_Clean", "Private_Dirty")
+    )
+
+
+def worker_pids(pid: int) -> List[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as children:
+        return [int(child) for child in children.read().split()]
+
+
+async def keep_requesting(
+    port: int, request: bytes, deadline: float, counts: List[int]
+) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    while time.monotonic() < deadline:
+        try:
+            writer.write(request)
+            headers = await reader.readuntil(b"\r\n\r\n")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # 入れ替わるワーカーは Keep-Alive の接続を閉じるので、つなぎ直す
+            writer.close()
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            continue
+        length = 0
+        for line in headers.split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.lower() == b"content-length":
+                length = int(value)
+        await reader.readexactly(length)
+        counts[0] += 1
+    writer.close()
+
+
+async def measure(port: int, request: bytes, connections: int, seconds: float) -> float:
+    # 接続を張ってから1秒は数えない
+    await asyncio.gather(
+        *(
+            keep_requesting(port, request, time.monotonic() + 1, [0])
+            for _ in range(connections)
+        )
+    )
+    counts = [0]
+    started_at = time.monotonic()
+    await asyncio.gather(
+        *(
+            keep_requesting(port, request, started_at + seconds, counts)
+            for _ in range(connections)
+        )
+    )
+    return counts[0] / (time.monotonic() - started_at)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--path", default="/api/metrics/")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    # 負荷をかける側と CPU を取り合うとぶれるので、中央値を表示する
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    token = secrets.token_hex(16)
+    request = build_request(args.path, token)
+
+    for label, (command, settings) in SERVERS.items():
+        port = free_port()
+        env: Dict[str, str] = {
+            **os.environ,
+            **settings,
+            "SERVER_HOST": "127.0.0.1",
+            "SERVER_PORT": str(port),
+            "METRICS_TOKEN": token,
+        }
+        server = subprocess.Popen(
+            [*command, "--port", str(port)] if command[0] == "uvicorn" else command,
+            env=env,
+            stderr=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_server(port, request)
+            throughput = statistics.median(
+                asyncio.run(measure(port, request, args.connections, args.seconds))
+                for _ in range(args.repeat)
+            )
+            memory = ""
+            if command[0] != "uvicorn":
+                sizes = [unique_set_size(pid) for pid in worker_pids(server.pid)]
+                memory = ", worker USS " + " / ".join(
+                    f"{size / 2**20:.1f} MB" for size in sizes
+                )
+            print(f"{label:>38}: {throughput:8.1f} requests/s{memory}")
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+databases に文字列の SQL を渡す経路と、コンパイル済みの Statement を asyncpg で
+直接実行する経路で、1回の問い合わせにかかる時間を比べる
+
+    python -m benchmarks.statements [--dsn postgresql://...] [--number 5000]
+
+DB に問い合わせる時間の他に、クライアント側の処理
+(パラメータの変換と行のラップ) だけにかかる時間も表示する。
+"""
+
+import argparse
+import asyncio
+import time
+import timeit
+
+from app.core.config import DATABASE_URL
+from app.db.repositories.hedgehogs import GET_HEDGEHOG_BY_ID_QUERY
+from app.db.statements import StatementDatabase
+from databases.backends.postgres import PostgresConnection
+
+
+async def time_queries(
+    db: StatementDatabase, query: str, id: int, number: int
+) -> float:
+    best = float("inf")
+    for _ in range(5):
+        started_at = time.perf_counter()
+        for _ in range(number):
+            await db.fetch_one(query, values={"id": id})
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dsn", default=str(DATABASE_URL))
+    parser.add_argument("--number", type=int, default=5_000)
+    args = parser.parse_args()
+
+    db = StatementDatabase(args.dsn, min_size=1, max_size=1)
+    await db.connect()
+    try:
+        id = await db.fetch_val(
+            "INSERT INTO hedgehogs (name, age, color_type)"
+            " VALUES ('benchmark', 1, 'SOLT & PEPPER') RETURNING id"
+        )
+        async with db.connection():
+            for name, query in (
+                ("databases", str(GET_HEDGEHOG_BY_ID_QUERY)),
+                ("statement", GET_HEDGEHOG_BY_ID_QUERY),
+            ):
+                await db.fetch_one(query, values={"id": id})
+                seconds = await time_queries(db, query, id, args.number)
+                print(f"{name:>10}: {seconds / args.number * 1e6:8.2f} us/query")
+
+        # DB を使わずに、パラメータの変換だけを比べる
+        connection = db.connection()._connection
+        assert isinstance(connection, PostgresConnection)
+        built_query = db.connection()._build_query(
+            str(GET_HEDGEHOG_BY_ID_QUERY), {"id": id}
+        )
+        for name, function in (
+            ("databases", lambda: connection._compile(built_query)),
+            ("statement", lambda: GET_HEDGEHOG_BY_ID_QUERY.arguments({"id": id})),
+        ):
+            seconds = min(timeit.repeat(function, number=args.number, repeat=5))
+            print(f"{name:>10}: {seconds / args.number * 1e6:8.2f} us/compile")
+    finally:
+        await db.execute("DELETE FROM hedgehogs WHERE name = 'benchmark'")
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""
+テーブルの変更カウンタを1行にした場合と、セッションごとに複数の行に分けた場合で、
+同時に書き込むトランザクションの件数を比べる
+
+    python -m benchmarks.table_versions [--dsn postgresql://...] [--connections 16] [--hold 0.005]
+
+各接続は、カウンタを加算してから --hold 秒待ってコミットするトランザクションを繰り返す
+(トリガーで加算したあと、同じトランザクションで他の処理をしている間を模している)。
+1行の場合はカウンタの行ロックをコミットまで持つので、トランザクションが1つずつしか進まない。
+"""
+
+import argparse
+import asyncio
+import time
+
+from app.core.config import DATABASE_URL
+from databases import Database
+
+SHARDS = 16
+
+# マイグレーション c7e4a1f95b28 の前後の bump_table_version と同じ文
+BUMP_QUERIES = {
+    "single row": """
+        INSERT INTO table_versions (table_name, shard, version)
+        VALUES ('benchmark', 0, 1)
+        ON CONFLICT (table_name, shard)
+        DO UPDATE SET version = table_versions.version + 1
+    """,
+    f"{SHARDS} shards": f"""
+        INSERT INTO table_versions (table_name, shard, version)
+        VALUES ('benchmark', pg_backend_pid() % {SHARDS}, 1)
+        ON CONFLICT (table_name, shard)
+        DO UPDATE SET version = table_versions.version + 1
+    """,
+}
+
+
+async def keep_writing(
+    db: Database, query: str, hold: float, deadline: float, counts: list
+) -> None:
+    async with db.connection() as connection:
+        while time.monotonic() < deadline:
+            async with connection.transaction():
+                await connection.execute(query)
+                await asyncio.sleep(hold)
+            counts[0] += 1
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dsn", default=str(DATABASE_URL))
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--hold", type=float, default=0.005)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    db = Database(args.dsn, min_size=args.connections, max_size=args.connections)
+    await db.connect()
+    try:
+        for label, query in BUMP_QUERIES.items():
+            counts = [0]
+            started_at = time.monotonic()
+            await asyncio.gather(
+                *(
+                    keep_writing(
+                        db, query, args.hold, started_at + args.seconds, counts
+                    )
+                    for _ in range(args.connections)
+                )
+            )
+            throughput = counts[0] / (time.monotonic() - started_at)
+            print(f"{label:>10}: {throughput:8.1f} transactions/s")
+    finally:
+        await db.execute("DELETE FROM table_versions WHERE table_name = 'benchmark'")
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
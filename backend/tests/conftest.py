@@ -1,44 +1,62 @@
 """
 フィクスチャを定義するファイル
+
+テストは設定された Postgres のサーバーに {POSTGRES_DB}_test のデータベースを作り直して実行する。
+TEST_POSTGRES_CONTAINER=1 の場合は、docker で Postgres のコンテナを起動して使う。
 """
 
 import os
 import subprocess
 import uuid
 import warnings
-
-import alembic
-import docker as pydocker
-import pytest
-from alembic.config import Config
-from app.core.config import JWT_TOKEN_PREFIX, SECRET_KEY
-from app.db.repositories.hedgehogs import HedgehogsRepository, UsersRepository
-from app.models.hedgehog import HedgehogCreate, HedgehogInDB
-from app.models.user import UserCreate, UserInDB
-from app.services import auth_service
-from asgi_lifespan import LifespanManager
-from databases import Database
-from fastapi import FastAPI
-from httpx import AsyncClient
-from tests.utility import ping_postgress
+from typing import Iterator
+
+from starlette.config import Config as EnvConfig
+
+# .env がなくてもテストを実行できるよう、必須の設定にテスト用の値を入れる
+# (環境変数と .env に設定されている値が優先される)
+TEST_SETTINGS = {
+    "SECRET_KEY": "test-secret-key",
+    "POSTGRES_USER": "postgres",
+    "POSTGRES_PASSWORD": "postgres",
+    "POSTGRES_DB": "postgres",
+}
+env_file_values = EnvConfig(".env").file_values if os.path.isfile(".env") else {}
+for name, value in TEST_SETTINGS.items():
+    if name not in env_file_values:
+        os.environ.setdefault(name, value)
+
+import alembic  # noqa: E402
+import psycopg2  # noqa: E402
+import pytest  # noqa: E402
+from alembic.config import Config  # noqa: E402
+from app.core.config import DATABASE_URL, JWT_TOKEN_PREFIX  # noqa: E402
+from app.db.repositories.hedgehogs import HedgehogsRepository  # noqa: E402
+from app.db.repositories.users import UsersRepository  # noqa: E402
+from app.models.hedgehog import HedgehogCreate, HedgehogInDB  # noqa: E402
+from app.models.user import UserCreate, UserInDB  # noqa: E402
+from app.services import auth_service  # noqa: E402
+from asgi_lifespan import LifespanManager  # noqa: E402
+from databases import Database  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from httpx import AsyncClient  # noqa: E402
+from tests.utility import ping_postgress  # noqa: E402
 
 config = Config("alembic.ini")
 
 
 @pytest.fixture(scope="session")
-def docker() -> pydocker.APIClient:
-    # base url is the unix socket we use to communicate with docker
-    return pydocker.APIClient(base_url="unix://var/run/docker.sock", version="auto")
-
-
-@pytest.fixture(scope="session", autouse=True)
-def postgres_container(docker: pydocker.APIClient) -> None:
+def postgres_container() -> Iterator[str]:
     """
     Use docker to spin up a postgres container for the duration of the testing session.
     Kill it as soon as all tests are run.
     DB actions persist across the entirety of the testing session.
     """
+    import docker as pydocker
+
     warnings.filterwarnings("ignore", category=DeprecationWarning)
+    # base url is the unix socket we use to communicate with docker
+    docker = pydocker.APIClient(base_url="unix://var/run/docker.sock", version="auto")
 
     image = "postgres:12.1-alpine"
     docker.pull(image)
@@ -70,14 +88,48 @@ def postgres_container(docker: pydocker.APIClient) -> None:
 
     try:
         ping_postgress(dsn)
-        os.environ["CONTAINER_dsn"] = dsn
-        alembic.command.upgrade(config, "head")
-        yield container
+        yield dsn
     finally:
         docker.kill(container["Id"])
         docker.remove_container(container["Id"])
 
 
+@pytest.fixture(scope="session")
+def postgres_test_database() -> Iterator[str]:
+    """
+    設定された Postgres のサーバーにテスト用のデータベースを作り直し、終わったら削除する
+    """
+    name = f"{DATABASE_URL.database}_test"
+    server = psycopg2.connect(str(DATABASE_URL.replace(database="postgres")))
+    server.autocommit = True
+    try:
+        with server.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+            cursor.execute(f'CREATE DATABASE "{name}"')
+        yield str(DATABASE_URL.replace(database=name))
+        with server.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    finally:
+        server.close()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def migrated_database(request: pytest.FixtureRequest) -> Iterator[str]:
+    """
+    テストで使うデータベースにマイグレーションを適用する
+
+    アプリとマイグレーションは CONTAINER_DSN が設定されていればその接続先を使う。
+    """
+    if os.getenv("TEST_POSTGRES_CONTAINER"):
+        dsn = request.getfixturevalue("postgres_container")
+    else:
+        dsn = request.getfixturevalue("postgres_test_database")
+    os.environ["CONTAINER_DSN"] = dsn
+    alembic.command.upgrade(config, "head")
+    yield dsn
+    del os.environ["CONTAINER_DSN"]
+
+
 @pytest.fixture
 def app() -> FastAPI:
     from app.api.server import get_application
@@ -121,7 +173,9 @@ async def test_user(db: Database) -> UserInDB:
         password="nmomosissocute",
     )
     user_repo = UsersRepository(db)
-    existing_user = await user_repo.get_user_by_email(email=new_user.email)
+    existing_user = await user_repo.get_user_by_email(
+        email=new_user.email, populate=True
+    )
     # ユーザーの存在チェックをフィクスチャでする
     # テスト用のpostgresコンテナはスコープがsessionなので、
     # 存在確認をせずにユーザーを作成すると、
@@ -158,7 +212,9 @@ async def test_user2(db: Database) -> UserInDB:
         password="nmomosissocute2",
     )
     user_repo = UsersRepository(db)
-    existing_user = await user_repo.get_user_by_email(email=new_user.email)
+    existing_user = await user_repo.get_user_by_email(
+        email=new_user.email, populate=True
+    )
     if existing_user:
         return existing_user
     return await user_repo.register_new_user(new_user=new_user)
@@ -0,0 +1,169 @@
+import asyncio
+from typing import Any, Optional
+
+import pytest
+from app.db.cache import (
+    MISSING,
+    CacheBackend,
+    MemoryCacheBackend,
+    NullCacheBackend,
+    RepositoryCache,
+    cached,
+    invalidates,
+)
+from pydantic import BaseModel
+from tests.utility import SerializedMemoryCacheBackend
+
+pytestmark = pytest.mark.asyncio
+
+
+class Item(BaseModel):
+    id: int
+    owner: int
+
+
+class FakeRepository:
+    """
+    キャッシュのデコレータを確認するための DB を使わないリポジトリ
+    """
+
+    def __init__(self, cache: RepositoryCache) -> None:
+        self.cache = cache
+        self.calls = 0
+
+    @cached("item:{id}", tags=("item:{id}", "owner:{result[owner]}"))
+    async def get_item(self, *, id: int) -> dict:
+        self.calls += 1
+        return {"id": id, "owner": 1} if id > 0 else None
+
+    @cached("model:{id}", tags=("item:{id}",))
+    async def get_model(self, *, id: int) -> Optional[Item]:
+        self.calls += 1
+        return Item(id=id, owner=1)
+
+    @cached("secret:{id}", local_only=True)
+    async def get_secret(self, *, id: int) -> dict:
+        self.calls += 1
+        return {"id": id, "password": "hashed"}
+
+    @invalidates("item:{id}")
+    async def update_item(self, *, id: int) -> None:
+        pass
+
+
+class TestMemoryCacheBackend:
+    async def test_least_recently_used_entry_is_evicted(self) -> None:
+        backend = MemoryCacheBackend(max_entries=2)
+        await backend.set("a", 1, ttl=60, tags=())
+        await backend.set("b", 2, ttl=60, tags=())
+        assert await backend.get("a") == 1
+        await backend.set("c", 3, ttl=60, tags=())
+
+        assert await backend.get("b") is MISSING
+        assert await backend.get("a") == 1
+        assert backend.evictions == 1
+
+    async def test_expired_entry_is_not_returned(self) -> None:
+        backend = MemoryCacheBackend(max_entries=10)
+        await backend.set("a", 1, ttl=0.01, tags=())
+        await asyncio.sleep(0.02)
+        assert await backend.get("a") is MISSING
+
+    async def test_entries_are_invalidated_by_tag(self) -> None:
+        backend = MemoryCacheBackend(max_entries=10)
+        await backend.set("a", 1, ttl=60, tags=("user:1",))
+        await backend.set("b", 2, ttl=60, tags=("user:1", "user:2"))
+        await backend.set("c", 3, ttl=60, tags=("user:2",))
+        await backend.invalidate_tags(["user:1"])
+
+        assert await backend.get("a") is MISSING
+        assert await backend.get("b") is MISSING
+        assert await backend.get("c") == 3
+
+    async def test_backend_must_implement_the_interface(self) -> None:
+        class IncompleteCacheBackend(CacheBackend):
+            async def get(self, key: str) -> Any:
+                return MISSING
+
+        with pytest.raises(TypeError):
+            IncompleteCacheBackend()
+
+
+class TestCachedRepositoryMethods:
+    async def test_read_through_and_invalidation(self) -> None:
+        cache = RepositoryCache(MemoryCacheBackend(max_entries=10), ttl=60)
+        repo = FakeRepository(cache)
+
+        assert await repo.get_item(id=1) == {"id": 1, "owner": 1}
+        assert await repo.get_item(id=1) == {"id": 1, "owner": 1}
+        assert repo.calls == 1
+
+        await repo.update_item(id=1)
+        await repo.get_item(id=1)
+        assert repo.calls == 2
+        assert cache.stats() == {
+            "hits": 1,
+            "misses": 2,
+            "evictions": 0,
+            "invalidations": 1,
+        }
+
+    async def test_none_is_not_cached(self) -> None:
+        repo = FakeRepository(
+            RepositoryCache(MemoryCacheBackend(max_entries=10), ttl=60)
+        )
+        assert await repo.get_item(id=0) is None
+        assert await repo.get_item(id=0) is None
+        assert repo.calls == 2
+
+
+class TestSerializedBackend:
+    async def test_values_are_stored_as_json_of_the_return_type(self) -> None:
+        backend = SerializedMemoryCacheBackend(max_entries=10)
+        repo = FakeRepository(RepositoryCache(backend, ttl=60))
+
+        assert await repo.get_model(id=1) == Item(id=1, owner=1)
+        assert await backend.get("model:1") == b'{"id":1,"owner":1}'
+        cached_item = await repo.get_model(id=1)
+        assert isinstance(cached_item, Item)
+        assert cached_item == Item(id=1, owner=1)
+        assert repo.calls == 1
+
+        assert await repo.get_item(id=2) == {"id": 2, "owner": 1}
+        assert await repo.get_item(id=2) == {"id": 2, "owner": 1}
+        assert repo.calls == 2
+
+    async def test_local_only_results_are_not_written(self) -> None:
+        backend = SerializedMemoryCacheBackend(max_entries=10)
+        repo = FakeRepository(RepositoryCache(backend, ttl=60))
+
+        await repo.get_secret(id=1)
+        await repo.get_secret(id=1)
+        assert repo.calls == 2
+        assert await backend.get("secret:1") is MISSING
+
+    async def test_local_only_results_are_cached_in_process(self) -> None:
+        repo = FakeRepository(
+            RepositoryCache(MemoryCacheBackend(max_entries=10), ttl=60)
+        )
+        await repo.get_secret(id=1)
+        await repo.get_secret(id=1)
+        assert repo.calls == 1
+
+
+class TestConfigureForWorkers:
+    async def test_memory_backend_is_disabled_for_multiple_workers(self) -> None:
+        cache = RepositoryCache(MemoryCacheBackend(max_entries=10), ttl=60)
+        cache.configure_for_workers(2)
+        assert isinstance(cache.backend, NullCacheBackend)
+
+        repo = FakeRepository(cache)
+        await repo.get_item(id=1)
+        await repo.get_item(id=1)
+        assert repo.calls == 2
+
+    async def test_memory_backend_is_kept_for_a_single_worker(self) -> None:
+        backend = MemoryCacheBackend(max_entries=10)
+        cache = RepositoryCache(backend, ttl=60)
+        cache.configure_for_workers(1)
+        assert cache.backend is backend
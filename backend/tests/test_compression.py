@@ -0,0 +1,277 @@
+import asyncio
+import gzip
+import json
+import zlib
+from typing import List
+
+import pytest
+from app.api.middleware.compression import (
+    CompressionMiddleware,
+    CompressionStats,
+    choose_encoding,
+)
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+from httpx import AsyncClient
+from starlette.types import Message, Send
+
+pytestmark = pytest.mark.asyncio
+
+LEVELS = {"br": 4, "zstd": 3, "gzip": 6}
+ROWS = [
+    {"id": i, "name": f"hedgehog {i}", "color_type": "DARK GREY"} for i in range(200)
+]
+
+
+def create_app(stats: CompressionStats) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(
+        CompressionMiddleware, minimum_size=1024, levels=LEVELS, stats=stats
+    )
+
+    @app.get("/large")
+    async def large() -> Response:
+        return Response(
+            json.dumps(ROWS), media_type="application/json", headers={"ETag": '"v1"'}
+        )
+
+    @app.get("/small")
+    async def small(response: Response) -> dict:
+        response.headers["ETag"] = '"v1"'
+        return {"id": 1}
+
+    @app.get("/not-modified")
+    async def not_modified() -> Response:
+        return Response(status_code=304, headers={"ETag": '"v1"'})
+
+    @app.get("/stream")
+    async def stream() -> StreamingResponse:
+        async def rows():
+            for row in ROWS:
+                yield json.dumps(row) + "\n"
+
+        return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+    @app.get("/image")
+    async def image() -> Response:
+        return Response(b"\x89PNG" + b"0" * 4096, media_type="image/png")
+
+    @app.get("/no-transform")
+    async def no_transform() -> Response:
+        return Response(
+            json.dumps(ROWS),
+            media_type="application/json",
+            headers={"Cache-Control": "no-transform"},
+        )
+
+    return app
+
+
+async def call_streaming(app: FastAPI, path: str, send: Send) -> None:
+    """
+    ASGI のアプリを直接呼び出す (httpx はレスポンスを最後まで読んでから返すので、
+    送られてくるメッセージの単位が分からない)
+    """
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive() -> Message:
+        if requests:
+            return requests.pop()
+        # 切断されないまま、レスポンスを送り終えるまで待つ
+        await asyncio.Event().wait()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"accept-encoding", b"gzip")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    await app(scope, receive, send)
+
+
+@pytest.fixture
+async def stats() -> CompressionStats:
+    return CompressionStats()
+
+
+@pytest.fixture
+async def compression_client(stats: CompressionStats) -> AsyncClient:
+    async with AsyncClient(
+        app=create_app(stats), base_url="http://testserver"
+    ) as client:
+        yield client
+
+
+class TestChooseEncoding:
+    @pytest.mark.parametrize(
+        "accept_encoding, expected",
+        (
+            ("gzip, deflate", "gzip"),
+            ("br, gzip", "br"),
+            ("gzip;q=1.0, br;q=0.5", "gzip"),
+            ("zstd, br", "br"),
+            ("*", "br"),
+            ("*, br;q=0", "zstd"),
+            ("gzip;q=0", None),
+            ("identity", None),
+            ("x-gzip", "gzip"),
+            ("GZIP;Q=0.8", "gzip"),
+            ("gzip;q=abc", None),
+            ("", None),
+        ),
+    )
+    async def test_highest_weighted_available_encoding_is_chosen(
+        self, accept_encoding: str, expected: str
+    ) -> None:
+        assert choose_encoding(accept_encoding, ["br", "zstd", "gzip"]) == expected
+
+    async def test_unavailable_encodings_are_never_chosen(self) -> None:
+        assert choose_encoding("br, zstd", ["gzip"]) is None
+        assert choose_encoding("br, gzip;q=0.1", ["gzip"]) == "gzip"
+
+
+class TestCompressionMiddleware:
+    async def test_large_responses_are_gzipped(
+        self, compression_client: AsyncClient, stats: CompressionStats
+    ) -> None:
+        res = await compression_client.get(
+            "/large", headers={"Accept-Encoding": "gzip"}
+        )
+        assert res.headers["Content-Encoding"] == "gzip"
+        assert res.headers["Vary"] == "Accept-Encoding"
+        assert int(res.headers["Content-Length"]) < len(json.dumps(ROWS))
+        # 表現が変わるので ETag は弱い ETag になる
+        assert res.headers["ETag"] == 'W/"v1"'
+        assert res.json() == ROWS
+
+        gzip_stats = stats.stats()["encodings"]["gzip"]
+        assert gzip_stats["responses"] == 1
+        assert gzip_stats["bytes_in"] == len(json.dumps(ROWS))
+        assert gzip_stats["bytes_out"] == int(res.headers["Content-Length"])
+        assert gzip_stats["ratio"] < 1
+        assert gzip_stats["cpu_ns_per_byte"] >= 0
+
+    async def test_responses_are_not_compressed_without_accept_encoding(
+        self, compression_client: AsyncClient
+    ) -> None:
+        res = await compression_client.get(
+            "/large", headers={"Accept-Encoding": "identity"}
+        )
+        assert "Content-Encoding" not in res.headers
+        assert res.headers["Vary"] == "Accept-Encoding"
+        assert res.headers["ETag"] == '"v1"'
+        assert res.json() == ROWS
+
+    async def test_small_responses_are_not_compressed(
+        self, compression_client: AsyncClient, stats: CompressionStats
+    ) -> None:
+        res = await compression_client.get(
+            "/small", headers={"Accept-Encoding": "gzip"}
+        )
+        assert "Content-Encoding" not in res.headers
+        assert res.headers["Content-Length"] == str(len(res.content))
+        assert res.json() == {"id": 1}
+        assert stats.stats()["skipped_below_minimum"] == 1
+        # 圧縮しなくても、圧縮した場合と同じ弱い ETag にする
+        assert res.headers["ETag"] == 'W/"v1"'
+
+    async def test_not_modified_responses_have_same_etag_as_compressed(
+        self, compression_client: AsyncClient
+    ) -> None:
+        res = await compression_client.get(
+            "/not-modified", headers={"Accept-Encoding": "gzip"}
+        )
+        assert res.status_code == 304
+        assert res.headers["ETag"] == 'W/"v1"'
+        assert res.headers["Vary"] == "Accept-Encoding"
+
+        res = await compression_client.get(
+            "/not-modified", headers={"Accept-Encoding": "identity"}
+        )
+        assert res.headers["ETag"] == '"v1"'
+
+    @pytest.mark.parametrize("path", ("/image", "/no-transform"))
+    async def test_incompressible_responses_are_passed_through(
+        self, compression_client: AsyncClient, path: str
+    ) -> None:
+        res = await compression_client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in res.headers
+        assert "Vary" not in res.headers
+
+    async def test_streaming_responses_are_compressed_chunk_by_chunk(
+        self, stats: CompressionStats
+    ) -> None:
+        app = create_app(stats)
+        messages: List[Message] = []
+
+        async def send(message: Message) -> None:
+            messages.append(message)
+
+        await call_streaming(app, "/stream", send)
+
+        start, *bodies = messages
+        headers = dict(start["headers"])
+        assert headers[b"content-encoding"] == b"gzip"
+        assert b"content-length" not in headers
+        # 溜めずに、チャンクごとに送り出される
+        assert len(bodies) == len(ROWS) + 1
+        assert all(message["more_body"] for message in bodies[:-1])
+        assert not bodies[-1]["more_body"]
+
+        # 途中までのチャンクだけでも展開できる
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        partial = decompressor.decompress(bodies[0]["body"])
+        assert partial.startswith(json.dumps(ROWS[0]).encode())
+
+        body = b"".join(message["body"] for message in bodies)
+        expected = "".join(json.dumps(row) + "\n" for row in ROWS)
+        assert gzip.decompress(body).decode() == expected
+
+    async def test_first_streaming_chunk_is_sent_before_minimum_size(
+        self, stats: CompressionStats
+    ) -> None:
+        app = create_app(stats)
+        first_chunk_sent = asyncio.Event()
+        bodies: List[bytes] = []
+
+        @app.get("/slow-stream")
+        async def slow_stream() -> StreamingResponse:
+            async def rows():
+                yield json.dumps(ROWS[0]) + "\n"
+                # 最初のチャンクが送られるまで次を作らない (溜めていると終わらない)
+                await first_chunk_sent.wait()
+                yield json.dumps(ROWS[1]) + "\n"
+
+            return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+        async def send(message: Message) -> None:
+            if message["type"] == "http.response.body":
+                bodies.append(message["body"])
+                first_chunk_sent.set()
+
+        await asyncio.wait_for(call_streaming(app, "/slow-stream", send), timeout=5)
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        assert (
+            decompressor.decompress(bodies[0]) == (json.dumps(ROWS[0]) + "\n").encode()
+        )
+
+    @pytest.mark.parametrize(
+        "encoding, module", (("br", "brotli"), ("zstd", "zstandard"))
+    )
+    async def test_optional_encodings_are_used_when_installed(
+        self, compression_client: AsyncClient, encoding: str, module: str
+    ) -> None:
+        pytest.importorskip(module)
+        res = await compression_client.get(
+            "/large", headers={"Accept-Encoding": encoding}
+        )
+        assert res.headers["Content-Encoding"] == encoding
@@ -0,0 +1,23 @@
+from typing import List, Optional
+
+import pytest
+from app.api.dependencies.etag import parse_entity_tags
+
+
+class TestParseEntityTags:
+    @pytest.mark.parametrize(
+        "header, tags",
+        (
+            ('"1-2"', ['"1-2"']),
+            ('W/"1-2"', ['"1-2"']),
+            (' "1-1" , W/"1-2",, ', ['"1-1"', '"1-2"']),
+            ('"a,b", "c"', ['"a,b"', '"c"']),
+            ("1-2", None),
+            ('"1-2" "1-3"', None),
+            ('w/"1-2"', None),
+            ('"1-2', None),
+            (" , ", None),
+        ),
+    )
+    def test_parse_entity_tags(self, header: str, tags: Optional[List[str]]) -> None:
+        assert parse_entity_tags(header) == tags
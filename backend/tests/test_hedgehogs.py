@@ -1,13 +1,25 @@
-from typing import List
+import json
+from typing import List, Optional
 
+import msgpack
 import pytest
-from app.models.hedgehog import HedgehogCreate, HedgehogInDB
+from app.api.dependencies.pagination import encode_cursor
+from app.db.repositories.hedgehogs import (
+    GET_HEDGEHOGS_PAGE_QUERY,
+    HedgehogsRepository,
+    build_hedgehogs_where_clause,
+)
+from app.models.hedgehog import HedgehogCreate, HedgehogFilter, HedgehogInDB
+from databases import Database
 from fastapi import FastAPI
 from httpx import AsyncClient
 from starlette.status import (
     HTTP_200_OK,
     HTTP_201_CREATED,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_400_BAD_REQUEST,
     HTTP_404_NOT_FOUND,
+    HTTP_412_PRECONDITION_FAILED,
     HTTP_422_UNPROCESSABLE_ENTITY,
 )
 
@@ -21,8 +33,7 @@ def new_hedgehog():
         name="test hedgehog",
         description="test description",
         age=0.0,
-        color="SOLT & PEPPER",
-        species="AFRICAN PYGMY HEDGEHOG",
+        color_type="SOLT & PEPPER",
     )
 
 
@@ -99,7 +110,7 @@ class TestGetHedgehog:
         )
         assert res.status_code == HTTP_200_OK
         hedgehog = HedgehogInDB(**res.json())
-        assert hedgehog.id == test_hedgehog
+        assert hedgehog == test_hedgehog
 
     @pytest.mark.parametrize(
         "id, status_code",
@@ -132,8 +143,8 @@ class TestUpdateHedgehog:
         (
             (["name"], ["new fake hedgehog name"]),
             (["description"], ["new fake description"]),
-            (["age"], [3.14]),
-            (["color_type"], ["SOLT & PEPPER"]),
+            (["age"], [3.5]),
+            (["color_type"], ["DARK GREY"]),
             (
                 ["name", "description"],
                 ["extra new fake hedgehog name", "extra new fake description"],
@@ -189,11 +200,32 @@ class TestUpdateHedgehog:
     ) -> None:
         hedgehog_update = {"hedgehog_update": payload}
         res = await client.put(
-            app.url_path_for("hedghogs:update-hedgehog-by-id", id=id),
+            app.url_path_for("hedgehogs:update-hedgehog-by-id", id=id),
             json=hedgehog_update,
         )
         assert res.status_code == status_code
 
+    @pytest.mark.parametrize(
+        "payload",
+        ({"age": 1e12}, {"name": None}),
+    )
+    async def test_update_rejected_by_database_returns_400(
+        self,
+        app: FastAPI,
+        client: AsyncClient,
+        test_hedgehog: HedgehogInDB,
+        payload: dict,
+    ) -> None:
+        """
+        列の範囲や NOT NULL の違反は 500 ではなく 400 になることを確認するテスト
+        """
+        res = await client.patch(
+            app.url_path_for("hedgehogs:patch-hedgehog-by-id", id=test_hedgehog.id),
+            json={"hedgehog_update": payload},
+        )
+        assert res.status_code == HTTP_400_BAD_REQUEST
+        assert res.json()["detail"] == "Invalid update params."
+
 
 class TestDeleteHedgehog:
     async def test_delete_hedgehog_successfully(
@@ -229,3 +261,791 @@ class TestDeleteHedgehog:
             app.url_path_for("hedgehogs:delete-hedgehog-by-id", id=id)
         )
         assert res.status_code == status_code
+
+
+class TestHedgehogsPagination:
+    async def test_pages_can_be_followed_with_cursor(
+        self, app: FastAPI, client: AsyncClient, test_hedgehog: HedgehogInDB
+    ) -> None:
+        """
+        limit を指定すると X-Next-Cursor を辿って次のページを取得できることを確認するテスト
+        """
+        # 2件以上存在することを保証する
+        await client.post(
+            app.url_path_for("hedgehogs:create-hedgehog"),
+            json={
+                "new_hedgehog": {
+                    "name": "paged",
+                    "description": None,
+                    "age": 1.0,
+                    "color_type": "CHOCOLATE",
+                }
+            },
+        )
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-all-hedgehogs"), params={"limit": 1}
+        )
+        assert res.status_code == HTTP_200_OK
+        assert len(res.json()) == 1
+        cursor = res.headers.get("X-Next-Cursor")
+        assert cursor is not None
+        assert 'rel="next"' in res.headers["Link"]
+
+        next_res = await client.get(
+            app.url_path_for("hedgehogs:get-all-hedgehogs"),
+            params={"limit": 1, "after": cursor},
+        )
+        assert next_res.status_code == HTTP_200_OK
+        assert next_res.json()[0]["id"] > res.json()[0]["id"]
+
+    async def test_approximate_total_is_returned_on_request(
+        self, app: FastAPI, client: AsyncClient, test_hedgehog: HedgehogInDB
+    ) -> None:
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-all-hedgehogs"),
+            params={"include_total": True},
+        )
+        assert res.status_code == HTTP_200_OK
+        assert int(res.headers["X-Total-Count-Estimate"]) >= 0
+
+    @pytest.mark.parametrize(
+        "params, status_code",
+        (
+            ({"limit": 0}, 422),
+            ({"limit": 100000}, 422),
+            ({"after": "not-a-cursor"}, 400),
+            ({"after": "eyJpZCI6ImEifQ"}, 400),
+            ({"after": encode_cursor({"id": True})}, 400),
+            ({"after": encode_cursor({"id": 0})}, 400),
+            ({"after": encode_cursor({"id": 2**31})}, 400),
+        ),
+    )
+    async def test_invalid_page_params_raise_error(
+        self, app: FastAPI, client: AsyncClient, params: dict, status_code: int
+    ) -> None:
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-all-hedgehogs"), params=params
+        )
+        assert res.status_code == status_code
+
+
+class TestHedgehogsExport:
+    async def test_export_streams_ndjson(
+        self, app: FastAPI, client: AsyncClient, test_hedgehog: HedgehogInDB
+    ) -> None:
+        res = await client.get(app.url_path_for("hedgehogs:export-hedgehogs"))
+        assert res.status_code == HTTP_200_OK
+        assert res.headers["content-type"].startswith("application/x-ndjson")
+        hedgehogs = [HedgehogInDB(**json.loads(line)) for line in res.text.splitlines()]
+        assert test_hedgehog in hedgehogs
+
+    async def test_export_streams_json_array(
+        self, app: FastAPI, client: AsyncClient, test_hedgehog: HedgehogInDB
+    ) -> None:
+        res = await client.get(
+            app.url_path_for("hedgehogs:export-hedgehogs"), params={"format": "json"}
+        )
+        assert res.status_code == HTTP_200_OK
+        assert isinstance(res.json(), list)
+        hedgehogs = [HedgehogInDB(**item) for item in res.json()]
+        assert test_hedgehog in hedgehogs
+
+    async def test_export_rejects_unknown_format(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        res = await client.get(
+            app.url_path_for("hedgehogs:export-hedgehogs"), params={"format": "xml"}
+        )
+        assert res.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestBulkCreateHedgehogs:
+    async def test_json_array_is_created_in_one_request(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        new_hedgehogs = [
+            {
+                "name": f"bulk {i}",
+                "description": None,
+                "age": i,
+                "color_type": "CHOCOLATE",
+            }
+            for i in range(3)
+        ]
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"), json=new_hedgehogs
+        )
+        assert res.status_code == HTTP_201_CREATED
+        ids = res.json()["ids"]
+        assert len(ids) == 3
+
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-hedgehog-by-id", id=ids[0])
+        )
+        assert res.status_code == HTTP_200_OK
+        assert res.json()["name"] == "bulk 0"
+
+    async def test_msgpack_array_is_created_and_listed_as_msgpack(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        new_hedgehogs = [
+            {
+                "name": f"msgpack {i}",
+                "description": None,
+                "age": i,
+                "color_type": "CHOCOLATE",
+            }
+            for i in range(3)
+        ]
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"),
+            content=msgpack.packb(new_hedgehogs),
+            headers={"Content-Type": "application/msgpack"},
+        )
+        assert res.status_code == HTTP_201_CREATED
+        assert len(res.json()["ids"]) == 3
+
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-all-hedgehogs"),
+            params={"name_prefix": "msgpack"},
+            headers={"Accept": "application/msgpack"},
+        )
+        assert res.status_code == HTTP_200_OK
+        assert res.headers["Content-Type"] == "application/msgpack"
+        hedgehogs = msgpack.unpackb(res.content)
+        assert sorted(hedgehog["name"] for hedgehog in hedgehogs) == [
+            "msgpack 0",
+            "msgpack 1",
+            "msgpack 2",
+        ]
+
+    async def test_csv_upload_is_created(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        content = (
+            "name,description,age,color_type\n"
+            "csv one,,1.5,DARK GREY\n"
+            "csv two,from csv,2,SOLT & PEPPER\n"
+        )
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"),
+            content=content,
+            headers={"Content-Type": "text/csv"},
+        )
+        assert res.status_code == HTTP_201_CREATED
+        assert len(res.json()["ids"]) == 2
+
+    async def test_invalid_rows_are_reported_and_nothing_is_created(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        new_hedgehogs = [
+            {"name": "valid", "description": None, "age": 1, "color_type": "CHOCOLATE"},
+            {
+                "name": "invalid color",
+                "description": None,
+                "age": 1,
+                "color_type": "RED",
+            },
+            {"description": "no name", "age": 1, "color_type": "CHOCOLATE"},
+        ]
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"), json=new_hedgehogs
+        )
+        assert res.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+        assert [error["row"] for error in res.json()["detail"]] == [2, 3]
+
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"),
+            params={"skip_invalid": True},
+            json=new_hedgehogs,
+        )
+        assert res.status_code == HTTP_201_CREATED
+        assert len(res.json()["ids"]) == 1
+        assert [error["row"] for error in res.json()["errors"]] == [2, 3]
+        assert res.json()["created"] == [{"row": 1, "id": res.json()["ids"][0]}]
+
+    async def test_created_ids_are_reported_per_row(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        new_hedgehogs = [
+            {
+                "name": f"ordered {i}",
+                "description": None,
+                "age": 1 if i != 2 else None,
+                "color_type": "CHOCOLATE",
+            }
+            for i in range(1, 6)
+        ]
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"),
+            params={"skip_invalid": True},
+            json=new_hedgehogs,
+        )
+        assert res.status_code == HTTP_201_CREATED
+        created = res.json()["created"]
+        assert [row["row"] for row in created] == [1, 3, 4, 5]
+        assert [row["id"] for row in created] == res.json()["ids"]
+
+        for row in created:
+            res = await client.get(
+                app.url_path_for("hedgehogs:get-hedgehog-by-id", id=row["id"])
+            )
+            assert res.json()["name"] == f"ordered {row['row']}"
+
+
+class TestConditionalUpdateHedgehog:
+    async def test_update_with_current_etag_succeeds_and_stale_etag_fails(
+        self, app: FastAPI, client: AsyncClient, test_hedgehog: HedgehogInDB
+    ) -> None:
+        """
+        If-Match の ETag が古い場合は更新されず 412 が返ることを確認するテスト
+        """
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-hedgehog-by-id", id=test_hedgehog.id)
+        )
+        etag = res.headers["ETag"]
+
+        res = await client.patch(
+            app.url_path_for("hedgehogs:patch-hedgehog-by-id", id=test_hedgehog.id),
+            json={"hedgehog_update": {"name": "conditional name"}},
+            headers={"If-Match": etag},
+        )
+        assert res.status_code == HTTP_200_OK
+        assert res.json()["name"] == "conditional name"
+        assert res.json()["description"] == test_hedgehog.description
+        assert res.headers["ETag"] != etag
+
+        res = await client.patch(
+            app.url_path_for("hedgehogs:patch-hedgehog-by-id", id=test_hedgehog.id),
+            json={"hedgehog_update": {"name": "stale name"}},
+            headers={"If-Match": etag},
+        )
+        assert res.status_code == HTTP_412_PRECONDITION_FAILED
+
+    async def test_empty_patch_does_not_bump_the_version(
+        self, app: FastAPI, client: AsyncClient, test_hedgehog: HedgehogInDB
+    ) -> None:
+        url = app.url_path_for("hedgehogs:patch-hedgehog-by-id", id=test_hedgehog.id)
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-hedgehog-by-id", id=test_hedgehog.id)
+        )
+        etag = res.headers["ETag"]
+
+        for headers in ({}, {"If-Match": etag}):
+            res = await client.patch(url, json={"hedgehog_update": {}}, headers=headers)
+            assert res.status_code == HTTP_200_OK
+            assert res.headers["ETag"] == etag
+
+        # 更新しない場合も、If-Match と 404 の判定は更新と同じ
+        res = await client.patch(
+            url,
+            json={"hedgehog_update": {}},
+            headers={"If-Match": f'"{test_hedgehog.id}-999999"'},
+        )
+        assert res.status_code == HTTP_412_PRECONDITION_FAILED
+        res = await client.patch(
+            app.url_path_for("hedgehogs:patch-hedgehog-by-id", id=99999999),
+            json={"hedgehog_update": {}},
+            headers={"If-Match": '"99999999-1"'},
+        )
+        assert res.status_code == HTTP_404_NOT_FOUND
+
+    async def test_update_missing_hedgehog_with_etag_returns_404(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        res = await client.patch(
+            app.url_path_for("hedgehogs:patch-hedgehog-by-id", id=99999999),
+            json={"hedgehog_update": {"name": "missing"}},
+            headers={"If-Match": '"99999999-1"'},
+        )
+        assert res.status_code == HTTP_404_NOT_FOUND
+
+    async def test_delete_with_stale_etag_fails(
+        self, app: FastAPI, client: AsyncClient, test_hedgehog: HedgehogInDB
+    ) -> None:
+        res = await client.delete(
+            app.url_path_for("hedgehogs:delete-hedgehog-by-id", id=test_hedgehog.id),
+            headers={"If-Match": f'"{test_hedgehog.id}-{test_hedgehog.version + 1}"'},
+        )
+        assert res.status_code == HTTP_412_PRECONDITION_FAILED
+
+        res = await client.delete(
+            app.url_path_for("hedgehogs:delete-hedgehog-by-id", id=test_hedgehog.id),
+            headers={"If-Match": f'"{test_hedgehog.id}-{test_hedgehog.version}"'},
+        )
+        assert res.status_code == HTTP_200_OK
+        assert res.json() == test_hedgehog.id
+
+    @pytest.mark.parametrize(
+        "if_match",
+        (
+            'W/"{id}-{version}"',
+            '"{id}-{stale}", "{id}-{version}"',
+            '"999-{version}", W/"{id}-{version}"',
+        ),
+    )
+    async def test_update_accepts_any_listed_or_weak_etag(
+        self,
+        app: FastAPI,
+        client: AsyncClient,
+        test_hedgehog: HedgehogInDB,
+        if_match: str,
+    ) -> None:
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-hedgehog-by-id", id=test_hedgehog.id)
+        )
+        version = int(res.headers["ETag"].strip('"').partition("-")[2])
+
+        res = await client.patch(
+            app.url_path_for("hedgehogs:patch-hedgehog-by-id", id=test_hedgehog.id),
+            json={"hedgehog_update": {"description": "listed etag"}},
+            headers={
+                "If-Match": if_match.format(
+                    id=test_hedgehog.id, version=version, stale=version + 1
+                )
+            },
+        )
+        assert res.status_code == HTTP_200_OK
+
+    @pytest.mark.parametrize(
+        "if_match, detail",
+        (
+            ('"{id}-{stale}", W/"999-{stale}"', "Hedgehog has been modified."),
+            ("{id}-{stale}", "Invalid If-Match header."),
+            ('"{id}-{stale}" garbage', "Invalid If-Match header."),
+        ),
+    )
+    async def test_update_with_unmatched_or_invalid_if_match_fails(
+        self,
+        app: FastAPI,
+        client: AsyncClient,
+        test_hedgehog: HedgehogInDB,
+        if_match: str,
+        detail: str,
+    ) -> None:
+        res = await client.patch(
+            app.url_path_for("hedgehogs:patch-hedgehog-by-id", id=test_hedgehog.id),
+            json={"hedgehog_update": {"description": "should not change"}},
+            headers={
+                "If-Match": if_match.format(
+                    id=test_hedgehog.id, stale=test_hedgehog.version + 100
+                )
+            },
+        )
+        assert res.status_code == HTTP_412_PRECONDITION_FAILED
+        assert res.json()["detail"] == detail
+
+
+class TestConditionalGetHedgehogs:
+    async def test_unchanged_hedgehog_returns_not_modified(
+        self, app: FastAPI, client: AsyncClient, test_hedgehog: HedgehogInDB
+    ) -> None:
+        url = app.url_path_for("hedgehogs:get-hedgehog-by-id", id=test_hedgehog.id)
+        res = await client.get(url)
+        etag = res.headers["ETag"]
+
+        res = await client.get(url, headers={"If-None-Match": etag})
+        assert res.status_code == HTTP_304_NOT_MODIFIED
+        assert res.content == b""
+        assert res.headers["ETag"] == etag
+
+    async def test_not_modified_msgpack_has_same_etag_as_ok(
+        self, app: FastAPI, client: AsyncClient, test_hedgehog: HedgehogInDB
+    ) -> None:
+        url = app.url_path_for("hedgehogs:get-hedgehog-by-id", id=test_hedgehog.id)
+        headers = {"Accept": "application/msgpack", "Accept-Encoding": "identity"}
+        res = await client.get(url, headers=headers)
+        etag = res.headers["ETag"]
+        assert etag.startswith("W/")
+
+        res = await client.get(url, headers={**headers, "If-None-Match": etag})
+        assert res.status_code == HTTP_304_NOT_MODIFIED
+        assert res.headers["ETag"] == etag
+        assert "Accept" in res.headers["Vary"]
+
+    async def test_list_is_not_modified_until_table_changes(
+        self, app: FastAPI, client: AsyncClient, test_hedgehog: HedgehogInDB
+    ) -> None:
+        url = app.url_path_for("hedgehogs:get-all-hedgehogs")
+        res = await client.get(url, params={"limit": 5})
+        etag = res.headers["ETag"]
+
+        res = await client.get(
+            url, params={"limit": 5}, headers={"If-None-Match": etag}
+        )
+        assert res.status_code == HTTP_304_NOT_MODIFIED
+
+        # ページ指定が異なれば別の表現として扱う
+        res = await client.get(
+            url, params={"limit": 6}, headers={"If-None-Match": etag}
+        )
+        assert res.status_code == HTTP_200_OK
+
+        await client.patch(
+            app.url_path_for("hedgehogs:patch-hedgehog-by-id", id=test_hedgehog.id),
+            json={"hedgehog_update": {"description": "changed"}},
+        )
+        res = await client.get(
+            url, params={"limit": 5}, headers={"If-None-Match": etag}
+        )
+        assert res.status_code == HTTP_200_OK
+        assert res.headers["ETag"] != etag
+
+    async def test_table_version_increases_for_writes_from_any_session(
+        self, client: AsyncClient, db: Database, test_hedgehog: HedgehogInDB
+    ) -> None:
+        """
+        変更カウンタはセッションごとに別の行に加算されるが、合計は書き込みのたびに増える
+        """
+        repo = HedgehogsRepository(db)
+        other_db = Database(db.url, min_size=1, max_size=1)
+        await other_db.connect()
+        try:
+            versions = [await repo.get_hedgehogs_table_version()]
+            for session in (db, other_db, db, other_db):
+                await session.execute(
+                    "UPDATE hedgehogs SET age = age WHERE id = :id",
+                    values={"id": test_hedgehog.id},
+                )
+                versions.append(await repo.get_hedgehogs_table_version())
+        finally:
+            await other_db.disconnect()
+
+        assert versions == sorted(set(versions))
+        assert len(versions) == 5
+
+
+class TestFilterHedgehogs:
+    async def test_hedgehogs_are_filtered_on_server(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        new_hedgehogs = [
+            {
+                "name": "Filter Alpha",
+                "description": None,
+                "age": 1,
+                "color_type": "DARK GREY",
+            },
+            {
+                "name": "filter beta",
+                "description": None,
+                "age": 5,
+                "color_type": "DARK GREY",
+            },
+            {
+                "name": "Filter Gamma",
+                "description": None,
+                "age": 9,
+                "color_type": "CHOCOLATE",
+            },
+        ]
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"), json=new_hedgehogs
+        )
+        assert res.status_code == HTTP_201_CREATED
+        url = app.url_path_for("hedgehogs:get-all-hedgehogs")
+
+        res = await client.get(
+            url, params={"name_prefix": "Filter ", "color_type": "DARK GREY"}
+        )
+        assert [item["name"] for item in res.json()] == ["Filter Alpha"]
+
+        res = await client.get(
+            url, params={"name_contains": "ILTER", "min_age": 4, "max_age": 10}
+        )
+        assert {item["name"] for item in res.json()} >= {"filter beta", "Filter Gamma"}
+        assert all(4 <= item["age"] <= 10 for item in res.json())
+
+    @pytest.mark.parametrize(
+        "params",
+        (
+            {"min_age": 5, "max_age": 1},
+            {"color_type": "RED"},
+            {"name_contains": "ab"},
+            {"min_age": -1},
+        ),
+    )
+    async def test_invalid_filters_raise_error(
+        self, app: FastAPI, client: AsyncClient, params: dict
+    ) -> None:
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-all-hedgehogs"), params=params
+        )
+        assert res.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestFilterHedgehogsQueryPlans:
+    async def test_filters_do_not_scan_whole_table(
+        self, app: FastAPI, client: AsyncClient, db: Database
+    ) -> None:
+        """
+        100万行のテーブルでも、どの絞り込み条件もシーケンシャルスキャンにならないことを
+        EXPLAIN で確認するテスト (データはロールバックする)
+        """
+        cases = [
+            (HedgehogFilter(), None),
+            (HedgehogFilter(), 500_000),
+            (HedgehogFilter(color_type="CHOCOLATE"), None),
+            (HedgehogFilter(color_type="CHOCOLATE"), 500_000),
+            (HedgehogFilter(min_age=2.0, max_age=3.0), None),
+            (HedgehogFilter(name_prefix="hedgehog 12345"), None),
+            (HedgehogFilter(color_type="DARK GREY", min_age=9.5), None),
+        ]
+        if await db.fetch_val(
+            "SELECT count(*) FROM pg_extension WHERE extname = 'pg_trgm'"
+        ):
+            cases.append((HedgehogFilter(name_contains="og 4242"), None))
+
+        async with db.transaction(force_rollback=True):
+            await db.execute(
+                """
+                INSERT INTO hedgehogs (name, description, age, color_type)
+                SELECT 'hedgehog ' || g,
+                       NULL,
+                       (g % 100) / 10.0,
+                       (ARRAY['SOLT & PEPPER', 'DARK GREY', 'CHOCOLATE'])[1 + g % 3]
+                FROM generate_series(1, 1000000) AS g;
+                """
+            )
+            await db.execute("ANALYZE hedgehogs")
+            for filters, after_id in cases:
+                where_clause, values = build_hedgehogs_where_clause(
+                    filters, after_id=after_id
+                )
+                query = GET_HEDGEHOGS_PAGE_QUERY.format(where_clause=where_clause)
+                # パラメータの値に依存しない汎用プランでも索引が使われることを確認する
+                for plan_cache_mode in ("force_custom_plan", "force_generic_plan"):
+                    await db.execute(f"SET LOCAL plan_cache_mode = {plan_cache_mode}")
+                    plan = await db.fetch_all(
+                        f"EXPLAIN {query}", values={**values, "limit": 101}
+                    )
+                    plan_text = "\n".join(row[0] for row in plan)
+                    assert "Seq Scan" not in plan_text, plan_text
+
+
+class TestSearchHedgehogs:
+    async def test_search_ranks_and_highlights_matches(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        new_hedgehogs = [
+            {
+                "name": "Quillsworth",
+                "description": "Loves mealworms and long naps.",
+                "age": 2,
+                "color_type": "CHOCOLATE",
+            },
+            {
+                "name": "Bramble",
+                "description": "Best friends with Quillsworth the elder.",
+                "age": 3,
+                "color_type": "DARK GREY",
+            },
+            {
+                "name": "Thistle",
+                "description": "Has never met anyone.",
+                "age": 4,
+                "color_type": "DARK GREY",
+            },
+        ]
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"), json=new_hedgehogs
+        )
+        assert res.status_code == HTTP_201_CREATED
+
+        res = await client.get(
+            app.url_path_for("hedgehogs:search-hedgehogs"),
+            params={"q": "quillsworth"},
+        )
+        assert res.status_code == HTTP_200_OK
+        results = res.json()
+        # 名前での一致は説明での一致より上に来る
+        assert [item["name"] for item in results] == ["Quillsworth", "Bramble"]
+        assert results[0]["rank"] > results[1]["rank"]
+        assert results[0]["name_highlight"] == "<mark>Quillsworth</mark>"
+        assert "<mark>Quillsworth</mark>" in results[1]["snippet"]
+
+        res = await client.get(
+            app.url_path_for("hedgehogs:search-hedgehogs"),
+            params={"q": "quillsworth -mealworms"},
+        )
+        assert [item["name"] for item in res.json()] == ["Bramble"]
+
+    async def test_search_highlights_are_html_escaped(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        new_hedgehogs = [
+            {
+                "name": "<script>alert(1)</script> Spikewell",
+                "description": "Spikewell says <script>alert(1)</script> & hi",
+                "age": 2,
+                "color_type": "CHOCOLATE",
+            }
+        ]
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"), json=new_hedgehogs
+        )
+        assert res.status_code == HTTP_201_CREATED
+
+        res = await client.get(
+            app.url_path_for("hedgehogs:search-hedgehogs"),
+            params={"q": "spikewell"},
+        )
+        assert res.status_code == HTTP_200_OK
+        result = res.json()[0]
+        assert result["name"] == "<script>alert(1)</script> Spikewell"
+        assert result["name_highlight"] == (
+            "&lt;script&gt;alert(1)&lt;/script&gt; <mark>Spikewell</mark>"
+        )
+        assert "<script>" not in result["snippet"]
+        assert "<mark>Spikewell</mark>" in result["snippet"]
+
+    async def test_search_pages_can_be_followed_with_cursor(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        new_hedgehogs = [
+            {
+                "name": f"Pinecone {i}",
+                "description": "pinecone " * (i % 3),
+                "age": i,
+                "color_type": "SOLT & PEPPER",
+            }
+            for i in range(7)
+        ]
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"), json=new_hedgehogs
+        )
+        created_ids = res.json()["ids"]
+
+        url = app.url_path_for("hedgehogs:search-hedgehogs")
+        params = {"q": "pinecone", "limit": 3}
+        seen: List[dict] = []
+        while True:
+            res = await client.get(url, params=params)
+            assert res.status_code == HTTP_200_OK
+            seen.extend(res.json())
+            cursor = res.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+            params = {**params, "after": cursor}
+
+        assert sorted(item["id"] for item in seen) == sorted(created_ids)
+        keys = [(-item["rank"], item["id"]) for item in seen]
+        assert keys == sorted(keys)
+
+    @pytest.mark.parametrize(
+        "params, status_code",
+        (
+            ({}, HTTP_422_UNPROCESSABLE_ENTITY),
+            ({"q": ""}, HTTP_422_UNPROCESSABLE_ENTITY),
+            ({"q": "pinecone", "after": "bm90LWEtY3Vyc29y"}, HTTP_400_BAD_REQUEST),
+            (
+                {"q": "pinecone", "after": encode_cursor({"rank": 0.1, "id": 2**31})},
+                HTTP_400_BAD_REQUEST,
+            ),
+            (
+                {"q": "pinecone", "after": encode_cursor({"rank": True, "id": 1})},
+                HTTP_400_BAD_REQUEST,
+            ),
+            (
+                {"q": "pinecone", "after": encode_cursor({"rank": 0.1, "id": False})},
+                HTTP_400_BAD_REQUEST,
+            ),
+            (
+                {
+                    "q": "pinecone",
+                    "after": encode_cursor({"rank": float("nan"), "id": 1}),
+                },
+                HTTP_400_BAD_REQUEST,
+            ),
+        ),
+    )
+    async def test_invalid_search_params_raise_error(
+        self, app: FastAPI, client: AsyncClient, params: dict, status_code: int
+    ) -> None:
+        res = await client.get(
+            app.url_path_for("hedgehogs:search-hedgehogs"), params=params
+        )
+        assert res.status_code == status_code
+
+
+class TestHedgehogStats:
+    async def expected_stats(self, db: Database) -> dict:
+        by_color_type = await db.fetch_all(
+            "SELECT color_type, count(*) AS count FROM hedgehogs"
+            " GROUP BY 1 ORDER BY 1"
+        )
+        histogram = await db.fetch_all(
+            "SELECT floor(age)::int AS bucket, count(*) AS count FROM hedgehogs"
+            " GROUP BY 1 ORDER BY 1"
+        )
+        return {
+            "total": await db.fetch_val("SELECT count(*) FROM hedgehogs"),
+            "by_color_type": [dict(row) for row in by_color_type],
+            "age_histogram": [
+                {
+                    "age_from": row["bucket"],
+                    "age_to": row["bucket"] + 1,
+                    "count": row["count"],
+                }
+                for row in histogram
+            ],
+        }
+
+    async def test_stats_follow_every_kind_of_write(
+        self, app: FastAPI, client: AsyncClient, db: Database
+    ) -> None:
+        url = app.url_path_for("hedgehogs:get-hedgehog-stats")
+
+        async def assert_stats_match_table() -> None:
+            res = await client.get(url)
+            assert res.status_code == HTTP_200_OK
+            stats = res.json()
+            expected = await self.expected_stats(db)
+            assert stats["total"] == expected["total"]
+            assert stats["by_color_type"] == expected["by_color_type"]
+            assert stats["age_histogram"] == expected["age_histogram"]
+
+        await assert_stats_match_table()
+
+        res = await client.post(
+            app.url_path_for("hedgehogs:bulk-create-hedgehogs"),
+            json=[
+                {
+                    "name": "Stats A",
+                    "description": None,
+                    "age": 0.5,
+                    "color_type": "CHOCOLATE",
+                },
+                {
+                    "name": "Stats B",
+                    "description": None,
+                    "age": 11.2,
+                    "color_type": "CHOCOLATE",
+                },
+                {
+                    "name": "Stats C",
+                    "description": None,
+                    "age": 11.9,
+                    "color_type": "DARK GREY",
+                },
+            ],
+        )
+        ids = res.json()["ids"]
+        await assert_stats_match_table()
+
+        res = await client.patch(
+            app.url_path_for("hedgehogs:patch-hedgehog-by-id", id=str(ids[0])),
+            json={"hedgehog_update": {"age": 7.0, "color_type": "DARK GREY"}},
+        )
+        assert res.status_code == HTTP_200_OK
+        await assert_stats_match_table()
+
+        res = await client.delete(
+            app.url_path_for("hedgehogs:delete-hedgehog-by-id", id=str(ids[1]))
+        )
+        assert res.status_code == HTTP_200_OK
+        await assert_stats_match_table()
+
+        res = await client.get(url)
+        average_age = await db.fetch_val("SELECT avg(age) FROM hedgehogs")
+        assert res.json()["average_age"] == pytest.approx(float(average_age))
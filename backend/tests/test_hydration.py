@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+from app.db.hydration import hydrate, hydrate_all
+from app.models.hedgehog import ColorType, HedgehogInDB, HedgehogSearchResult
+from app.models.profile import ProfileInDB, ProfilePublic
+from app.models.user import UserInDB, UserPublic
+
+pytestmark = pytest.mark.asyncio
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def user_row(**overrides) -> dict:
+    return {
+        "id": 1,
+        "username": "hydrated",
+        "email": "hydrated@mail.com",
+        "email_verified": False,
+        "password": "not-a-real-hash",
+        "salt": "salt",
+        "is_active": True,
+        "is_superuser": False,
+        "created_at": NOW,
+        "updated_at": NOW,
+        **overrides,
+    }
+
+
+class TestHydrate:
+    async def test_hydrated_model_matches_validated_model(self) -> None:
+        row = {
+            "id": 1,
+            "name": "hydrated",
+            "description": None,
+            "age": Decimal("1.5"),
+            "color_type": "DARK GREY",
+            "version": 3,
+            "search_vector": "ignored",
+        }
+        hydrated = hydrate(HedgehogInDB, row)
+
+        assert hydrated == HedgehogInDB(**row)
+        assert hydrated.age == 1.5 and isinstance(hydrated.age, float)
+        assert hydrated.color_type is ColorType.dark_grey
+        assert hydrated.model_dump_json() == HedgehogInDB(**row).model_dump_json()
+
+    async def test_missing_columns_use_field_defaults(self) -> None:
+        hydrated = hydrate(
+            HedgehogSearchResult,
+            {
+                "id": 1,
+                "name": "n",
+                "description": None,
+                "age": Decimal("1"),
+                "color_type": "CHOCOLATE",
+                "rank": 0.5,
+                "name_highlight": "<mark>n</mark>",
+            },
+        )
+        assert hydrated.snippet is None
+        assert "snippet" not in hydrated.model_fields_set
+
+    async def test_missing_timestamps_default_to_now(self) -> None:
+        row = user_row(created_at=None)
+        del row["updated_at"]
+        hydrated = hydrate(UserInDB, row)
+
+        assert hydrated.created_at is not None
+        assert hydrated.updated_at is not None
+
+    async def test_columns_with_other_types_are_converted(self) -> None:
+        profile = hydrate(
+            ProfileInDB,
+            {
+                "id": 1,
+                "full_name": "",
+                "phone_number": None,
+                "bio": None,
+                "image": "https://example.com/hedgehog.png",
+                "user_id": 1,
+                "username": "hydrated",
+                "email": "hydrated@mail.com",
+                "created_at": NOW,
+                "updated_at": NOW,
+            },
+        )
+        assert str(profile.image) == "https://example.com/hedgehog.png"
+
+        user = hydrate(
+            UserPublic, {**hydrate(UserInDB, user_row()).__dict__, "profile": profile}
+        )
+        assert isinstance(user.profile, ProfilePublic)
+        assert user.profile.image == profile.image
+        assert "password" not in user.model_dump()
+
+    async def test_many_rows_are_hydrated_with_one_plan(self) -> None:
+        rows = [user_row(id=i, username=f"user{i}") for i in range(3)]
+        users = hydrate_all(UserInDB, rows)
+        assert [user.id for user in users] == [0, 1, 2]
+        assert users == [UserInDB(**row) for row in rows]
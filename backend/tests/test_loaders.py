@@ -0,0 +1,60 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+from app.db.loaders import BatchLoader
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeSource:
+    """
+    バッチローダーを確認するための DB を使わないデータソース
+    """
+
+    def __init__(self) -> None:
+        self.batches: List[List[int]] = []
+
+    async def load(self, keys: List[int]) -> Dict[int, str]:
+        self.batches.append(keys)
+        return {key: f"item-{key}" for key in keys if key > 0}
+
+
+class TestBatchLoader:
+    async def test_keys_loaded_in_the_same_tick_are_batched(self) -> None:
+        source = FakeSource()
+        loader = BatchLoader(source.load)
+
+        results = await asyncio.gather(
+            loader.load(1), loader.load(2), loader.load(1), loader.load(-1)
+        )
+
+        assert results == ["item-1", "item-2", "item-1", None]
+        assert source.batches == [[1, 2, -1]]
+
+    async def test_later_loads_start_a_new_batch(self) -> None:
+        source = FakeSource()
+        loader = BatchLoader(source.load)
+
+        assert await loader.load(1) == "item-1"
+        assert await loader.load_many([2, 3]) == ["item-2", "item-3"]
+        assert source.batches == [[1], [2, 3]]
+        assert loader.batches == 2
+
+    async def test_batches_are_split_by_max_batch_size(self) -> None:
+        source = FakeSource()
+        loader = BatchLoader(source.load, max_batch_size=2)
+
+        assert await loader.load_many([1, 2, 3]) == ["item-1", "item-2", "item-3"]
+        assert source.batches == [[1, 2], [3]]
+
+    async def test_errors_are_raised_to_every_caller(self) -> None:
+        async def failing_load(keys: List[int]) -> Dict[int, str]:
+            raise RuntimeError("boom")
+
+        loader = BatchLoader(failing_load)
+        results = await asyncio.gather(
+            loader.load(1), loader.load(2), return_exceptions=True
+        )
+
+        assert all(isinstance(result, RuntimeError) for result in results)
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+from app.services.authentication import AuthService
+from app.services.password_hashing import PasswordHashingPool
+from fastapi import HTTPException
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
+
+pytestmark = pytest.mark.asyncio
+
+
+def slow_identity(*, value: str, seconds: float) -> str:
+    time.sleep(seconds)
+    return value
+
+
+class TestPasswordHashingPool:
+    async def test_work_runs_off_the_event_loop(self) -> None:
+        pool = PasswordHashingPool(workers=1, max_queue=0)
+        ticks = 0
+
+        async def ticker() -> None:
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        result = await pool.run(slow_identity, value="done", seconds=0.2)
+        task.cancel()
+        pool.shutdown()
+
+        assert result == "done"
+        # 実行中もイベントループは他のタスクを進められる
+        assert ticks >= 5
+
+    async def test_requests_over_queue_limit_are_rejected(self) -> None:
+        pool = PasswordHashingPool(workers=1, max_queue=1)
+        running = [
+            asyncio.create_task(pool.run(slow_identity, value=str(i), seconds=0.1))
+            for i in range(2)
+        ]
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as exc_info:
+            await pool.run(slow_identity, value="rejected", seconds=0)
+        assert exc_info.value.status_code == HTTP_503_SERVICE_UNAVAILABLE
+        assert exc_info.value.headers["Retry-After"] == "1"
+
+        assert await asyncio.gather(*running) == ["0", "1"]
+        stats = pool.stats()
+        pool.shutdown()
+        assert stats["calls"] == 2
+        assert stats["rejected"] == 1
+        assert stats["in_flight"] == 0
+        # 2件目は1件目が終わるまで待たされる
+        assert stats["queue_wait_seconds_max"] >= 0.05
+        assert stats["hash_seconds_total"] >= 0.2
+
+
+class TestAuthServiceAsyncHashing:
+    @pytest.mark.parametrize("kind", ("thread", "process"))
+    async def test_hash_and_verify_in_pool(self, kind: str) -> None:
+        pool = PasswordHashingPool(workers=1, max_queue=4, kind=kind)
+        auth_service = AuthService(hashing_pool=pool)
+        try:
+            credentials = await auth_service.create_salt_and_hashed_password(
+                plaintext_password="hedgehogsarecute"
+            )
+            assert await auth_service.verify_password_async(
+                password="hedgehogsarecute",
+                salt=credentials.salt,
+                hashed_pw=credentials.password,
+            )
+            assert not await auth_service.verify_password_async(
+                password="wrong",
+                salt=credentials.salt,
+                hashed_pw=credentials.password,
+            )
+            # 同期版と同じ結果になる
+            assert auth_service.verify_password(
+                password="hedgehogsarecute",
+                salt=credentials.salt,
+                hashed_pw=credentials.password,
+            )
+        finally:
+            pool.shutdown()
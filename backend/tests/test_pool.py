@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from app.api.dependencies import auth
+from app.db.pool import Histogram, InstrumentedDatabase, PoolTimeout
+from databases import Database
+from fastapi import FastAPI
+from httpx import AsyncClient
+from starlette.datastructures import Secret
+from starlette.status import (
+    HTTP_200_OK,
+    HTTP_401_UNAUTHORIZED,
+    HTTP_404_NOT_FOUND,
+    HTTP_503_SERVICE_UNAVAILABLE,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+class TestHistogram:
+    async def test_buckets_are_cumulative(self) -> None:
+        histogram = Histogram((0.01, 0.1))
+        for value in (0.005, 0.01, 0.05, 0.5):
+            histogram.observe(value)
+
+        snapshot = histogram.snapshot()
+        assert snapshot["buckets"] == {"0.01": 2, "0.1": 3, "+Inf": 4}
+        assert snapshot["count"] == 4
+        assert snapshot["sum"] == pytest.approx(0.565)
+
+
+class TestMetricsAccess:
+    async def test_metrics_are_not_exposed_without_token_setting(
+        self, app: FastAPI, client: AsyncClient, monkeypatch
+    ) -> None:
+        monkeypatch.setattr(auth, "METRICS_TOKEN", Secret(""))
+        res = await client.get(app.url_path_for("metrics:get-metrics"))
+        assert res.status_code == HTTP_404_NOT_FOUND
+
+    @pytest.mark.parametrize("headers", ({}, {"Authorization": "Bearer wrong"}))
+    async def test_metrics_require_the_token(
+        self, app: FastAPI, client: AsyncClient, monkeypatch, headers: dict
+    ) -> None:
+        monkeypatch.setattr(auth, "METRICS_TOKEN", Secret("metrics-token"))
+        res = await client.get(app.url_path_for("metrics:get-metrics"), headers=headers)
+        assert res.status_code == HTTP_401_UNAUTHORIZED
+
+
+class TestInstrumentedPool:
+    async def test_metrics_report_pool_usage(
+        self, app: FastAPI, client: AsyncClient, db: Database, monkeypatch
+    ) -> None:
+        monkeypatch.setattr(auth, "METRICS_TOKEN", Secret("metrics-token"))
+        await db.fetch_val("SELECT 1")
+        res = await client.get(
+            app.url_path_for("metrics:get-metrics"),
+            headers={"Authorization": "Bearer metrics-token"},
+        )
+        assert res.status_code == HTTP_200_OK
+
+        pool = res.json()["db_pool"]
+        assert pool["acquisitions"] >= 1
+        assert pool["size"] == pool["in_use"] + pool["idle"]
+        assert pool["acquire_wait_seconds"]["count"] >= pool["acquisitions"]
+        assert "repository_cache" in res.json()
+
+    async def test_acquire_timeout_raises_pool_timeout(
+        self, app: FastAPI, client: AsyncClient, db: Database
+    ) -> None:
+        small_db = InstrumentedDatabase(
+            db.url, min_size=1, max_size=1, acquire_timeout=0.05
+        )
+        await small_db.connect()
+        try:
+            held = asyncio.Event()
+            done = asyncio.Event()
+
+            async def hold_connection() -> None:
+                async with small_db.connection() as connection:
+                    await connection.fetch_val("SELECT 1")
+                    held.set()
+                    await done.wait()
+
+            holder = asyncio.create_task(hold_connection())
+            await held.wait()
+            with pytest.raises(PoolTimeout):
+                await small_db.fetch_val("SELECT 1")
+
+            # API では Retry-After を付けた 503 になる
+            app.state._db = small_db
+            res = await client.get(
+                app.url_path_for("hedgehogs:get-hedgehog-by-id", id=99999999)
+            )
+            app.state._db = db
+            done.set()
+            await holder
+
+            assert res.status_code == HTTP_503_SERVICE_UNAVAILABLE
+            assert res.headers["Retry-After"] == "1"
+            assert small_db.pool_stats()["timeouts"] == 2
+        finally:
+            app.state._db = db
+            await small_db.disconnect()
+
+    async def test_connections_are_recycled_after_max_lifetime(
+        self, client: AsyncClient, db: Database
+    ) -> None:
+        short_lived_db = InstrumentedDatabase(
+            db.url, min_size=1, max_size=1, max_lifetime=0.01
+        )
+        await short_lived_db.connect()
+        try:
+            first_pid = await short_lived_db.fetch_val("SELECT pg_backend_pid()")
+            await asyncio.sleep(0.02)
+            await short_lived_db.fetch_val("SELECT 1")
+            second_pid = await short_lived_db.fetch_val("SELECT pg_backend_pid()")
+
+            assert second_pid != first_pid
+            assert short_lived_db.pool_stats()["recycled"] >= 1
+        finally:
+            await short_lived_db.disconnect()
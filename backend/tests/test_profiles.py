@@ -36,8 +36,8 @@ class TestProfileCreate:
     ) -> None:
         profiles_repo = ProfilesRepository(db)
         new_user = {
-            "email": "nmomos@mail.com",
-            "username": "nmomoishedgehog",
+            "email": "newprofile@mail.com",
+            "username": "newprofile",
             "password": "nmomosissocute",
         }
         res = await client.post(
@@ -130,7 +130,35 @@ class TestProfileManagement:
         )
         assert res.status_code == status.HTTP_200_OK
         profile = ProfilePublic(**res.json())
-        assert getattr(profile, attr) == value
+        # image は HttpUrl として読まれるので文字列にして比べる
+        assert str(getattr(profile, attr)) == value
+
+    async def test_update_does_not_write_back_stale_cached_profile(
+        self,
+        app: FastAPI,
+        authorized_client: AsyncClient,
+        test_user: UserInDB,
+        db: Database,
+    ) -> None:
+        """
+        キャッシュに残った古いプロフィールで、他のワーカーの更新を上書きしないことを確認するテスト
+        """
+        profiles_repo = ProfilesRepository(db)
+        await profiles_repo.get_profile_by_user_id(user_id=test_user.id)
+        # キャッシュを無効化しない更新 (他のワーカーの書き込み) を模す
+        await db.execute(
+            query="UPDATE profiles SET bio = :bio WHERE user_id = :user_id",
+            values={"bio": "updated by another worker", "user_id": test_user.id},
+        )
+
+        res = await authorized_client.put(
+            app.url_path_for("profiles:update-own-profile"),
+            json={"profile_update": {"full_name": "Concurrent Hedgehog"}},
+        )
+        assert res.status_code == status.HTTP_200_OK
+        profile = ProfilePublic(**res.json())
+        assert profile.full_name == "Concurrent Hedgehog"
+        assert profile.bio == "updated by another worker"
 
     @pytest.mark.parametrize(
         "attr, value, status_code",
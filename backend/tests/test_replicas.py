@@ -0,0 +1,163 @@
+from typing import AsyncIterator
+
+import pytest
+from app.api.dependencies.database import READ_YOUR_WRITES_COOKIE
+from app.api.middleware.read_your_writes import read_your_writes_window
+from app.db.cache import MISSING, MemoryCacheBackend, RepositoryCache
+from app.db.pool import InstrumentedDatabase
+from app.db.replicas import ReplicaSet
+from app.db.repositories.hedgehogs import HedgehogsRepository
+from app.models.hedgehog import HedgehogInDB
+from databases import Database
+from fastapi import FastAPI
+from httpx import AsyncClient
+from starlette.status import HTTP_200_OK, HTTP_201_CREATED
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def replicas(app: FastAPI, client: AsyncClient, db: Database) -> AsyncIterator:
+    """
+    プライマリと同じ Postgres を指すレプリカを1つ設定する
+    """
+    replica_set = ReplicaSet(
+        [InstrumentedDatabase(db.url, min_size=1, max_size=2)],
+        max_lag=5,
+        check_interval=60,
+    )
+    await replica_set.connect()
+    app.state._replicas = replica_set
+    client.cookies.clear()
+    try:
+        yield replica_set
+    finally:
+        app.state._replicas = None
+        await replica_set.disconnect()
+
+
+class TestReplicaRouting:
+    async def test_replica_lag_is_measured(self, replicas: ReplicaSet) -> None:
+        assert replicas.lags == [0.0]
+
+    async def test_reads_are_routed_to_replica(
+        self,
+        app: FastAPI,
+        client: AsyncClient,
+        replicas: ReplicaSet,
+        test_hedgehog: HedgehogInDB,
+    ) -> None:
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-hedgehog-by-id", id=test_hedgehog.id)
+        )
+        assert res.status_code == HTTP_200_OK
+        assert replicas.reads == [1]
+
+    async def test_writer_reads_from_primary_for_a_while(
+        self, app: FastAPI, client: AsyncClient, replicas: ReplicaSet
+    ) -> None:
+        res = await client.post(
+            app.url_path_for("hedgehogs:create-hedgehog"),
+            json={
+                "new_hedgehog": {
+                    "name": "sticky hedgehog",
+                    "description": "read your writes",
+                    "age": 1.0,
+                    "color_type": "SOLT & PEPPER",
+                }
+            },
+        )
+        assert res.status_code == HTTP_201_CREATED
+        assert READ_YOUR_WRITES_COOKIE in res.cookies
+        assert replicas.reads == [0]
+
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-hedgehog-by-id", id=res.json()["id"])
+        )
+        assert res.status_code == HTTP_200_OK
+        assert res.json()["name"] == "sticky hedgehog"
+        assert replicas.reads == [0]
+
+        client.cookies.clear()
+        await client.get(
+            app.url_path_for("hedgehogs:get-hedgehog-by-id", id=res.json()["id"])
+        )
+        assert replicas.reads == [1]
+
+    async def test_lagging_replica_falls_back_to_primary(
+        self,
+        app: FastAPI,
+        client: AsyncClient,
+        replicas: ReplicaSet,
+        test_hedgehog: HedgehogInDB,
+    ) -> None:
+        replicas.lags[0] = replicas.max_lag + 1
+        res = await client.get(
+            app.url_path_for("hedgehogs:get-hedgehog-by-id", id=test_hedgehog.id)
+        )
+        assert res.status_code == HTTP_200_OK
+        assert replicas.reads == [0]
+        assert replicas.fallbacks == 1
+
+        await replicas.check_lag()
+        assert replicas.lags == [0.0]
+
+    async def test_replica_without_wal_receiver_is_not_used(
+        self, replicas: ReplicaSet, monkeypatch
+    ) -> None:
+        async def not_streaming(*args, **kwargs):
+            # WAL レシーバーが止まっているレプリカでは遅延の問い合わせが NULL を返す
+            return None
+
+        monkeypatch.setattr(replicas.replicas[0], "fetch_val", not_streaming)
+        await replicas.check_lag()
+        assert replicas.lags == [None]
+        assert replicas.choose() is None
+        assert replicas.fallbacks == 1
+
+    async def test_unreachable_replica_is_not_used(
+        self, client: AsyncClient, db: Database
+    ) -> None:
+        replica_set = ReplicaSet(
+            [InstrumentedDatabase(db.url.replace(hostname="127.0.0.1", port=1))],
+            max_lag=5,
+            check_interval=60,
+        )
+        await replica_set.connect()
+        try:
+            assert replica_set.lags == [None]
+            assert replica_set.choose() is None
+            assert replica_set.fallbacks == 1
+        finally:
+            await replica_set.disconnect()
+
+    async def test_replica_reads_do_not_populate_the_cache(
+        self, replicas: ReplicaSet, db: Database, test_hedgehog: HedgehogInDB
+    ) -> None:
+        cache = RepositoryCache(MemoryCacheBackend(max_entries=10), ttl=60)
+        replica_repo = HedgehogsRepository(
+            db, cache=cache, read_db=replicas.replicas[0]
+        )
+        assert await replica_repo.get_hedgehog_by_id(id=test_hedgehog.id)
+        assert await cache.get(f"hedgehog:{test_hedgehog.id}") is MISSING
+
+        primary_repo = HedgehogsRepository(db, cache=cache)
+        assert await primary_repo.get_hedgehog_by_id(id=test_hedgehog.id)
+        # プライマリで読んだ結果は、レプリカで読むリクエストにも使われる
+        assert await replica_repo.get_hedgehog_by_id(id=test_hedgehog.id)
+        assert cache.hits == 1
+
+
+class TestReadYourWritesWindow:
+    @pytest.mark.parametrize(
+        "window_seconds, expected", ((5, 6), (6, 6), (10, 10), (0, 6))
+    )
+    async def test_window_covers_lag_between_checks(
+        self, window_seconds: float, expected: float
+    ) -> None:
+        assert (
+            read_your_writes_window(
+                window_seconds, replica_max_lag=5, replica_check_interval=1
+            )
+            == expected
+        )
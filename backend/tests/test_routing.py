@@ -0,0 +1,296 @@
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Type
+
+import msgpack
+import pytest
+from app.api.routing import (
+    MSGPACK_MEDIA_TYPE,
+    MessagePackRoute,
+    TrustedResponseRoute,
+    accepts_msgpack,
+    build_serializer,
+)
+from app.models.hedgehog import HedgehogInDB, HedgehogPublic
+from app.models.profile import ProfilePublic
+from app.models.user import UserInDB, UserPublic
+from fastapi import APIRouter, FastAPI, Response
+from fastapi.routing import APIRoute
+from httpx import AsyncClient
+from pydantic import BaseModel, Field, field_serializer
+from starlette.status import (
+    HTTP_201_CREATED,
+    HTTP_202_ACCEPTED,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_400_BAD_REQUEST,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+)
+
+pytestmark = pytest.mark.asyncio
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+HEDGEHOGS = [
+    HedgehogInDB(
+        id=i,
+        name=f"ハリネズミ {i}",
+        description=None,
+        age=1.5,
+        color_type="DARK GREY",
+        version=2,
+    )
+    for i in range(3)
+]
+USER = UserInDB(
+    id=1,
+    username="trusted",
+    email="trusted@mail.com",
+    password="not-a-real-hash",
+    salt="salt",
+    created_at=NOW,
+    updated_at=NOW,
+)
+PROFILE = ProfilePublic(
+    id=1,
+    full_name="信頼できる ハリネズミ",
+    phone_number=None,
+    bio=None,
+    image="https://example.com/trusted.png",
+    user_id=1,
+    username="trusted",
+    email="trusted@mail.com",
+    created_at=NOW,
+    updated_at=NOW,
+)
+
+
+def create_app(route_class: Type[APIRoute]) -> FastAPI:
+    router = APIRouter(route_class=route_class)
+
+    @router.get("/hedgehogs/", response_model=List[HedgehogPublic])
+    async def list_hedgehogs(response: Response) -> List[HedgehogPublic]:
+        response.headers["X-Next-Cursor"] = "next"
+        return HEDGEHOGS
+
+    @router.get("/hedgehogs/{id}", response_model=HedgehogPublic)
+    async def get_hedgehog(id: int, response: Response) -> HedgehogPublic:
+        response.headers["ETag"] = f'"{id}-2"'
+        if id == 0:
+            return Response(status_code=HTTP_304_NOT_MODIFIED, headers={"ETag": "x"})
+        return HEDGEHOGS[id]
+
+    @router.post(
+        "/hedgehogs/", response_model=HedgehogPublic, status_code=HTTP_201_CREATED
+    )
+    def create_hedgehog(new_hedgehog: HedgehogPublic) -> HedgehogPublic:
+        return new_hedgehog
+
+    @router.get("/users/me/", response_model=UserPublic)
+    async def get_user(response: Response) -> UserPublic:
+        response.status_code = HTTP_202_ACCEPTED
+        return UserPublic(**USER.model_dump(), profile=PROFILE)
+
+    @router.get("/users/raw/", response_model=UserPublic)
+    async def get_user_from_dict() -> Dict[str, Any]:
+        return USER.model_dump()
+
+    @router.get(
+        "/users/excluded/", response_model=UserPublic, response_model_exclude_none=True
+    )
+    async def get_user_excluding_none() -> UserPublic:
+        return USER
+
+    @router.delete("/hedgehogs/{id}", response_model=int)
+    async def delete_hedgehog(id: int) -> int:
+        return id
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    return app
+
+
+@pytest.fixture
+async def clients() -> List[AsyncClient]:
+    async with AsyncClient(
+        app=create_app(APIRoute), base_url="http://testserver"
+    ) as default_client, AsyncClient(
+        app=create_app(TrustedResponseRoute), base_url="http://testserver"
+    ) as trusted_client:
+        yield [default_client, trusted_client]
+
+
+class TestTrustedResponseRoute:
+    async def test_openapi_schema_is_unchanged(self) -> None:
+        assert (
+            create_app(TrustedResponseRoute).openapi() == create_app(APIRoute).openapi()
+        )
+
+    @pytest.mark.parametrize(
+        "method, path, json",
+        (
+            ("GET", "/api/hedgehogs/", None),
+            ("GET", "/api/hedgehogs/0", None),
+            ("GET", "/api/hedgehogs/2", None),
+            (
+                "POST",
+                "/api/hedgehogs/",
+                {
+                    "id": 1,
+                    "name": "n",
+                    "description": None,
+                    "age": 1,
+                    "color_type": "CHOCOLATE",
+                },
+            ),
+            ("POST", "/api/hedgehogs/", {"name": "n"}),
+            ("GET", "/api/users/me/", None),
+            ("GET", "/api/users/raw/", None),
+            ("GET", "/api/users/excluded/", None),
+            ("DELETE", "/api/hedgehogs/1", None),
+        ),
+    )
+    async def test_responses_match_default_route(
+        self, clients: List[AsyncClient], method: str, path: str, json: Any
+    ) -> None:
+        default, trusted = [
+            await client.request(method, path, json=json) for client in clients
+        ]
+
+        assert trusted.status_code == default.status_code
+        assert trusted.headers == default.headers
+        assert trusted.content == default.content
+
+    async def test_fields_not_in_response_model_are_dropped(
+        self, clients: List[AsyncClient]
+    ) -> None:
+        _, trusted = clients
+        res = await trusted.get("/api/users/me/")
+        assert res.status_code == HTTP_202_ACCEPTED
+        assert "password" not in res.json() and "salt" not in res.json()
+        assert res.json()["profile"]["username"] == "trusted"
+
+        res = await trusted.get("/api/hedgehogs/")
+        assert res.headers["X-Next-Cursor"] == "next"
+        assert all("version" not in hedgehog for hedgehog in res.json())
+
+    async def test_invalid_request_body_is_still_validated(
+        self, clients: List[AsyncClient]
+    ) -> None:
+        _, trusted = clients
+        res = await trusted.post("/api/hedgehogs/", json={"name": "n"})
+        assert res.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.fixture
+async def msgpack_client() -> AsyncClient:
+    async with AsyncClient(
+        app=create_app(MessagePackRoute), base_url="http://testserver"
+    ) as client:
+        yield client
+
+
+class TestMessagePackRoute:
+    @pytest.mark.parametrize(
+        "accept, expected",
+        (
+            ("application/msgpack", True),
+            ("application/x-msgpack", True),
+            ("application/msgpack, application/json", True),
+            ("application/json;q=0.9, application/msgpack", True),
+            ("application/json, application/msgpack;q=0.5", False),
+            ("application/msgpack;q=0", False),
+            ("application/json", False),
+            ("*/*", False),
+            ("", False),
+        ),
+    )
+    async def test_msgpack_is_chosen_only_when_preferred(
+        self, accept: str, expected: bool
+    ) -> None:
+        assert accepts_msgpack(accept) is expected
+
+    async def test_openapi_schema_is_unchanged(self) -> None:
+        assert create_app(MessagePackRoute).openapi() == create_app(APIRoute).openapi()
+
+    @pytest.mark.parametrize(
+        "path", ("/api/hedgehogs/", "/api/hedgehogs/2", "/api/users/me/")
+    )
+    async def test_same_models_are_returned_as_msgpack(
+        self, msgpack_client: AsyncClient, path: str
+    ) -> None:
+        json_res = await msgpack_client.get(path)
+        res = await msgpack_client.get(path, headers={"Accept": "application/msgpack"})
+
+        assert res.headers["Content-Type"] == "application/msgpack"
+        assert res.headers["Vary"] == "Accept"
+        assert json_res.headers["Content-Type"] == "application/json"
+        assert json_res.headers["Vary"] == "Accept"
+        assert msgpack.unpackb(res.content) == json_res.json()
+        assert len(res.content) < len(json_res.content)
+
+    async def test_etag_of_msgpack_representation_is_weak(
+        self, msgpack_client: AsyncClient
+    ) -> None:
+        res = await msgpack_client.get(
+            "/api/hedgehogs/2", headers={"Accept": "application/msgpack"}
+        )
+        assert res.headers["ETag"] == 'W/"2-2"'
+        res = await msgpack_client.get("/api/hedgehogs/2")
+        assert res.headers["ETag"] == '"2-2"'
+
+    async def test_msgpack_bodies_are_validated_like_json(
+        self, msgpack_client: AsyncClient
+    ) -> None:
+        new_hedgehog = {
+            "id": 1,
+            "name": "n",
+            "description": None,
+            "age": 1,
+            "color_type": "CHOCOLATE",
+        }
+        res = await msgpack_client.post(
+            "/api/hedgehogs/",
+            content=msgpack.packb(new_hedgehog),
+            headers={"Content-Type": "application/msgpack"},
+        )
+        assert res.status_code == HTTP_201_CREATED
+        assert res.json()["name"] == "n"
+
+        res = await msgpack_client.post(
+            "/api/hedgehogs/",
+            content=msgpack.packb({"name": "n"}),
+            headers={"Content-Type": "application/msgpack"},
+        )
+        assert res.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+        res = await msgpack_client.post(
+            "/api/hedgehogs/",
+            content=b"\xc1",
+            headers={"Content-Type": "application/msgpack"},
+        )
+        assert res.status_code == HTTP_400_BAD_REQUEST
+
+    async def test_models_with_custom_serialization_fall_back_to_pydantic(
+        self,
+    ) -> None:
+        class Aliased(BaseModel):
+            name: str = Field(serialization_alias="displayName")
+
+            @field_serializer("name")
+            def shout(self, name: str) -> str:
+                return name.upper()
+
+        class Wrapper(BaseModel):
+            items: List[Aliased]
+            user: UserPublic
+
+        value = Wrapper(
+            items=[Aliased(name="a")],
+            user=UserPublic(**USER.model_dump(), profile=PROFILE),
+        )
+        for model in (Wrapper, List[Wrapper]):
+            content = [value] if model is not Wrapper else value
+            packed = build_serializer(model, MSGPACK_MEDIA_TYPE)(content)
+            assert msgpack.unpackb(packed) == json.loads(
+                build_serializer(model)(content)
+            )
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Set
+
+import httpx
+import pytest
+from app.core.runner import CRASH_LOOP_EXIT_CODE, respawn_delay, worker_max_requests
+from starlette.types import Receive, Scope, Send
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    """
+    レスポンスを返したワーカーのプロセス ID を返すアプリ
+    """
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            await send({"type": f"{message['type']}.complete"})
+            if message["type"] == "lifespan.shutdown":
+                return
+    body = str(os.getpid()).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def crashing_app(scope: Scope, receive: Receive, send: Send) -> None:
+    """
+    起動を終えた直後にワーカーのプロセスごと終了するアプリ
+    """
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            await send({"type": f"{message['type']}.complete"})
+            if message["type"] == "lifespan.startup":
+                asyncio.get_running_loop().call_later(0.1, os._exit, 1)
+            if message["type"] == "lifespan.shutdown":
+                return
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestWorkerMaxRequests:
+    @pytest.mark.parametrize("max_requests", (0, -1))
+    def test_workers_are_not_recycled_when_disabled(self, max_requests: int) -> None:
+        assert worker_max_requests(max_requests, 100) is None
+
+    def test_limits_are_jittered_per_worker(self) -> None:
+        limits = {worker_max_requests(1000, 100) for _ in range(200)}
+        assert all(1000 <= limit <= 1100 for limit in limits)
+        assert len(limits) > 1
+        assert worker_max_requests(1000, 0) == 1000
+
+
+class TestRespawnDelay:
+    def test_delay_doubles_up_to_the_maximum(self) -> None:
+        delays = [respawn_delay(failures, 0.5, 3) for failures in range(6)]
+        assert delays == [0, 0.5, 1, 2, 3, 3]
+
+
+class TestSupervisor:
+    def test_workers_are_recycled_and_stopped_gracefully(self) -> None:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "app.core.runner", "tests.test_runner:app"],
+            cwd=Path(__file__).resolve().parents[1],
+            env={
+                **os.environ,
+                "SERVER_HOST": "127.0.0.1",
+                "SERVER_PORT": str(port),
+                "SERVER_WORKERS": "2",
+                "SERVER_MAX_REQUESTS": "5",
+                "SERVER_MAX_REQUESTS_JITTER": "0",
+                "SERVER_GRACEFUL_TIMEOUT_SECONDS": "5",
+            },
+        )
+        try:
+            pids: Set[str] = set()
+            deadline = time.monotonic() + 30
+            while len(pids) <= 2 and time.monotonic() < deadline:
+                try:
+                    # 接続を使い回さず、毎回どちらかのワーカーに受け付けさせる
+                    res = httpx.get(f"http://127.0.0.1:{port}/", timeout=5)
+                except httpx.TransportError:
+                    time.sleep(0.1)
+                    continue
+                assert res.status_code == 200
+                pids.add(res.text)
+            # 上限まで処理したワーカーは入れ替わる
+            assert len(pids) > 2
+            assert str(server.pid) not in pids
+        finally:
+            server.send_signal(signal.SIGTERM)
+            returncode = server.wait(timeout=30)
+        assert returncode == 0
+
+    def test_supervisor_gives_up_when_workers_keep_crashing(self) -> None:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "app.core.runner", "tests.test_runner:crashing_app"],
+            cwd=Path(__file__).resolve().parents[1],
+            env={
+                **os.environ,
+                "SERVER_HOST": "127.0.0.1",
+                "SERVER_PORT": str(free_port()),
+                "SERVER_WORKERS": "1",
+                "SERVER_RESPAWN_BACKOFF_SECONDS": "0.4",
+                "SERVER_MAX_FAST_FAILURES": "3",
+            },
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        started_at = time.monotonic()
+        try:
+            _, stderr = server.communicate(timeout=30)
+        finally:
+            server.kill()
+        # 0.4 秒と 0.8 秒待ってから起動し直し、3回目で止める
+        assert time.monotonic() - started_at >= 1.2
+        assert server.returncode == CRASH_LOOP_EXIT_CODE
+        assert stderr.count("Booted worker") == 3
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from app.db.repositories.hedgehogs import GET_HEDGEHOG_BY_ID_QUERY
+from app.db.statements import Statement, compile_named_parameters, statement
+from databases import Database
+from httpx import AsyncClient
+
+pytestmark = pytest.mark.asyncio
+
+
+class TestCompileNamedParameters:
+    async def test_parameters_are_numbered_in_order_of_appearance(self) -> None:
+        sql, names = compile_named_parameters(
+            "SELECT * FROM t WHERE a = :a AND (b = :b OR a < :a)"
+        )
+        assert sql == "SELECT * FROM t WHERE a = $1 AND (b = $2 OR a < $1)"
+        assert names == ("a", "b")
+
+    async def test_casts_literals_and_comments_are_left_alone(self) -> None:
+        sql, names = compile_named_parameters(
+            "SELECT 'x:y', \"col:name\"::text, 'it''s :not' -- :comment\n"
+            "FROM t WHERE oid = 'hedgehogs'::regclass AND id = :id"
+        )
+        assert sql == (
+            "SELECT 'x:y', \"col:name\"::text, 'it''s :not' -- :comment\n"
+            "FROM t WHERE oid = 'hedgehogs'::regclass AND id = $1"
+        )
+        assert names == ("id",)
+
+    async def test_dynamic_statements_are_compiled_once(self) -> None:
+        assert statement("SELECT :a") is statement("SELECT :a")
+
+    async def test_missing_values_raise(self) -> None:
+        with pytest.raises(KeyError):
+            Statement("SELECT :a, :b").arguments({"a": 1})
+
+
+class TestStatementDatabase:
+    async def test_statements_run_on_the_current_transaction(
+        self, client: AsyncClient, db: Database
+    ) -> None:
+        async with db.transaction(force_rollback=True):
+            hedgehog_id = await db.fetch_val(
+                Statement(
+                    "INSERT INTO hedgehogs (name, age, color_type)"
+                    " VALUES (:name, :age, :color_type) RETURNING id"
+                ),
+                values={"name": "prepared", "age": 1, "color_type": "SOLT & PEPPER"},
+            )
+            record = await db.fetch_one(
+                GET_HEDGEHOG_BY_ID_QUERY, values={"id": hedgehog_id}
+            )
+            assert record["name"] == "prepared"
+            # databases で実行した場合と同じ行が返る
+            assert dict(record) == dict(
+                (
+                    await db.fetch_one(
+                        str(GET_HEDGEHOG_BY_ID_QUERY), values={"id": hedgehog_id}
+                    )
+                )._mapping
+            )
+        assert (
+            await db.fetch_one(GET_HEDGEHOG_BY_ID_QUERY, values={"id": hedgehog_id})
+            is None
+        )
+
+    async def test_databases_connection_has_the_attributes_used(
+        self, client: AsyncClient, db: Database
+    ) -> None:
+        """
+        StatementDatabase が使う databases の接続の属性が、固定したバージョンにあることを確認する
+        """
+        async with db.connection() as connection:
+            assert isinstance(connection._query_lock, asyncio.Lock)
+            assert hasattr(connection.raw_connection, "fetchrow")
+
+    async def test_concurrent_statements_share_the_transaction_connection(
+        self, client: AsyncClient, db: Database
+    ) -> None:
+        async with db.transaction(force_rollback=True):
+            values = await asyncio.gather(
+                *(
+                    db.fetch_val(
+                        Statement("SELECT CAST(:n AS INTEGER)"), values={"n": n}
+                    )
+                    for n in range(5)
+                )
+            )
+        assert values == [0, 1, 2, 3, 4]
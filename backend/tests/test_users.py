@@ -1,29 +1,44 @@
+import asyncio
+import time
+import uuid
+from ipaddress import ip_network
 from typing import List, Optional, Type, Union
 
+import bcrypt
 import jwt
 import pytest
 from app.core.config import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
+    BCRYPT_ROUNDS,
     JWT_ALGORITHM,
     JWT_AUDIENCE,
     JWT_TOKEN_PREFIX,
     SECRET_KEY,
 )
+from app.api.dependencies import rate_limit
+from app.db.cache import NullCacheBackend, RepositoryCache, repository_cache
+from app.db.repositories.rate_limits import RateLimitsRepository
 from app.db.repositories.users import UsersRepository
+from app.models.rate_limit import RateLimit
 from app.models.token import JWTCreds, JWTMeta, JWTPayload
-from app.models.user import UserCreate, UserInDB, UserPublic
+from app.models.user import UserBase, UserCreate, UserInDB, UserPublic
 from app.services import auth_service
+from app.services.authentication import AuthService
+from app.services.token_cache import VerifiedTokenCache
 from databases import Database
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from httpx import AsyncClient
 from pydantic import ValidationError
 from starlette.datastructures import Secret
 from starlette.status import (
     HTTP_200_OK,
     HTTP_201_CREATED,
+    HTTP_400_BAD_REQUEST,
     HTTP_401_UNAUTHORIZED,
     HTTP_404_NOT_FOUND,
+    HTTP_429_TOO_MANY_REQUESTS,
 )
+from tests.utility import SerializedMemoryCacheBackend
 
 pytestmark = pytest.mark.asyncio
 
@@ -294,8 +309,13 @@ class TestUserRegistration:
         assert user_in_db.email == new_user["email"]
         assert user_in_db.username == new_user["username"]
 
-        created_user = UserPublic(**res.json()).model_dump(exclude={"access_token"})
-        assert created_user == user_in_db.model_dump(exclude={"password", "salt"})
+        # 登録したユーザーは空のプロフィールと一緒に返される
+        created_user = UserPublic(**res.json())
+        assert created_user.profile is not None
+        assert created_user.profile.username == new_user["username"]
+        assert created_user.model_dump(
+            exclude={"access_token", "profile"}
+        ) == user_in_db.model_dump(exclude={"password", "salt"})
 
 
 class TestUserLogin:
@@ -331,10 +351,11 @@ class TestUserLogin:
         "credential, wrong_value, status_code",
         (
             ("email", "wrong@email.com", 401),
-            ("email", None, 401),
+            # 空の値はフォームの検証で弾かれる
+            ("email", None, 422),
             ("email", "notemail", 401),
             ("password", "wrongpassword", 401),
-            ("password", None, 401),
+            ("password", None, 422),
         ),
     )
     async def test_user_with_wrong_creds_doesnt_receive_token(
@@ -344,7 +365,7 @@ class TestUserLogin:
         test_user: UserInDB,
         credential: str,
         wrong_value: str,
-        satus_code: int,
+        status_code: int,
     ) -> None:
         client.headers["content-type"] = "application/x-www-form-urlencoded"
         user_data = test_user.model_dump()
@@ -357,11 +378,11 @@ class TestUserLogin:
         res = await client.post(
             app.url_path_for("users:login-email-and-password"), data=login_data
         )
-        assert res.status_code == satus_code
+        assert res.status_code == status_code
         assert "access_token" not in res.json()
 
 
-class TetUserMe:
+class TestUserMe:
     async def test_authenticated_user_can_retrive_own_data(
         self, app: FastAPI, authorized_client: AsyncClient, test_user: UserInDB
     ) -> None:
@@ -395,3 +416,489 @@ class TetUserMe:
             headers={"Authorization": f"{jwt_prefix} {token}"},
         )
         assert res.status_code == HTTP_401_UNAUTHORIZED
+
+
+class TestPrincipalCache:
+    async def create_user(self, db: Database, username: str) -> UserInDB:
+        record = await db.fetch_one(
+            """
+            INSERT INTO users (username, email, password, salt)
+            VALUES (:username, :email, 'not-a-real-hash', 'salt')
+            ON CONFLICT (username) DO UPDATE SET is_active = TRUE
+            RETURNING id, username, email, email_verified, password,
+                      salt, is_active, is_superuser, created_at, updated_at;
+            """,
+            values={"username": username, "email": f"{username}@mail.com"},
+        )
+        # 登録されたユーザーと同じく、空のプロフィールを持たせる
+        await db.execute(
+            """
+            INSERT INTO profiles (full_name, user_id)
+            VALUES ('', :user_id)
+            ON CONFLICT (user_id) DO NOTHING;
+            """,
+            values={"user_id": record["id"]},
+        )
+        return UserInDB(**record)
+
+    async def test_cached_principal_skips_database_until_invalidated(
+        self, app: FastAPI, client: AsyncClient, db: Database, monkeypatch
+    ) -> None:
+        # ワーカー間で共有されるバックエンド (redis) と同じように扱う
+        monkeypatch.setattr(repository_cache.backend, "shared", True)
+        user = await self.create_user(db, "principalcache")
+        token = auth_service.create_access_token_for_user(user=user)
+        headers = {"Authorization": f"{JWT_TOKEN_PREFIX} {token}"}
+        url = app.url_path_for("users:get-current-user")
+
+        res = await client.get(url, headers=headers)
+        assert res.status_code == HTTP_200_OK
+        assert res.json()["username"] == user.username
+
+        queries: List[str] = []
+        for method in ("fetch_one", "fetch_all", "fetch_val", "execute"):
+            original = getattr(db, method)
+
+            async def counting(*args, original=original, **kwargs):
+                queries.append(str(kwargs.get("query", args[0] if args else "")))
+                return await original(*args, **kwargs)
+
+            monkeypatch.setattr(db, method, counting)
+
+        res = await client.get(url, headers=headers)
+        assert res.status_code == HTTP_200_OK
+        assert queries == []
+
+        # 無効化すると次のリクエストで読み直され、無効なユーザーは拒否される
+        user_repo = UsersRepository(db)
+        await user_repo.set_user_active(user_id=user.id, is_active=False)
+        res = await client.get(url, headers=headers)
+        assert res.status_code == HTTP_401_UNAUTHORIZED
+        assert res.json()["detail"] == "Not an active user"
+
+    async def test_shared_cache_does_not_store_password_or_salt(
+        self, client: AsyncClient, db: Database
+    ) -> None:
+        backend = SerializedMemoryCacheBackend(max_entries=10)
+        user_repo = UsersRepository(db, RepositoryCache(backend, ttl=60))
+        user = await self.create_user(db, "principalsecret")
+
+        principal = await user_repo.get_principal(username=user.username, token_id="t")
+        assert principal.id == user.id
+        assert await user_repo.get_user_by_email(email=user.email)
+        assert await user_repo.get_user_by_username(username=user.username)
+
+        stored = [entry[1] for entry in backend._entries.values()]
+        assert len(stored) == 1
+        assert user.username.encode() in stored[0]
+        assert b"password" not in stored[0]
+        assert b"salt" not in stored[0]
+        assert user.password.encode() not in stored[0]
+
+        # キャッシュから読んだ持ち主も、パスワードとソルトを持たない
+        cached_principal = await user_repo.get_principal(
+            username=user.username, token_id="t"
+        )
+        assert cached_principal == principal
+        assert not hasattr(cached_principal, "password")
+
+    async def test_principal_is_not_cached_in_a_per_process_cache(
+        self, app: FastAPI, client: AsyncClient, db: Database, monkeypatch
+    ) -> None:
+        monkeypatch.setattr(repository_cache.backend, "shared", False)
+        user = await self.create_user(db, "principallocal")
+        token = auth_service.create_access_token_for_user(user=user)
+        headers = {"Authorization": f"{JWT_TOKEN_PREFIX} {token}"}
+        url = app.url_path_for("users:get-current-user")
+
+        res = await client.get(url, headers=headers)
+        assert res.status_code == HTTP_200_OK
+
+        # 他のワーカーでの無効化 (このプロセスのキャッシュは無効化されない) もすぐに反映される
+        await db.execute(
+            "UPDATE users SET is_active = FALSE WHERE id = :id", values={"id": user.id}
+        )
+        res = await client.get(url, headers=headers)
+        assert res.status_code == HTTP_401_UNAUTHORIZED
+        assert res.json()["detail"] == "Not an active user"
+
+
+class TestVerifiedTokenCache:
+    def create_token(self, service: AuthService, **kwargs) -> str:
+        user = UserBase(email="tokencache@mail.com", username="tokencache")
+        return service.create_access_token_for_user(
+            user=user, secret_key=str(SECRET_KEY), **kwargs
+        )
+
+    async def test_verified_token_is_not_decoded_again(self, monkeypatch) -> None:
+        service = AuthService(token_cache=VerifiedTokenCache(max_entries=10))
+        token = self.create_token(service)
+        decode_calls = 0
+        original_decode = jwt.decode
+
+        def counting_decode(*args, **kwargs):
+            nonlocal decode_calls
+            decode_calls += 1
+            return original_decode(*args, **kwargs)
+
+        monkeypatch.setattr(jwt, "decode", counting_decode)
+        for _ in range(3):
+            payload = service.get_token_payload(token=token, secret_key=str(SECRET_KEY))
+            assert payload.username == "tokencache"
+        assert decode_calls == 1
+
+        # 別の鍵では検証済みの結果を使わない
+        with pytest.raises(HTTPException):
+            service.get_token_payload(token=token, secret_key="another-secret")
+
+    async def test_entry_is_not_served_after_exp(self) -> None:
+        token_cache = VerifiedTokenCache(max_entries=10)
+        payload = JWTPayload(
+            sub="tokencache@mail.com",
+            username="tokencache",
+            exp=time.time() + 0.05,
+        )
+        token_cache.set(b"digest", payload)
+        assert token_cache.get(b"digest") is payload
+        time.sleep(0.06)
+        assert token_cache.get(b"digest") is None
+        assert len(token_cache) == 0
+
+    async def test_least_recently_used_entry_is_evicted(self) -> None:
+        token_cache = VerifiedTokenCache(max_entries=2)
+        payload = JWTPayload(sub="tokencache@mail.com", username="tokencache")
+        for digest in (b"a", b"b"):
+            token_cache.set(digest, payload)
+        token_cache.get(b"a")
+        token_cache.set(b"c", payload)
+        assert token_cache.get(b"b") is None
+        assert token_cache.get(b"a") is payload
+
+    async def test_revoked_token_is_rejected_even_when_cached(self) -> None:
+        revoked = set()
+        service = AuthService(
+            token_cache=VerifiedTokenCache(max_entries=10),
+            is_token_revoked=lambda payload: payload.jti in revoked,
+        )
+        token = self.create_token(service)
+        payload = service.get_token_payload(token=token, secret_key=str(SECRET_KEY))
+
+        revoked.add(payload.jti)
+        with pytest.raises(HTTPException) as exc_info:
+            service.get_token_payload(token=token, secret_key=str(SECRET_KEY))
+        assert exc_info.value.status_code == HTTP_401_UNAUTHORIZED
+
+
+class TestLoginRateLimit:
+    async def test_bucket_denies_when_empty_and_reports_retry_after(
+        self, client: AsyncClient, db: Database
+    ) -> None:
+        repo = RateLimitsRepository(db)
+        limit = RateLimit(key=f"test:{uuid.uuid4()}", capacity=2, refill_per_second=0.5)
+        other = RateLimit(key=f"test:{uuid.uuid4()}", capacity=2, refill_per_second=0.5)
+
+        assert (await repo.take_tokens(limits=[limit])).allowed
+        assert (await repo.take_tokens(limits=[limit])).allowed
+        result = await repo.take_tokens(limits=[limit, other])
+        assert not result.allowed
+        assert result.denied_keys == [limit.key]
+        assert 0 < result.retry_after <= 2
+
+        # 拒否された試行ではトークンは減らないので、回復すればまた許可される
+        await asyncio.sleep(result.retry_after)
+        assert (await repo.take_tokens(limits=[limit])).allowed
+
+    async def test_denied_attempt_does_not_take_from_other_buckets(
+        self, client: AsyncClient, db: Database
+    ) -> None:
+        repo = RateLimitsRepository(db)
+        empty = RateLimit(
+            key=f"test:{uuid.uuid4()}", capacity=1, refill_per_second=0.01
+        )
+        other = RateLimit(
+            key=f"test:{uuid.uuid4()}", capacity=5, refill_per_second=0.01
+        )
+        assert (await repo.take_tokens(limits=[empty])).allowed
+        assert (await repo.take_tokens(limits=[other])).allowed
+
+        async def tokens(key: str) -> float:
+            return await db.fetch_val(
+                "SELECT tokens FROM rate_limit_buckets WHERE key = :key",
+                values={"key": key},
+            )
+
+        before = await tokens(other.key)
+        for limits in ([empty, other], [other, empty]):
+            result = await repo.take_tokens(limits=limits)
+            assert not result.allowed
+            assert result.denied_keys == [empty.key]
+        assert await tokens(other.key) == before
+
+    async def test_login_attempts_over_limit_receive_429(
+        self, app: FastAPI, client: AsyncClient, monkeypatch
+    ) -> None:
+        monkeypatch.setattr(rate_limit, "LOGIN_RATE_LIMIT_ACCOUNT_BURST", 2)
+        client.headers["content-type"] = "application/x-www-form-urlencoded"
+        login_data = {"username": f"{uuid.uuid4().hex}@mail.com", "password": "nope"}
+
+        for _ in range(2):
+            res = await client.post(
+                app.url_path_for("users:login-email-and-password"), data=login_data
+            )
+            assert res.status_code == HTTP_401_UNAUTHORIZED
+
+        res = await client.post(
+            app.url_path_for("users:login-email-and-password"), data=login_data
+        )
+        assert res.status_code == HTTP_429_TOO_MANY_REQUESTS
+        assert int(res.headers["Retry-After"]) >= 1
+
+
+class TestClientIpResolution:
+    def make_request(self, client_host: str, forwarded_for: Optional[str]) -> Request:
+        headers = []
+        if forwarded_for is not None:
+            headers.append((b"x-forwarded-for", forwarded_for.encode()))
+        return Request(
+            {"type": "http", "client": (client_host, 1234), "headers": headers}
+        )
+
+    @pytest.mark.parametrize(
+        "client_host, forwarded_for, expected",
+        (
+            # プロキシを信頼しなければ、X-Forwarded-For は無視する
+            ("203.0.113.9", "198.51.100.1", "203.0.113.9"),
+            # 信頼するプロキシが付けた右端のアドレスを使い、左側の偽装は使わない
+            ("10.0.0.2", "1.2.3.4, 198.51.100.1", "198.51.100.1"),
+            # 多段のプロキシは信頼するものを飛ばす
+            ("10.0.0.2", "198.51.100.1, 10.0.0.3", "198.51.100.1"),
+            ("10.0.0.2", None, "10.0.0.2"),
+            ("10.0.0.2", "10.0.0.3", "10.0.0.3"),
+        ),
+    )
+    async def test_forwarded_for_is_read_only_from_trusted_proxies(
+        self,
+        monkeypatch,
+        client_host: str,
+        forwarded_for: Optional[str],
+        expected: str,
+    ) -> None:
+        monkeypatch.setattr(
+            rate_limit, "TRUSTED_PROXY_NETWORKS", [ip_network("10.0.0.0/8")]
+        )
+        request = self.make_request(client_host, forwarded_for)
+        assert rate_limit.get_client_ip(request) == expected
+
+
+class TestPasswordRehash:
+    async def test_hash_with_outdated_cost_is_replaced_on_login(
+        self, client: AsyncClient, db: Database
+    ) -> None:
+        email, password, salt = "rehash@mail.com", "rehashpassword", "somesalt"
+        old_hash = bcrypt.hashpw(
+            (password + salt).encode(), bcrypt.gensalt(rounds=4)
+        ).decode()
+        await db.execute(
+            """
+            INSERT INTO users (username, email, password, salt)
+            VALUES ('rehash', :email, :password, :salt)
+            ON CONFLICT (email) DO UPDATE SET password = EXCLUDED.password
+            """,
+            values={"email": email, "password": old_hash, "salt": salt},
+        )
+
+        user_repo = UsersRepository(db)
+        assert await user_repo.authenticate_user(email=email, password="wrong") is None
+        assert (
+            await db.fetch_val(
+                "SELECT password FROM users WHERE email = :email",
+                values={"email": email},
+            )
+            == old_hash
+        )
+
+        user = await user_repo.authenticate_user(email=email, password=password)
+        stored_hash = await db.fetch_val(
+            "SELECT password FROM users WHERE email = :email", values={"email": email}
+        )
+        assert stored_hash.startswith(f"$2b${BCRYPT_ROUNDS:02d}$")
+        assert user.password == stored_hash
+        assert auth_service.verify_password(
+            password=password, salt=salt, hashed_pw=stored_hash
+        )
+        # 作り直した後は同じハッシュのまま使われる
+        await user_repo.authenticate_user(email=email, password=password)
+        assert (
+            await db.fetch_val(
+                "SELECT password FROM users WHERE email = :email",
+                values={"email": email},
+            )
+            == stored_hash
+        )
+
+
+class TestRegistrationRoundTrip:
+    async def test_user_and_profile_are_created_in_one_query(
+        self, app: FastAPI, client: AsyncClient, db: Database, monkeypatch
+    ) -> None:
+        queries: List[str] = []
+        original_fetch_one = db.fetch_one
+
+        async def counting_fetch_one(*args, **kwargs):
+            queries.append(kwargs.get("query", args[0] if args else ""))
+            return await original_fetch_one(*args, **kwargs)
+
+        monkeypatch.setattr(db, "fetch_one", counting_fetch_one)
+        user_repo = UsersRepository(db)
+        created_user = await user_repo.register_new_user(
+            new_user=UserCreate(
+                email="roundtrip@mail.com",
+                username="roundtrip",
+                password="roundtrippassword",
+            )
+        )
+
+        assert len(queries) == 1
+        assert created_user.profile is not None
+        assert created_user.profile.user_id == created_user.id
+        assert created_user.profile.username == "roundtrip"
+        assert (
+            await db.fetch_val(
+                "SELECT count(*) FROM profiles WHERE user_id = :id",
+                values={"id": created_user.id},
+            )
+            == 1
+        )
+
+    @pytest.mark.parametrize(
+        "new_user, detail",
+        (
+            (
+                {"email": "duplicate@mail.com", "username": "notduplicate"},
+                "このメールアドレスはすでに登録されています。",
+            ),
+            (
+                {"email": "notduplicate@mail.com", "username": "duplicate"},
+                "このユーザー名はすでに登録されています。",
+            ),
+        ),
+    )
+    async def test_duplicate_email_and_username_are_told_apart(
+        self, client: AsyncClient, db: Database, new_user: dict, detail: str
+    ) -> None:
+        user_repo = UsersRepository(db)
+        try:
+            await user_repo.register_new_user(
+                new_user=UserCreate(
+                    email="duplicate@mail.com",
+                    username="duplicate",
+                    password="duplicatepassword",
+                )
+            )
+        except HTTPException:
+            pass
+
+        users_before = await db.fetch_val("SELECT count(*) FROM users")
+        with pytest.raises(HTTPException) as exc_info:
+            await user_repo.register_new_user(
+                new_user=UserCreate(**new_user, password="duplicatepassword")
+            )
+        assert exc_info.value.status_code == HTTP_400_BAD_REQUEST
+        assert exc_info.value.detail == detail
+        assert await db.fetch_val("SELECT count(*) FROM users") == users_before
+
+
+class TestUserWithProfileQuery:
+    async def test_populated_user_is_loaded_in_one_query(
+        self, client: AsyncClient, db: Database, monkeypatch
+    ) -> None:
+        registered = await UsersRepository(db).register_new_user(
+            new_user=UserCreate(
+                email="joined@mail.com", username="joined", password="joinedpassword"
+            )
+        )
+        queries: List[str] = []
+        for method in ("fetch_one", "fetch_all"):
+            original = getattr(db, method)
+
+            async def counting(*args, original=original, **kwargs):
+                queries.append(kwargs.get("query", args[0] if args else ""))
+                return await original(*args, **kwargs)
+
+            monkeypatch.setattr(db, method, counting)
+        # キャッシュを使わないリポジトリで問い合わせの回数を数える
+        user_repo = UsersRepository(db, RepositoryCache(NullCacheBackend(), ttl=1))
+
+        user = await user_repo.get_user_by_username(username="joined", populate=True)
+        assert len(queries) == 1
+        assert user.profile is not None
+        assert user.profile.id == registered.profile.id
+        assert user.profile.username == "joined"
+
+        # 認証ではプロフィールを取得しない
+        queries.clear()
+        principal = await user_repo.get_principal(username="joined", token_id=None)
+        assert len(queries) == 1
+        assert not hasattr(principal, "profile")
+
+    async def test_profiles_are_looked_up_by_unique_user_id_index(
+        self, client: AsyncClient, db: Database
+    ) -> None:
+        async with db.transaction(force_rollback=True):
+            await db.execute("SET LOCAL enable_seqscan = off")
+            plan = await db.fetch_all(
+                "EXPLAIN SELECT * FROM profiles WHERE user_id = 1"
+            )
+        assert "ix_profiles_user_id" in "\n".join(row[0] for row in plan)
+        assert await db.fetch_val(
+            "SELECT indisunique FROM pg_index"
+            " WHERE indexrelid = 'ix_profiles_user_id'::regclass"
+        )
+
+
+class TestBatchedUserLookups:
+    async def test_concurrent_lookups_share_one_query(
+        self, client: AsyncClient, db: Database, monkeypatch
+    ) -> None:
+        user_repo = UsersRepository(db)
+        for username in ("batched1", "batched2"):
+            await user_repo.register_new_user(
+                new_user=UserCreate(
+                    email=f"{username}@mail.com",
+                    username=username,
+                    password="batchedpassword",
+                )
+            )
+        queries: List[str] = []
+        original_fetch_all = db.fetch_all
+
+        async def counting_fetch_all(*args, **kwargs):
+            queries.append(kwargs.get("query", args[0] if args else ""))
+            return await original_fetch_all(*args, **kwargs)
+
+        monkeypatch.setattr(db, "fetch_all", counting_fetch_all)
+        user_repo = UsersRepository(db, RepositoryCache(NullCacheBackend(), ttl=1))
+
+        users = await asyncio.gather(
+            user_repo.get_user_by_username(username="batched1"),
+            user_repo.get_user_by_username(username="batched2"),
+            user_repo.get_user_by_username(username="batched1"),
+            user_repo.get_user_by_username(username="nosuchuser"),
+        )
+        assert len(queries) == 1
+        assert [user.username if user else None for user in users] == [
+            "batched1",
+            "batched2",
+            "batched1",
+            None,
+        ]
+
+        queries.clear()
+        profiles = await asyncio.gather(
+            *(
+                user_repo.profile_repo.get_profile_by_user_id(user_id=user.id)
+                for user in users[:2]
+            )
+        )
+        assert len(queries) == 1
+        assert [profile.username for profile in profiles] == ["batched1", "batched2"]
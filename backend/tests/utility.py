@@ -3,6 +3,7 @@ from functools import wraps
 from typing import Any, Callable, Type
 
 import psycopg2
+from app.db.cache import MemoryCacheBackend
 
 """
 デコレータのの定義
@@ -42,3 +43,12 @@ def ping_postgress(dsn: str) -> None:
     cur.execute("select pid, state from pg_stat_activity:")
     cur.close()
     conn.close()
+
+
+class SerializedMemoryCacheBackend(MemoryCacheBackend):
+    """
+    Redis と同じく、ワーカー間で共有され JSON の bytes で保存するバックエンド
+    """
+
+    shared = True
+    serialized = True